@@ -20,15 +20,18 @@ import json
 import logging
 import os
 import re
+import time
 
 import appengine_config
 from lxml import etree
 import mako.lookup
 from models import models as m_models
 from models import transforms
+from modules.xblock_module.xblock_module import cacheable_handler
 from modules.xblock_module.xblock_module import MATHJAX_URI
 import webob
 import xblock.core
+from xblock.fields import List
 from xblock.fields import Scope
 import xblock.fragment
 import xblock.runtime
@@ -109,33 +112,86 @@ class Location(object):
         return self.loc
 
 
-def json_response(handler):
+# Functions called with (block, handler_name, elapsed_sec) after each handler
+HANDLER_TIMING_LISTENERS = []
 
-    @xblock.core.XBlock.handler
-    def wrapper(self, request, unused_suffix=''):
 
-        before = self.get_progress()
+def _log_handler_timing(block, handler_name, elapsed_sec):
+    logging.debug(
+        'Capa handler %s on %s took %.3fs', handler_name,
+        block.scope_ids.usage_id, elapsed_sec)
 
-        result = handler(self, request.POST)
+HANDLER_TIMING_LISTENERS.append(_log_handler_timing)
 
-        after = self.get_progress()
 
-        result.update({
-            'progress_changed': after != before,
-            'progress_status': progress.Progress.to_js_status_str(after),
-            'progress_detail': progress.Progress.to_js_detail_str(after),
-        })
+def _progress_frac(prog):
+    """A JSON serializable value for a Progress, which may be None."""
+    return list(prog.frac()) if prog is not None else []
 
-        # TODO(jorr): Security - use transforms dumps
-        return webob.Response(
-            json.dumps(result, cls=xmodule.capa_base.ComplexEncoder),
-            content_type='application/json')
-    return wrapper
+
+def json_response(changes_progress=True):
+    """Decorator for capa handlers which receive POST data and return a dict.
+
+    Progress is computed once per call, after the handler has run. A handler
+    which can change the student's score compares it with the progress it
+    last reported, which is kept in a field rather than computed again before
+    the handler runs.
+
+    Args:
+        changes_progress: bool. Whether the handler can change the student's
+            score.
+
+    Returns:
+        A decorator which wraps the handler as an XBlock JSON handler.
+    """
+
+    def decorator(handler):
+
+        @xblock.core.XBlock.handler
+        def wrapper(self, request, unused_suffix=''):
+            start = time.time()
+
+            if changes_progress:
+                before = self.reported_progress
+                if before is None:
+                    before = _progress_frac(self.get_progress())
+
+            result = handler(self, request.POST)
+
+            after = self.get_progress()
+            progress_changed = False
+            if changes_progress:
+                after_frac = _progress_frac(after)
+                progress_changed = after_frac != before
+                self.reported_progress = after_frac
+
+            result.update({
+                'progress_changed': progress_changed,
+                'progress_status': progress.Progress.to_js_status_str(after),
+                'progress_detail': progress.Progress.to_js_detail_str(after),
+            })
+
+            # TODO(jorr): Security - use transforms dumps
+            response = webob.Response(
+                json.dumps(result, cls=xmodule.capa_base.ComplexEncoder),
+                content_type='application/json')
+
+            elapsed_sec = time.time() - start
+            for listener in HANDLER_TIMING_LISTENERS:
+                listener(self, handler.__name__, elapsed_sec)
+
+            return response
+        return wrapper
+    return decorator
 
 
 @xblock.core.XBlock.needs('i18n')
 class ProblemBlock(xblock.core.XBlock, xmodule.capa_base.CapaMixin):
 
+    # The progress reported by the last handler which could change it, as
+    # returned by _progress_frac, or None if no such handler has run
+    reported_progress = List(scope=Scope.user_state, default=None)
+
     def __init__(self, runtime, field_data, scope_ids):
         extras = RuntimeExtras(self, runtime)
         runtime = xblock.runtime.ObjectAggregator(extras, runtime)
@@ -241,34 +297,35 @@ class ProblemBlock(xblock.core.XBlock, xmodule.capa_base.CapaMixin):
         frag.add_content(content)
         return frag
 
-    @json_response
+    @cacheable_handler
+    @json_response(changes_progress=False)
     def problem_get(self, data):
         return self.get_problem(data)
 
-    @json_response
+    @json_response()
     def problem_check(self, data):
         return self.check_problem(data)
 
-    @json_response
+    @json_response()
     def problem_reset(self, data):
         return self.reset_problem(data)
 
-    @json_response
+    @json_response(changes_progress=False)
     def problem_save(self, data):
         return self.save_problem(data)
 
-    @json_response
+    @json_response(changes_progress=False)
     def problem_show(self, data):
         return self.get_answer(data)
 
-    @json_response
+    @json_response()
     def score_update(self, data):
         return self.update_score(data)
 
-    @json_response
+    @json_response(changes_progress=False)
     def input_ajax(self, data):
         return self.handle_input_ajax(data)
 
-    @json_response
+    @json_response(changes_progress=False)
     def ungraded_response(self, data):
         return self.handle_ungraded_response(data)
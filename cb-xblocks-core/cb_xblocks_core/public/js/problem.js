@@ -11,6 +11,7 @@ var Logger = {
 var analytics = {
   track: function(msg, data) {
     gcbTagEventAudit && gcbTagEventAudit({
+      type: 'problem',
       event: 'xblock-problem',
       message: msg,
       data: data
@@ -45,7 +46,10 @@ $.postWithPrefix = function() {
   var element = $.postWithPrefix.elementByUsageId[usageId];
   var runtime = $.postWithPrefix.runtime;
   
-  if (method) {
+  if (method && runtime.batchHandlerCall) {
+    // Coalesce calls (e.g., problem_get from each problem on the page)
+    runtime.batchHandlerCall(element, method, data, callback);
+  } else if (method) {
     $.ajax({
       type: 'POST', // XBlock JSON handler must listen on POST
       url: runtime.handlerUrl(element, method),
@@ -0,0 +1,101 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmark of the per-request cost of rendering the app templates.
+
+Run this after scripts/run_example.sh has installed the app, e.g.,
+
+$ PYTHONPATH=examples/app:examples/google_appengine:\
+examples/google_appengine/lib/jinja2-2.6:\
+examples/google_appengine/lib/webapp2-2.5.2:\
+examples/google_appengine/lib/webob-1.2.3:\
+examples/google_appengine/lib/django-1.4 \
+  python scripts/template_benchmark.py --render_count=1000
+
+Each template is rendered first with a new Jinja environment per request, as
+the handlers used to do, and then with the shared environment.
+"""
+
+import argparse
+import time
+
+# The following import is needed in order to add third-party libraries
+# before loading any other modules.
+import appengine_config  # pylint: disable-msg=unused-import
+
+import handlers
+import jinja2
+from xblock.fragment import Fragment
+
+from google.appengine.ext import testbed
+
+
+PARSER = argparse.ArgumentParser()
+PARSER.add_argument(
+    '--render_count', help='Number of renders of each template.',
+    default=500, type=int)
+
+TEMPLATE_VALUES = {
+    'default.html': {'email': 'user@example.com', 'logout_url': '/logout'},
+    'display_xblock.html': {
+        'fragment': Fragment(u'<p>An XBlock</p>'), 'student_id': '1234567890'},
+    'js_wrapper.js': {'env': '{}', 'body': 'var x = 1;\n' * 200},
+    'login_in_popup.html': {'student_id': '1234567890'},
+    'view.html': {'base_url': handlers.BASE_URL, 'usage_id': '12'}}
+
+
+def render_with_new_env(template_name, values):
+    template_env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(handlers.TEMPLATES_PATH),
+        extensions=['jinja2.ext.autoescape'],
+        autoescape=True)
+    return template_env.get_template(template_name).render(values)
+
+
+def render_with_shared_env(template_name, values):
+    return handlers.TEMPLATE_ENV.get_template(template_name).render(values)
+
+
+def renders_per_second(render_fn, template_name, render_count):
+    values = TEMPLATE_VALUES[template_name]
+    start = time.time()
+    for _ in xrange(render_count):
+        render_fn(template_name, values)
+    return render_count / max(time.time() - start, 1e-6)
+
+
+def main():
+    args = PARSER.parse_args()
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_memcache_stub()
+    try:
+        handlers.warm_templates()
+        for template_name in handlers.TEMPLATE_NAMES:
+            try:
+                before = renders_per_second(
+                    render_with_new_env, template_name, args.render_count)
+                after = renders_per_second(
+                    render_with_shared_env, template_name, args.render_count)
+            except jinja2.TemplateError as e:
+                print '%-20s skipped: %s' % (template_name, e)
+                continue
+            print '%-20s before %8.0f renders/s, after %8.0f renders/s' % (
+                template_name, before, after)
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
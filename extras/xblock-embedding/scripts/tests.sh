@@ -0,0 +1,22 @@
+#! /bin/bash
+#
+# author: jorr@google.com (John Orr)
+#
+# This script runs the tests of the sample app.
+#
+
+. scripts/common.sh
+
+install_requirements
+
+GAE_HOME=examples/google_appengine
+
+PYTHONPATH=examples/app:$PYTHONPATH
+PYTHONPATH=$GAE_HOME:$PYTHONPATH
+PYTHONPATH=$GAE_HOME/lib/webob-1.2.3:$PYTHONPATH
+PYTHONPATH=$GAE_HOME/lib/webapp2-2.5.2:$PYTHONPATH
+PYTHONPATH=$GAE_HOME/lib/jinja2-2.6:$PYTHONPATH
+PYTHONPATH=$GAE_HOME/lib/django-1.4:$PYTHONPATH
+export PYTHONPATH
+
+python -m unittest tests.handlers_test
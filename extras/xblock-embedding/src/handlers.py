@@ -17,22 +17,72 @@
 __author__ = 'John Orr (jorr@google.com)'
 
 from cStringIO import StringIO
+import hashlib
 import json
+import logging
 import os
 import urllib
 import appengine_config
+from appengine_xblock_runtime import store
 import appengine_xblock_runtime.runtime
 import django.template.loader
 import jinja2
 import webapp2
 from workbench.runtime import _BlockSet
+import xblock.fields
+import xblock.exceptions
 from xblock.fragment import Fragment
+import xblock.plugin
+import xblock.runtime
+from google.appengine.api import memcache
+from google.appengine.api import datastore_errors
 from google.appengine.api import users
+from google.appengine.ext import ndb
 
 
 BASE_URL = 'http://localhost:8080/'
 JQUERY_URL = 'http://ajax.googleapis.com/ajax/libs/jquery/1.10.2/jquery.min.js'
 
+TEMPLATES_PATH = os.path.join(os.path.dirname(__file__), 'templates')
+# The templates compiled when the app starts
+TEMPLATE_NAMES = [
+    'default.html', 'display_xblock.html', 'js_wrapper.js',
+    'login_in_popup.html', 'view.html']
+# Prefix of the memcache keys holding compiled template bytecode
+TEMPLATE_BYTECODE_CACHE_PREFIX = 'xblock-embedding:jinja2:'
+# Number of seconds for which browsers may reuse wrapped JS files
+JS_WRAPPER_MAX_AGE_SEC = 60 * 60
+
+# The most blocks which may be rendered by a single request to /display_xblocks
+MAX_DISPLAY_XBLOCKS = 20
+
+IS_DEV_SERVER = os.environ.get('SERVER_SOFTWARE', '').startswith('Development')
+
+
+def create_template_env():
+    """Create a Jinja environment for the app templates.
+
+    The compiled bytecode of the templates is shared between instances through
+    memcache. Template files are only checked for changes on the dev server.
+    """
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(TEMPLATES_PATH),
+        extensions=['jinja2.ext.autoescape'],
+        autoescape=True,
+        auto_reload=IS_DEV_SERVER,
+        bytecode_cache=jinja2.MemcachedBytecodeCache(
+            memcache, prefix=TEMPLATE_BYTECODE_CACHE_PREFIX))
+
+
+# Shared by all requests, so that each template is compiled once per instance
+TEMPLATE_ENV = create_template_env()
+
+
+def warm_templates():
+    """Compile all the templates, so that requests need not do so."""
+    for template_name in TEMPLATE_NAMES:
+        TEMPLATE_ENV.get_template(template_name)
+
 
 class WorkbenchRuntime(appengine_xblock_runtime.runtime.Runtime):
     """A XBlock runtime which uses the App Engine datastore."""
@@ -70,6 +120,50 @@ class WorkbenchRuntime(appengine_xblock_runtime.runtime.Runtime):
     def query(self, block):
         return _BlockSet(self, [block])
 
+    def prefetch_blocks(self, usage_ids):
+        """Load the stored fields of a list of blocks in a few batches.
+
+        The usages, their definitions and then their fields are each read with
+        a single datastore call, and held in the NDB context cache so that
+        get_block and render need not make further round trips. Blocks which
+        cannot be resolved are skipped, and left for get_block to report.
+        """
+        usages = ndb.get_multi([
+            ndb.Key(store.UsageEntity, usage_id) for usage_id in usage_ids])
+        usages = [
+            (usage_id, usage) for usage_id, usage in zip(usage_ids, usages)
+            if usage is not None]
+        definitions = ndb.get_multi([
+            ndb.Key(store.DefinitionEntity, usage.definition_id)
+            for _, usage in usages])
+
+        keys = []
+        for (usage_id, usage), definition in zip(usages, definitions):
+            if definition is None:
+                continue
+            try:
+                xblock_class = self.load_block_type(definition.block_type)
+            except xblock.plugin.PluginMissingError:
+                continue
+            block_scope_ids = {
+                xblock.fields.BlockScope.USAGE: usage_id,
+                xblock.fields.BlockScope.DEFINITION: usage.definition_id,
+                xblock.fields.BlockScope.TYPE: definition.block_type,
+                xblock.fields.BlockScope.ALL: None}
+            for field in xblock_class.fields.itervalues():
+                if field.scope.user == xblock.fields.UserScope.ONE:
+                    user_id = self.user_id
+                else:
+                    user_id = None
+                keys.append(ndb.Key(
+                    store.KeyValueEntity,
+                    store.key_string(xblock.runtime.KeyValueStore.Key(
+                        scope=field.scope,
+                        user_id=user_id,
+                        block_scope_id=block_scope_ids[field.scope.block],
+                        field_name=field.name))))
+        ndb.get_multi(keys)
+
     def resources_url(self, resource):
         return '/static/%s' % resource
 
@@ -100,11 +194,7 @@ class BasePageHandler(webapp2.RequestHandler):
 
     def __init__(self, *args, **kwargs):
         super(BasePageHandler, self).__init__(*args, **kwargs)
-        self.template_env = jinja2.Environment(
-            loader=jinja2.FileSystemLoader(
-                os.path.join(os.path.dirname(__file__), 'templates')),
-            extensions=['jinja2.ext.autoescape'],
-            autoescape=True)
+        self.template_env = TEMPLATE_ENV
 
 
 class DefaultPageHandler(BasePageHandler):
@@ -129,15 +219,19 @@ class ViewXblockPageHandler(BasePageHandler):
 
 
 class JsWrapperHandler(BasePageHandler):
-    def get(self, path):
+    """Serve JS files wrapped with the environment of the current session.
+
+    The wrapped output of each variant of a file is built once per instance and
+    served with an ETag, so that repeat requests need neither disk reads nor
+    rendering, and browsers holding the current version get a 304.
+    """
 
-        if path.startswith('/'):
-            path = path[1:]
-        path = os.path.normpath(path)
-        resource_file = os.path.join(appengine_config.BUNDLE_ROOT, 'js', path)
+    # Maps (path, in_session) to (etag, wrapped JS)
+    _cache = {}
 
+    def _wrap(self, resource_file, in_session):
         env = {
-            'IN_SESSION': (users.get_current_user() is not None),
+            'IN_SESSION': in_session,
             'BASE_URL': BASE_URL,
             'JQUERY_URL': JQUERY_URL}
 
@@ -146,8 +240,43 @@ class JsWrapperHandler(BasePageHandler):
             'body': open(resource_file).read()
         }
         template = self.template_env.get_template('js_wrapper.js')
+        body = template.render(template_values).encode('utf-8')
+        return hashlib.sha1(body).hexdigest(), body
+
+    def get(self, path):
+        js_root = os.path.abspath(
+            os.path.join(appengine_config.BUNDLE_ROOT, 'js'))
+        resource_file = os.path.abspath(
+            os.path.join(js_root, path.lstrip('/')))
+        if not resource_file.startswith(js_root + os.sep):
+            self.error(404)
+            return
+
+        in_session = users.get_current_user() is not None
+        key = (resource_file, in_session)
+        cached = self._cache.get(key)
+        if cached is None:
+            try:
+                cached = self._wrap(resource_file, in_session)
+            except IOError:
+                self.error(404)
+                return
+            if not IS_DEV_SERVER:
+                self._cache[key] = cached
+        etag, body = cached
+
+        # The output depends on the login state, so it may not be shared
+        self.response.headers['Vary'] = 'Cookie'
+        self.response.cache_control.private = True
+        self.response.cache_control.max_age = JS_WRAPPER_MAX_AGE_SEC
+        self.response.etag = etag
+
+        if etag in getattr(self.request.if_none_match, 'etags', ()):
+            self.response.status = 304
+            return
+
         self.response.headers['Content-Type'] = 'text/javascript'
-        self.response.write(template.render(template_values))
+        self.response.write(body)
 
 
 class LoginInPopupPageHandler(BasePageHandler):
@@ -175,6 +304,59 @@ class DisplayXblockPageHandler(BasePageHandler):
         self.response.write(template.render(template_values))
 
 
+class DisplayXblocksHandler(webapp2.RequestHandler):
+    """Render several XBlocks, with usage ids passed in the query parameters.
+
+    Responds with JSON holding the body of each block, in the order requested,
+    and the head and foot resources of all the blocks, with duplicates removed.
+    A page embedding several blocks thus needs only one request. Each block has
+    a status of 200, or of 404 if its usage id is unknown or malformed, in
+    which case it has no body; the other blocks are still rendered.
+    """
+
+    def get(self):
+        usage_ids = self.request.get_all('usage_id')
+        if not usage_ids or len(usage_ids) > MAX_DISPLAY_XBLOCKS:
+            self.error(400)
+            return
+        student_id = users.get_current_user().user_id()
+
+        rt = WorkbenchRuntime(student_id=student_id)
+        try:
+            rt.prefetch_blocks(usage_ids)
+        except datastore_errors.Error:
+            # A malformed usage id fails the whole batch. Prefetching is only an
+            # optimization, so the blocks are still read one at a time below.
+            logging.warning('Could not prefetch XBlocks %s', usage_ids)
+
+        resources = Fragment()
+        blocks = []
+        for usage_id in usage_ids:
+            try:
+                block = rt.get_block(usage_id)
+            except (
+                    xblock.exceptions.NoSuchUsage,
+                    xblock.plugin.PluginMissingError,
+                    datastore_errors.Error):
+                blocks.append({'usage_id': usage_id, 'status': 404})
+                continue
+            fragment = rt.render(block, 'student_view')
+            for resource in fragment.resources:
+                if resource not in resources.resources:
+                    resources.resources.append(resource)
+            blocks.append({
+                'usage_id': usage_id,
+                'status': 200,
+                'body': fragment.body_html()})
+
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'student_id': student_id,
+            'head': resources.head_html(),
+            'foot': resources.foot_html(),
+            'blocks': blocks}))
+
+
 class XblockRestHandler(webapp2.RequestHandler):
     """A REST handler to store and retrieve XBlock XML definitions."""
 
@@ -34,6 +34,8 @@ if not django.conf.settings.configured:
     django.conf.settings.configure(
         TEMPLATE_DIRS=[XBLOCK_TEMPLATES_PATH])
 
+handlers.warm_templates()
+
 view_app = webapp2.WSGIApplication([
     ('/js/(.*)', handlers.JsWrapperHandler),
     ('/view', handlers.ViewXblockPageHandler),
@@ -43,6 +45,7 @@ app = webapp2.WSGIApplication([
     ('/handler/(\d*)/(.*)/', handlers.XBlockEndpointHandler),
     ('/login_in_popup', handlers.LoginInPopupPageHandler),
     ('/display_xblock', handlers.DisplayXblockPageHandler),
+    ('/display_xblocks', handlers.DisplayXblocksHandler),
     ('/rest/xblock', handlers.XblockRestHandler),
     ('/rest/xblock/(\d*)', handlers.XblockRestHandler),
     ('/.*', handlers.DefaultPageHandler),
@@ -0,0 +1,82 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the HTTP handlers of the example server.
+
+Run these with scripts/tests.sh, which installs the app first.
+"""
+
+import json
+import os
+import unittest
+
+# The following import is needed in order to add third-party libraries
+# before loading any other modules.
+import appengine_config  # pylint: disable-msg=unused-import
+
+import main
+import webapp2
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+
+class DisplayXblocksHandlerTest(unittest.TestCase):
+    """Tests for the handler rendering several XBlocks in one request."""
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_user_stub()
+        os.environ['USER_EMAIL'] = 'user@example.com'
+        os.environ['USER_ID'] = '1234567890'
+        ndb.get_context().clear_cache()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _get_blocks(self, usage_ids):
+        request = webapp2.Request.blank('/display_xblocks?%s' % '&'.join(
+            'usage_id=%s' % usage_id for usage_id in usage_ids))
+        response = request.get_response(main.app)
+        self.assertEqual(200, response.status_int)
+        return json.loads(response.body)['blocks']
+
+    def test_blocks_are_rendered_in_order(self):
+        rt = main.handlers.WorkbenchRuntime()
+        usage_ids = [
+            str(rt.parse_xml_string('<thumbs/>')) for _ in xrange(2)]
+
+        blocks = self._get_blocks(usage_ids)
+        self.assertEqual(usage_ids, [block['usage_id'] for block in blocks])
+        self.assertEqual([200, 200], [block['status'] for block in blocks])
+        self.assertTrue(all(block['body'] for block in blocks))
+
+    def test_unknown_and_malformed_usage_ids_fail_per_block(self):
+        rt = main.handlers.WorkbenchRuntime()
+        usage_id = str(rt.parse_xml_string('<thumbs/>'))
+
+        blocks = self._get_blocks([usage_id, '999999', 'x' * 1000])
+        self.assertEqual(
+            [usage_id, '999999', 'x' * 1000],
+            [block['usage_id'] for block in blocks])
+        self.assertEqual([200, 404, 404], [block['status'] for block in blocks])
+        self.assertTrue(blocks[0]['body'])
+        self.assertNotIn('body', blocks[1])
+        self.assertNotIn('body', blocks[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -31,7 +31,10 @@ class UsageEntity(entities.BaseEntity):
 
 
 class KeyValueEntity(entities.BaseEntity):
-    _BLOCK_ID_RE = re.compile('^[0-9a-zA-Z]{32}$')
+    # Matches "scope.block_id.field" and "scope.block_id.user_id.field"
+    _KEY_NAME_RE = re.compile(
+        r'^(?:children|parent|usage|definition|type|all)\.[0-9a-zA-Z]{32}\.'
+        r'(?:([^.]*)\.)?[^.]*$')
 
     data = db.TextProperty(indexed=False)
 
@@ -39,23 +42,38 @@ class KeyValueEntity(entities.BaseEntity):
     def safe_key(cls, db_key, transform_fn):
         """Creates a copy of db_key that is safe for export."""
 
-        key_list = db_key.name().split('.')
-
-        assert len(key_list) in {3, 4}
-        assert key_list[0] in {
-            'children', 'parent', 'usage', 'definition', 'type', 'all'}
-        assert cls._BLOCK_ID_RE.match(key_list[1])
+        key_name = db_key.name()
+        match = cls._KEY_NAME_RE.match(key_name)
+        assert match
 
         # If the key is 4 components, then the third component will be a user
         # id string which must be transformed.
-        if len(key_list) == 4:
-            key_list[2] = transform_fn(key_list[2])
+        if match.group(1) is not None:
+            key_name = '%s%s%s' % (
+                key_name[:match.start(1)], transform_fn(match.group(1)),
+                key_name[match.end(1):])
+
+        return db.Key.from_path(cls.kind(), key_name)
+
+    @classmethod
+    def get_packed_key_name(cls, key_name):
+        """The key name of the PackedKeyValueEntity holding a student field.
 
-        return db.Key.from_path(cls.kind(), '.'.join(key_list))
+        Args:
+            key_name: str. The key name of a KeyValueEntity.
+
+        Returns:
+            str. The key name without its field name component, or None if the
+            key does not hold a field in student scope.
+        """
+        match = cls._KEY_NAME_RE.match(key_name)
+        if match is None or match.group(1) is None:
+            return None
+        return key_name[:key_name.rindex('.')]
 
     def for_export(self, transform_fn):
         model = super(KeyValueEntity, self).for_export(transform_fn)
-        key_len = len(model.safe_key.name().split('.'))
+        key_len = model.safe_key.name().count('.') + 1
         assert key_len in {3, 4}
 
         # If the key is 4 components, then the data is in student scope and
@@ -64,3 +82,51 @@ class KeyValueEntity(entities.BaseEntity):
             model.data = transform_fn(model.data)
 
         return model
+
+
+class PackedKeyValueEntity(entities.BaseEntity):
+    """All the fields in student scope of one block, for one student.
+
+    The key name is "scope.block_id.user_id", and the data is a JSON object
+    mapping field names to values.
+
+    Note: xblock_module.PackedKeyValueEntity is the ndb model of the same kind,
+    used by the XBlock runtime. Keep the two in step.
+    """
+    _KEY_NAME_RE = re.compile(
+        r'^(?:children|parent|usage|definition|type|all)\.[0-9a-zA-Z]{32}\.'
+        r'([^.]*)$')
+
+    data = db.TextProperty(indexed=False)
+
+    @classmethod
+    def safe_key(cls, db_key, transform_fn):
+        """Creates a copy of db_key that is safe for export."""
+
+        key_name = db_key.name()
+        match = cls._KEY_NAME_RE.match(key_name)
+        assert match
+
+        key_name = '%s%s' % (
+            key_name[:match.start(1)], transform_fn(match.group(1)))
+
+        return db.Key.from_path(cls.kind(), key_name)
+
+    def for_export(self, transform_fn):
+        model = super(PackedKeyValueEntity, self).for_export(transform_fn)
+
+        # All the fields are in student scope, so the data must be transformed
+        model.data = transform_fn(model.data)
+
+        return model
+
+
+class XmlExportEntity(entities.BaseEntity):
+    """The cached XML export of the tree of XBlocks under a usage.
+
+    Note: xblock_module.XmlExportEntity is the ndb model of the same kind,
+    used by the XBlock runtime. Keep the two in step.
+    """
+    generation = db.IntegerProperty(indexed=False)
+    content_version = db.StringProperty(indexed=False)
+    compressed_xml = db.BlobProperty()
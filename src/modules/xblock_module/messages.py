@@ -27,7 +27,33 @@ XBLOCK_INSTANCE = 'XBlock instance'
 
 XBLOCK_DESCRIPTION_FIELD = 'Shown when selecting the XBlock'
 
+XBLOCK_LIST_INDEXING = (
+    'The list of XBlocks is being indexed and may be incomplete until this is '
+    'finished.')
+
 IMPORT_COURSE_PAGE_TITLE = 'Import XBlock Course'
 IMPORT_COURSE_PAGE_DESCRIPTION = 'Import an XBlock course into Course Builder'
 XBLOCK_ARCHIVE_FIELD = 'A tar.gz file containing an exported XBlock course'
 XBLOCK_ARCHIVE_DRY_RUN = 'Validate the archive but do not install it'
+XBLOCK_ARCHIVE_VALIDATE_ONLY = (
+    'Quickly check the archive structure without building the XBlocks')
+
+EXPORT_COURSE_PAGE_TITLE = 'Export XBlock Course'
+EXPORT_COURSE_PAGE_DESCRIPTION = (
+    'Export the course as an XBlock archive which can be imported into another '
+    'course')
+
+GARBAGE_COLLECTION_PAGE_TITLE = 'Clean Up XBlock Data'
+GARBAGE_COLLECTION_PAGE_DESCRIPTION = (
+    'Delete the XBlocks which are no longer used by any lesson or XBlock '
+    'listed in the course, together with their student data')
+GARBAGE_COLLECTION_DRY_RUN = (
+    'Count the unused XBlock data but do not delete it')
+GARBAGE_COLLECTION_IN_PROGRESS = (
+    'XBlocks cannot be changed while unused XBlock data is being cleaned up. '
+    'Please try again later.')
+
+PACKED_FIELD_MIGRATION_PAGE_TITLE = 'Pack XBlock Student Data'
+PACKED_FIELD_MIGRATION_PAGE_DESCRIPTION = (
+    'Move the student data saved before packed field storage was enabled into '
+    'the packed layout, so that it is read in fewer datastore calls')
@@ -4,3 +4,102 @@ RuntimeProvider.versions[1].handlerUrl = function(block, handler_name) {
     "&handler=" + handler_name +
     "&xsrf_token=" + $(block).data('xsrf-token');
 };
+
+/**
+ * Call a handler on a block. Calls made in the same tick are coalesced and
+ * sent to the server in a single batch request.
+ *
+ * @param block the element of the block
+ * @param handler_name the name of the handler to call
+ * @param data the POST data, either a string or an object to be url-encoded
+ * @param success called with the response data if the call succeeds
+ * @param error (optional) called if the call fails
+ */
+RuntimeProvider.versions[1].batchHandlerCall = (function() {
+  var BATCH_HANDLER_URL = "modules/xblock_module/batch_handler";
+  // Must not exceed MAX_BATCH_HANDLER_CALLS in xblock_module.py
+  var MAX_BATCH_SIZE = 20;
+  var pendingCalls = [];
+  // The last responses of cacheable handlers, revalidated using their ETags
+  var cachedResponses = {};
+
+  function cacheKey(request) {
+    return [request.usage, request.handler, request.body].join(' ');
+  }
+
+  function parseBody(response) {
+    if (response.content_type &&
+        response.content_type.indexOf('json') != -1) {
+      return $.parseJSON(response.body);
+    }
+    return response.body;
+  }
+
+  function onResponse(call, response) {
+    var key = cacheKey(call.request);
+    if (response && response.status == 304 && cachedResponses[key]) {
+      response = cachedResponses[key];
+    } else if (response && response.etag) {
+      cachedResponses[key] = response;
+    }
+    if (response && response.status < 400) {
+      call.success && call.success(parseBody(response));
+    } else {
+      call.error && call.error();
+    }
+  }
+
+  function sendBatch(calls) {
+    $.ajax({
+      type: "POST",
+      url: BATCH_HANDLER_URL + "?xsrf_token=" +
+          encodeURIComponent(calls[0].xsrfToken),
+      data: JSON.stringify({
+        calls: $.map(calls, function(call) {
+          return call.request;
+        })
+      }),
+      contentType: "application/json",
+      dataType: "json",
+      success: function(responses) {
+        $.each(calls, function(i, call) {
+          onResponse(call, responses[i]);
+        });
+      },
+      error: function() {
+        $.each(calls, function(i, call) {
+          onResponse(call, null);
+        });
+      }
+    });
+  }
+
+  function flush() {
+    var calls = pendingCalls;
+    pendingCalls = [];
+    for (var i = 0; i < calls.length; i += MAX_BATCH_SIZE) {
+      sendBatch(calls.slice(i, i + MAX_BATCH_SIZE));
+    }
+  }
+
+  return function(block, handler_name, data, success, error) {
+    if (pendingCalls.length == 0) {
+      setTimeout(flush, 0);
+    }
+    var request = {
+      usage: $(block).data('usage'),
+      handler: handler_name,
+      body: typeof data == 'string' ? data : $.param(data || {})
+    };
+    var cached = cachedResponses[cacheKey(request)];
+    if (cached) {
+      request.if_none_match = cached.etag;
+    }
+    pendingCalls.push({
+      xsrfToken: $(block).data('xsrf-token'),
+      request: request,
+      success: success,
+      error: error
+    });
+  };
+})();
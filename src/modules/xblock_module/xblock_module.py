@@ -26,15 +26,22 @@ lib/ folder.  See README.rst for more details.
 __author__ = 'John Orr (jorr@google.com)'
 
 import cgi
+import collections
 from cStringIO import StringIO
+import gzip
+import hashlib
+import itertools
 import logging
 import mimetypes
 import os
+import random
 import re
 import tarfile
+import time
 import urllib
 import uuid
 from xml.etree import cElementTree
+import zlib
 
 import appengine_config
 from appengine_xblock_runtime import store
@@ -50,10 +57,13 @@ import django.conf
 import django.template.loader
 from lxml import etree
 import messages
+from models import config
+from models import counters
 from models import courses
 from models import custom_modules
 from models import jobs
 from models import transforms
+from models import verify
 import models.models as m_models
 from modules.dashboard import filer
 from modules.dashboard import unit_lesson_editor
@@ -69,9 +79,13 @@ import xblock.fragment
 import xblock.plugin
 import xblock.runtime
 
+from google.appengine.api import files
+from google.appengine.api import namespace_manager
 from google.appengine.ext import blobstore
 from google.appengine.ext import db
+from google.appengine.ext import deferred
 from google.appengine.ext import ndb
+from google.appengine.ext.ndb import eventloop
 
 
 # URI routing for resources belonging to this module
@@ -82,11 +96,53 @@ XBLOCK_RESOURCES_URI = '/modules/xblock_module/xblock_resources'
 XBLOCK_LOCAL_RESOURCES_URI = '/modules/xblock_module/xblock_local_resources'
 # URI routing used by Course Builder for call-backs to server-side XBlock code
 HANDLER_URI = '/modules/xblock_module/handler'
+# URI routing used for batches of call-backs to server-side XBlock code
+BATCH_HANDLER_URI = '/modules/xblock_module/batch_handler'
 # URI routing the the MathJax package
 MATHJAX_URI = '/modules/xblock_module/MathJax'
 
 # Allow images of up to 5Mb
 MAX_ASSET_UPLOAD_SIZE_K = 5 * 1024
+# Deepest element nesting accepted in an imported course. The assembled course
+# is walked iteratively, but serializing each lesson and building its XBlocks
+# recurse once per level.
+MAX_IMPORT_XML_DEPTH = 100
+# Number of static files sent to the file system in each upload batch
+STATIC_FILE_UPLOAD_BATCH_SIZE = 20
+# Maximum number of static file upload batches in flight at the same time
+STATIC_FILE_UPLOAD_MAX_PENDING_BATCHES = 4
+# Maximum number of entities read or written in a single datastore call
+DATASTORE_BATCH_SIZE = 500
+# Number of keys swept in each task of the garbage collector
+GC_SWEEP_BATCH_SIZE = 100
+# Delay between the tasks of the garbage collector, to limit its load
+GC_SWEEP_DELAY_SEC = 1
+# Key id of the entity holding the progress of the garbage collector
+GC_STATE_ID = 'xblock_garbage_collection'
+# Size of the chunks in which an exported archive is written to the blobstore
+EXPORT_WRITE_BUFFER_SIZE = 512 * 1024
+# Number of static files written to an exported archive in each task
+EXPORT_STATIC_FILE_BATCH_SIZE = 20
+# Key id of the entity holding the progress of the course export
+EXPORT_STATE_ID = 'xblock_export'
+# Name of the top-level folder in an exported archive
+EXPORT_BASE_FOLDER = 'course'
+# Number of root usages listed on each page of the dashboard assets view
+XBLOCK_LIST_PAGE_SIZE = 50
+# Number of characters of the description used to sort root usages
+DESCRIPTION_SORT_KEY_LENGTH = 200
+# Memcache key for the version of the list of root usages in a course
+ROOT_USAGE_LIST_VERSION_KEY = 'xblock_module:root_usage_list_version'
+# Version of the XML export format. Cached exports of other versions are ignored
+XML_EXPORT_GENERATION = 2
+# Key id of the entity holding the version of the XBlock content of a course
+XBLOCK_CONTENT_VERSION_ID = 'xblock_content'
+# Number of XBlock events written to the datastore in each batch
+EVENT_WRITE_BATCH_SIZE = 20
+# Maximum number of handler calls accepted in a single batch request
+MAX_BATCH_HANDLER_CALLS = 20
+# Maximum number of unwritten XBlock events held by a runtime
+MAX_BUFFERED_EVENTS = 200
 
 # The location of the static workbench files used by the XBlocks
 WORKBENCH_STATIC_PATH = os.path.normpath('lib/XBlock/workbench/static')
@@ -98,6 +154,17 @@ XBLOCK_XSRF_TOKEN_NAME = 'xblock_handler'
 XBLOCK_EVENT_SOURCE_NAME = 'xblock-event'
 XBLOCK_TAG_EVENT_SOURCE_NAME = 'tag-xblock-event'
 
+XBLOCK_EVENTS_DROPPED = counters.PerfCounter(
+    'gcb-xblock-events-dropped',
+    'The number of XBlock events dropped because the event buffer was full.')
+XBLOCK_EVENTS_SAMPLED_OUT = counters.PerfCounter(
+    'gcb-xblock-events-sampled-out',
+    'The number of XBlock events not recorded because of event sampling.')
+XBLOCK_EVENTS_RATE_LIMITED = counters.PerfCounter(
+    'gcb-xblock-events-rate-limited',
+    'The number of XBlock events not recorded because a user exceeded the '
+    'event rate limit.')
+
 XBLOCK_WHITELIST = [
     'sequential = cb_xblocks_core.cb_xblocks_core:SequenceBlock',
     'video = cb_xblocks_core.cb_xblocks_core:VideoBlock',
@@ -107,6 +174,16 @@ XBLOCK_WHITELIST = [
     'problem = cb_xblocks_core.problem:ProblemBlock'
 ]
 
+XBLOCK_PACKED_FIELD_STORAGE = config.ConfigProperty(
+    'gcb_xblock_packed_field_storage', bool, (
+        'Whether to store all the student fields of each XBlock together in a '
+        'single entity per student, rather than one entity per field. Student '
+        'fields saved before this is enabled are moved to the new layout when '
+        'they are first written, or by running "Pack Student Data" from the '
+        'XBlock list of each course. Once enabled, this must not be disabled '
+        'again, or student data saved since it was enabled will be hidden.'),
+    default_value=False)
+
 # XBlock runtime section
 
 
@@ -135,6 +212,268 @@ class StudentFieldData(xblock.field_data.SplitFieldData):
             xblock.fields.Scope.preferences: student_data})
 
 
+class AuthorFieldData(xblock.field_data.SplitFieldData):
+    """A field data manager for use in admin context.
+
+    Writes of fields stored as UserScope.NONE start a new content version, so
+    that the cached XML exports made before the write are no longer used. See
+    XmlExportEntity.
+    """
+
+    def __init__(self, db_data):
+
+        authored_data = _VersionedFieldData(db_data)
+        student_data = db_data
+
+        super(AuthorFieldData, self).__init__({
+            xblock.fields.Scope.content: authored_data,
+            xblock.fields.Scope.settings: authored_data,
+            xblock.fields.Scope.parent: authored_data,
+            xblock.fields.Scope.children: authored_data,
+            xblock.fields.Scope.user_state_summary: student_data,
+            xblock.fields.Scope.user_state: student_data,
+            xblock.fields.Scope.user_info: student_data,
+            xblock.fields.Scope.preferences: student_data})
+
+
+class _VersionedFieldData(xblock.field_data.FieldData):
+    """Field data which starts a new content version after every write."""
+
+    def __init__(self, field_data):
+        self._field_data = field_data
+
+    def get(self, block, name):
+        return self._field_data.get(block, name)
+
+    def has(self, block, name):
+        return self._field_data.has(block, name)
+
+    def default(self, block, name):
+        return self._field_data.default(block, name)
+
+    def set(self, block, name, value):
+        self.set_many(block, {name: value})
+
+    def set_many(self, block, update_dict):
+        self._field_data.set_many(block, update_dict)
+        _new_content_version()
+
+    def delete(self, block, name):
+        self._field_data.delete(block, name)
+        _new_content_version()
+
+
+class PackedKeyValueEntity(ndb.Model):
+    """All the fields in student scope of one block, for one student.
+
+    The key id is the key name of the fields' KeyValueEntity's, without the
+    field name. See dbmodels.KeyValueEntity.get_packed_key_name.
+
+    Note: dbmodels.PackedKeyValueEntity is the db model of the same kind, used
+    for ETL export. Keep the two in step.
+    """
+    data = ndb.TextProperty()
+
+    @property
+    def fields(self):
+        return transforms.loads(self.data) if self.data else {}
+
+
+def _get_unpacked_student_fields(packed_key_name):
+    """Read the student fields of a block kept in the default layout."""
+    return _get_unpacked_student_fields_async(packed_key_name).get_result()
+
+
+@ndb.tasklet
+def _get_unpacked_student_fields_async(packed_key_name):
+    """Tasklet reading the student fields of a block kept in the default layout.
+
+    The names of the fields are taken from the class of the block, so that the
+    KeyValueEntity's can be read by key. Unlike a query, this always sees the
+    latest writes.
+
+    Args:
+        packed_key_name: str. The key name of the PackedKeyValueEntity which
+            would hold the fields.
+
+    Returns:
+        dict. Maps field names to the values of the KeyValueEntity's.
+    """
+    block_scope_name, block_id, user_id = packed_key_name.split('.')
+    if block_scope_name == 'usage':
+        block_ids = yield _get_block_ids_async(block_id)
+        if block_ids is None:
+            raise ndb.Return({})
+        def_id, block_type = block_ids
+        block_scope_ids = {
+            xblock.fields.BlockScope.USAGE: block_id,
+            xblock.fields.BlockScope.DEFINITION: def_id}
+    else:
+        definition = yield ndb.Key(
+            store.DefinitionEntity, block_id).get_async()
+        if definition is None:
+            raise ndb.Return({})
+        block_type = definition.block_type
+        block_scope_ids = {xblock.fields.BlockScope.DEFINITION: block_id}
+
+    try:
+        xblock_class = xblock.core.XBlock.load_class(
+            block_type, None, select_xblock)
+    except (ForbiddenXBlockError, xblock.plugin.PluginMissingError):
+        raise ndb.Return({})
+
+    keys = []
+    for field in xblock_class.fields.itervalues():
+        if field.scope.block not in block_scope_ids:
+            continue
+        key_name = _get_field_key_name(field, block_scope_ids, user_id)
+        if dbmodels.KeyValueEntity.get_packed_key_name(
+                key_name) == packed_key_name:
+            keys.append(ndb.Key(store.KeyValueEntity, key_name))
+
+    entities = yield ndb.get_multi_async(keys)
+    raise ndb.Return(dict(
+        (field_key.id()[len(packed_key_name) + 1:], entity.value)
+        for field_key, entity in zip(keys, entities) if entity is not None))
+
+
+def _get_field_key_name(field, block_scope_ids, user_id):
+    """The key name of the KeyValueEntity holding a field of a block.
+
+    Args:
+        field: xblock.fields.Field. The field.
+        block_scope_ids: dict. Maps the block scopes to the ids of the block
+            in each scope.
+        user_id: str. The id of the user, used for fields in user scope.
+    """
+    if field.scope.user != xblock.fields.UserScope.ONE:
+        user_id = None
+    return store.key_string(xblock.runtime.KeyValueStore.Key(
+        scope=field.scope,
+        user_id=user_id,
+        block_scope_id=block_scope_ids[field.scope.block],
+        field_name=field.name))
+
+
+class PackedKeyValueStore(xblock.runtime.KeyValueStore):
+    """A key-value store which packs the student fields of each block.
+
+    The fields in student scope of a block are kept in a single
+    PackedKeyValueEntity per student, so that reading or saving a block's
+    student state takes one datastore call rather than one per field. All
+    other fields are kept in the default KeyValueEntity layout.
+
+    Student fields saved before packed storage was enabled are still in the
+    default layout. While a block has no PackedKeyValueEntity for a student,
+    its fields are read from there, and they are merged into the
+    PackedKeyValueEntity when it is first written. Once it exists, the
+    PackedKeyValueEntity alone holds the student's state for the block.
+    """
+
+    def __init__(self):
+        self._unpacked_store = store.KeyValueStore()
+        # Maps packed key names to the dicts of fields read or written
+        self._packed_fields = {}
+
+    def _get_packed_fields(self, packed_key_name):
+        if packed_key_name not in self._packed_fields:
+            entity = ndb.Key(PackedKeyValueEntity, packed_key_name).get()
+            if entity is None:
+                fields = _get_unpacked_student_fields(packed_key_name)
+            else:
+                fields = entity.fields
+            self._packed_fields[packed_key_name] = fields
+        return self._packed_fields[packed_key_name]
+
+    def _update_packed_fields(self, changes):
+        """Transactionally apply changes to PackedKeyValueEntity's.
+
+        Args:
+            changes: dict. Maps packed key names to pairs (updates, deletes),
+                where updates is a dict of new field values and deletes is a
+                list of the names of fields to delete.
+        """
+        keys = [
+            ndb.Key(PackedKeyValueEntity, packed_key_name)
+            for packed_key_name in changes]
+        # The default layout is no longer written, so the fields to merge into
+        # new entities can be read before the transaction
+        unpacked_futures = dict(
+            (key.id(), _get_unpacked_student_fields_async(key.id()))
+            for key, entity in zip(keys, ndb.get_multi(keys))
+            if entity is None)
+        unpacked_fields = dict(
+            (packed_key_name, future.get_result())
+            for packed_key_name, future in unpacked_futures.iteritems())
+
+        def update():
+            packed_fields = {}
+            entities = []
+            for key, entity in zip(keys, ndb.get_multi(keys)):
+                updates, deletes = changes[key.id()]
+                if entity is None:
+                    fields = dict(unpacked_fields.get(key.id(), {}))
+                else:
+                    fields = entity.fields
+                fields.update(updates)
+                for field_name in deletes:
+                    fields.pop(field_name, None)
+                packed_fields[key.id()] = fields
+                entities.append(PackedKeyValueEntity(
+                    key=key, data=transforms.dumps(fields)))
+            ndb.put_multi(entities)
+            return packed_fields
+
+        self._packed_fields.update(
+            ndb.transaction(update, xg=len(changes) > 1))
+
+    def get(self, key):
+        key_name = store.key_string(key)
+        packed_key_name = dbmodels.KeyValueEntity.get_packed_key_name(key_name)
+        if packed_key_name is None:
+            return self._unpacked_store.get(key)
+        return self._get_packed_fields(packed_key_name)[key.field_name]
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, update_dict):
+        changes = {}
+        for key, value in update_dict.iteritems():
+            key_name = store.key_string(key)
+            packed_key_name = dbmodels.KeyValueEntity.get_packed_key_name(
+                key_name)
+            if packed_key_name is None:
+                self._unpacked_store.set(key, value)
+            else:
+                updates, _ = changes.setdefault(packed_key_name, ({}, []))
+                updates[key.field_name] = value
+        if changes:
+            self._update_packed_fields(changes)
+
+    def delete(self, key):
+        key_name = store.key_string(key)
+        packed_key_name = dbmodels.KeyValueEntity.get_packed_key_name(key_name)
+        if packed_key_name is None:
+            self._unpacked_store.delete(key)
+        elif key.field_name in self._get_packed_fields(packed_key_name):
+            self._update_packed_fields(
+                {packed_key_name: ({}, [key.field_name])})
+
+    def has(self, key):
+        key_name = store.key_string(key)
+        packed_key_name = dbmodels.KeyValueEntity.get_packed_key_name(key_name)
+        if packed_key_name is None:
+            return self._unpacked_store.has(key)
+        return key.field_name in self._get_packed_fields(packed_key_name)
+
+
+def _get_key_value_store():
+    if XBLOCK_PACKED_FIELD_STORAGE.value:
+        return PackedKeyValueStore()
+    return store.KeyValueStore()
+
+
 class ForbiddenXBlockError(Exception):
     """Raised when a non-whitelisted XBlock is requested."""
 
@@ -163,6 +502,182 @@ class MemoryIdManager(xblock.runtime.MemoryIdManager):
         return def_id
 
 
+EventLimit = collections.namedtuple(
+    'EventLimit', ['sample_rate', 'max_per_minute', 'burst'])
+
+
+def _parse_event_limits(value):
+    """Parse the JSON text of XBLOCK_EVENT_LIMITS into a dict of EventLimit.
+
+    Args:
+        value: str. A JSON object mapping a key of the form "block_type" or
+            "block_type:event_name" to an object with the optional fields
+            "sample_rate" (the fraction of events recorded), "max_per_minute"
+            (the rate at which each user may record events) and "burst" (the
+            number of events a user may record at once; defaults to
+            max_per_minute).
+
+    Returns:
+        dict. A dict mapping keys to EventLimit's.
+
+    Raises:
+        ValueError: if the text is not a valid limits specification.
+    """
+    limits = {}
+    if not value or not value.strip():
+        return limits
+
+    spec = transforms.loads(value)
+    if not isinstance(spec, dict):
+        raise ValueError('Event limits must be a JSON object')
+
+    for key, item in spec.iteritems():
+        if not isinstance(item, dict):
+            raise ValueError('Limits for "%s" must be a JSON object' % key)
+        unknown_fields = set(item) - set(EventLimit._fields)
+        if unknown_fields:
+            raise ValueError('Unknown fields for "%s": %s' % (
+                key, ', '.join(sorted(unknown_fields))))
+
+        sample_rate = item.get('sample_rate', 1)
+        max_per_minute = item.get('max_per_minute')
+        burst = item.get('burst', max_per_minute)
+        if not (isinstance(sample_rate, (int, float)) and
+                0 <= sample_rate <= 1):
+            raise ValueError(
+                'The sample_rate for "%s" must be between 0 and 1' % key)
+        for name, number in [('max_per_minute', max_per_minute),
+                             ('burst', burst)]:
+            if number is not None and not (
+                    isinstance(number, (int, float)) and number > 0):
+                raise ValueError(
+                    'The %s for "%s" must be a positive number' % (name, key))
+
+        limits[key] = EventLimit(sample_rate, max_per_minute, burst)
+    return limits
+
+
+def _validate_event_limits(value, errors):
+    try:
+        _parse_event_limits(value)
+    except ValueError as e:
+        errors.append(str(e))
+
+
+XBLOCK_EVENT_LIMITS = config.ConfigProperty(
+    'gcb_xblock_event_limits', str, (
+        'Sampling rates and per-user rate limits for recording XBlock events. '
+        'A JSON object keyed by "block_type" or "block_type:event_name". '
+        'Events sent from the browser are keyed in the same way, by the block '
+        'type and event name they carry. For example, {"video": '
+        '{"sample_rate": 0.1}, "sequential": {"max_per_minute": 10, '
+        '"burst": 20}}.'),
+    default_value='', multiline=True, validator=_validate_event_limits)
+
+_event_limits_cache = (None, {})
+
+
+def _get_event_limits():
+    """Get the parsed event limits, reparsing only when the setting changes."""
+    global _event_limits_cache
+    value = XBLOCK_EVENT_LIMITS.value
+    if _event_limits_cache[0] != value:
+        try:
+            limits = _parse_event_limits(value)
+        except ValueError:
+            logging.exception('Ignoring invalid XBlock event limits')
+            limits = {}
+        _event_limits_cache = (value, limits)
+    return _event_limits_cache[1]
+
+
+def _take_event_token(user_id, key, limit):
+    """Take a token from the user's token bucket for the given limit.
+
+    The buckets are held in memcache and so are shared between instances, but
+    concurrent requests may occasionally both take the last token.
+
+    Args:
+        user_id: str. The id of the user recording the event.
+        key: str. The key of the limit in XBLOCK_EVENT_LIMITS.
+        limit: EventLimit. The limit to apply.
+
+    Returns:
+        bool. True if a token was available.
+    """
+    memcache_key = 'xblock_module:event_tokens:%s:%s' % (key, user_id)
+    now = time.time()
+    state = m_models.MemcacheManager.get(memcache_key)
+    if state is None:
+        tokens = limit.burst
+    else:
+        tokens, last_time = state
+        tokens = min(
+            limit.burst,
+            tokens + (now - last_time) * limit.max_per_minute / 60.0)
+
+    if tokens < 1:
+        return False
+
+    m_models.MemcacheManager.set(memcache_key, (tokens - 1, now))
+    return True
+
+
+def should_record_event(user_id, keys):
+    """Apply the configured sampling and rate limits to an event.
+
+    Args:
+        user_id: str. The id of the user recording the event.
+        keys: list of str. The keys under which the limits for the event may be
+            configured, most specific first. The first key which has limits is
+            used.
+
+    Returns:
+        bool. True if the event should be recorded.
+    """
+    limits = _get_event_limits()
+    for key in keys:
+        limit = limits.get(key)
+        if limit is not None:
+            break
+    else:
+        return True
+
+    if limit.sample_rate < 1 and random.random() >= limit.sample_rate:
+        XBLOCK_EVENTS_SAMPLED_OUT.inc()
+        return False
+
+    if limit.max_per_minute and not _take_event_token(user_id, key, limit):
+        XBLOCK_EVENTS_RATE_LIMITED.inc()
+        return False
+
+    return True
+
+
+def _get_event_limit_keys(block_type, event_name):
+    """The limit keys for an event of a block of the given type."""
+    if event_name:
+        return ['%s:%s' % (block_type, event_name), block_type]
+    return [block_type]
+
+
+def cacheable_handler(handler):
+    """Decorator declaring that an XBlock handler does not change any state.
+
+    The response of a cacheable handler must depend only on the request and on
+    the stored fields of the block. The runtime then sends an ETag with the
+    response, and answers a request whose If-None-Match matches it with a 304
+    without running the handler.
+    """
+    handler.xblock_cacheable = True
+    return handler
+
+
+def is_cacheable_handler(block, handler_name):
+    handler = getattr(block, handler_name, None)
+    return getattr(handler, 'xblock_cacheable', False)
+
+
 class Runtime(appengine_xblock_runtime.runtime.Runtime):
     """A XBlock runtime which uses the App Engine datastore."""
 
@@ -171,10 +686,10 @@ class Runtime(appengine_xblock_runtime.runtime.Runtime):
             is_admin=False):
 
         field_data = field_data or xblock.runtime.KvsFieldData(
-            store.KeyValueStore())
+            _get_key_value_store())
 
         if is_admin:
-            pass
+            field_data = AuthorFieldData(field_data)
         elif student_id:
             field_data = StudentFieldData(field_data)
         else:
@@ -189,6 +704,82 @@ class Runtime(appengine_xblock_runtime.runtime.Runtime):
             id_reader=id_reader, field_data=field_data, student_id=student_id,
             services=services, select=select_xblock)
         self.handler = handler
+        self._event_buffer = []
+        self._unwritten_event_count = 0
+
+    @ndb.tasklet
+    def prefetch_block_async(self, usage_id):
+        """Tasklet loading the stored fields of a block in a single batch.
+
+        The entities are held in the NDB context cache, so that the reads made
+        by get_block and by the block's handlers do not each need a round
+        trip to the datastore. Prefetching is an optimization only; a block
+        which cannot be resolved is left for get_block to report.
+
+        Args:
+            usage_id: str. The usage id of the block.
+        """
+        block_ids = yield _get_block_ids_async(usage_id)
+        if block_ids is None:
+            return
+        def_id, block_type = block_ids
+
+        try:
+            xblock_class = self.load_block_type(block_type)
+        except (ForbiddenXBlockError, xblock.plugin.PluginMissingError):
+            return
+
+        yield ndb.get_multi_async(self._get_field_keys(
+            xblock_class, usage_id, def_id, block_type))
+
+    def _get_field_keys(self, xblock_class, usage_id, def_id, block_type):
+        """The keys of the entities holding the fields of a block."""
+        block_scope_ids = {
+            xblock.fields.BlockScope.USAGE: usage_id,
+            xblock.fields.BlockScope.DEFINITION: def_id,
+            xblock.fields.BlockScope.TYPE: block_type,
+            xblock.fields.BlockScope.ALL: None}
+        packed = XBLOCK_PACKED_FIELD_STORAGE.value
+        keys = []
+        for field in xblock_class.fields.itervalues():
+            key_name = _get_field_key_name(field, block_scope_ids, self.user_id)
+            packed_key_name = packed and (
+                dbmodels.KeyValueEntity.get_packed_key_name(key_name))
+            if packed_key_name:
+                key = ndb.Key(PackedKeyValueEntity, packed_key_name)
+            else:
+                key = ndb.Key(store.KeyValueEntity, key_name)
+            if key not in keys:
+                keys.append(key)
+        return keys
+
+    def get_handler_etag(self, block, handler_name, body):
+        """Compute an ETag for the response of a cacheable handler.
+
+        The ETag is a hash of the request and of the stored fields of the block
+        which are visible to the current user. Thus it changes whenever the
+        student's state, or the block's content, changes.
+
+        Args:
+            block: XBlock. The block whose handler is called.
+            handler_name: str. The name of the handler.
+            body: str. The body of the request.
+
+        Returns:
+            str. The ETag.
+        """
+        scope_ids = block.scope_ids
+        keys = self._get_field_keys(
+            block.__class__, scope_ids.usage_id, scope_ids.def_id,
+            scope_ids.block_type)
+
+        digest = hashlib.sha1()
+        digest.update(repr((
+            os.environ.get('CURRENT_VERSION_ID'), scope_ids.usage_id,
+            handler_name, body)))
+        for key, entity in zip(keys, ndb.get_multi(keys)):
+            digest.update(repr((key.id(), entity and entity.to_dict())))
+        return digest.hexdigest()
 
     def render_template(self, template_name, **kwargs):
         """Loads the django template for `template_name."""
@@ -301,6 +892,51 @@ class Runtime(appengine_xblock_runtime.runtime.Runtime):
         tree.write(
             xmlfile, xml_declaration=True, encoding='utf8', pretty_print=True)
 
+    def get_xml(self, usage_id):
+        """Get the XML export of the tree under a usage.
+
+        Exports made by a runtime with no user are cached in an
+        XmlExportEntity, which parse_xml_string refreshes whenever it writes the
+        tree. A cached export is only used if it was made at the current
+        content version. An export is only cached here if there is no current
+        cached copy, so that it cannot overwrite the copy from a concurrent
+        write.
+
+        Args:
+            usage_id: str. The usage id of the root of the tree.
+
+        Returns:
+            str. The XML export, as written by export_to_xml.
+        """
+        if self.user_id is not None:
+            # The export could include the user's state
+            xml_buffer = StringIO()
+            self.export_to_xml(self.get_block(usage_id), xml_buffer)
+            return xml_buffer.getvalue()
+
+        # The version is read before the export, so that a write made while
+        # exporting leaves the cached copy stale
+        key = ndb.Key(XmlExportEntity, usage_id)
+        version_key = ndb.Key(
+            XBlockContentVersionEntity, XBLOCK_CONTENT_VERSION_ID)
+        entity, version_entity = ndb.get_multi([key, version_key])
+        content_version = version_entity.version if version_entity else None
+        if entity is not None and entity.is_current(content_version):
+            return entity.xml
+
+        xml_buffer = StringIO()
+        self.export_to_xml(self.get_block(usage_id), xml_buffer)
+        xml = xml_buffer.getvalue()
+
+        @ndb.transactional
+        def add_to_cache():
+            entity = key.get()
+            if entity is None or not entity.is_current(content_version):
+                XmlExportEntity.create(key, content_version, xml).put()
+
+        add_to_cache()
+        return xml
+
     def add_block_as_child_node(self, block, node):
         """Override export method from XBlock runtime."""
         child = etree.SubElement(
@@ -330,6 +966,13 @@ class Runtime(appengine_xblock_runtime.runtime.Runtime):
     def publish(self, block, event):
         """Log an XBlock event to the event stream.
 
+        Events are buffered and written asynchronously in batches; call
+        flush_events() before the end of the request, in a handler decorated
+        with @ndb.toplevel, which completes the writes. When MAX_BUFFERED_EVENTS
+        events are waiting to be written, further events are dropped. The
+        sampling and rate limits in XBLOCK_EVENT_LIMITS are applied by block
+        type and by the "event_type" field of the event, if it has one.
+
         Args:
             block: XBlock. The XBlock which emitted the event.
             event: dict. A JSON serializable dict containing the event data.
@@ -337,20 +980,58 @@ class Runtime(appengine_xblock_runtime.runtime.Runtime):
         if self.user_id is None:
             return
 
-        wrapper = {
-            'usage': block.scope_ids.usage_id,
-            'type': block.scope_ids.block_type,
-            'event': event}
+        # The type is written first, so that export can read it without
+        # decoding the event. See _event_entity_for_export.
+        wrapper = collections.OrderedDict([
+            ('type', block.scope_ids.block_type),
+            ('usage', block.scope_ids.usage_id),
+            ('event', event)])
+
+        if not utils.CAN_PERSIST_TAG_EVENTS.value:
+            return
+
+        event_name = None
+        if isinstance(event, dict):
+            event_name = event.get('event_type')
+        if not should_record_event(self.user_id, _get_event_limit_keys(
+                block.scope_ids.block_type, event_name)):
+            return
+
+        if self._unwritten_event_count >= MAX_BUFFERED_EVENTS:
+            XBLOCK_EVENTS_DROPPED.inc()
+            return
+
+        self._event_buffer.append(m_models.EventEntity(
+            source=XBLOCK_EVENT_SOURCE_NAME,
+            user_id=self.user_id,
+            data=transforms.dumps(wrapper)))
+        self._unwritten_event_count += 1
+        if len(self._event_buffer) >= EVENT_WRITE_BATCH_SIZE:
+            self._write_event_batch()
+
+    def _write_event_batch(self):
+        """Start an asynchronous write of the buffered events.
+
+        The write is queued on the NDB event loop, so that it is completed by
+        @ndb.toplevel at the end of the request, rather than waited for here.
+        """
+        if self._event_buffer:
+            rpc = db.put_async(self._event_buffer)
+            eventloop.queue_rpc(rpc, _log_failed_event_write, rpc)
+            self._event_buffer = []
+
+    def flush_events(self):
+        """Start writing all buffered events, without waiting for the writes.
 
-        if utils.CAN_PERSIST_TAG_EVENTS.value:
-            m_models.EventEntity(
-                source=XBLOCK_EVENT_SOURCE_NAME,
-                user_id=self.user_id,
-                data=transforms.dumps(wrapper)).put()
+        A failed write is logged rather than raised, so that event logging
+        cannot break the request which published the events.
+        """
+        self._write_event_batch()
+        self._unwritten_event_count = 0
 
     def parse_xml_string(
             self, xml_str, unused_id_generator, orig_xml_str=None,
-            dry_run=False, log=None):
+            dry_run=False, log=None, write_counts=None):
         """Override parse_xml_string to make it asynchronous.
 
         Calls to this method will execute using NDB's asynchronous API. In order
@@ -358,6 +1039,9 @@ class Runtime(appengine_xblock_runtime.runtime.Runtime):
         essential that some method higher up the call stack (e.g., the request
         handler) should be decorated with @ndb.toplevel.
 
+        The entities already stored for the tree are read in one batch, and only
+        the entities which are new or have changed are written.
+
         Args:
             xml_str: str. The string of XML which will be parsed as XBlocks.
             unused_id_generator: IdGenerator. The XBlock API allows the runtime
@@ -370,6 +1054,9 @@ class Runtime(appengine_xblock_runtime.runtime.Runtime):
                 datastore writes.
             log: file-like. A buffer to write back the XML representation of the
                 XBlock tree which has been assembled.
+            write_counts: dict. If given, the numbers of entities written and
+                of unchanged entities skipped are added to its 'written' and
+                'skipped' entries.
 
         Returns:
             str. The usage id of the root block of the XML tree.
@@ -420,23 +1107,62 @@ class Runtime(appengine_xblock_runtime.runtime.Runtime):
             usage_entity.definition_id = def_id
             entities.append(usage_entity)
 
-        ndb.put_multi_async(entities)
+        old_entities = ndb.get_multi([entity.key for entity in entities])
+        changed_entities = [
+            entity for entity, old_entity in zip(entities, old_entities)
+            if old_entity is None or old_entity.to_dict() != entity.to_dict()]
+
+        # Refresh the cached export of the tree. It is not content, so it is
+        # not included in the write counts.
+        ndb.put_multi_async(changed_entities + [XmlExportEntity.create(
+            ndb.Key(XmlExportEntity, root_usage_id), _get_content_version(),
+            log.getvalue())])
+
+        written = len(changed_entities)
+        skipped = len(entities) - written
+        logging.info(
+            'Parsed XBlock %s: wrote %s entities, skipped %s unchanged',
+            root_usage_id, written, skipped)
+        if write_counts is not None:
+            write_counts['written'] = write_counts.get('written', 0) + written
+            write_counts['skipped'] = write_counts.get('skipped', 0) + skipped
 
         return root_usage_id
 
 
+def _fix_ajax_request_body(body):
+    # The XBlock ajax clients send JSON strings in the POST body, but if
+    # the content-type is not explicitly set to application/json then
+    # the handler receives name=value pairs in url-encoded
+    # strings.
+    return urllib.unquote(body[:-1]) if body and body[-1] == '=' else body
+
+
+@ndb.tasklet
+def _get_block_ids_async(usage_id):
+    """Tasklet resolving a usage id to its definition id and block type."""
+    usage = yield ndb.Key(store.UsageEntity, usage_id).get_async()
+    if usage is None:
+        raise ndb.Return(None)
+    definition = yield ndb.Key(
+        store.DefinitionEntity, usage.definition_id).get_async()
+    if definition is None:
+        raise ndb.Return(None)
+    raise ndb.Return((usage.definition_id, definition.block_type))
+
+
+def _log_failed_event_write(rpc):
+    """Event loop callback logging the failure of a write of events."""
+    try:
+        rpc.check_success()
+    except Exception:  # pylint: disable=broad-except
+        logging.exception('Failed to write XBlock events')
+
+
 class XBlockActionHandler(utils.BaseHandler):
 
+    @ndb.toplevel
     def _handle_request(self):
-        def fix_ajax_request_body(body):
-            # The XBlock ajax clients send JSON strings in the POST body, but if
-            # the content-type is not explicitly set to application/json then
-            # the handler receives name=value pairs in url-encoded
-            # strings.
-            return urllib.unquote(
-                body[:-1]) if body and body[-1] == '=' else body
-
-        student_id = get_enrolled_user_id_or_guest_user_id(self)
         token = self.request.get('xsrf_token')
         if not utils.XsrfTokenManager.is_xsrf_token_valid(
                 token, XBLOCK_XSRF_TOKEN_NAME):
@@ -446,13 +1172,36 @@ class XBlockActionHandler(utils.BaseHandler):
         usage_id = self.request.get('usage')
         handler_name = self.request.get('handler')
 
+        student_id = get_enrolled_user_id_or_guest_user_id(self)
         rt = Runtime(self, student_id=student_id)
+        # Load the block's fields in a single batch
+        rt.prefetch_block_async(usage_id).wait()
+
         block = rt.get_block(usage_id)
-        self.request.body = fix_ajax_request_body(self.request.body)
-        response = block.runtime.handle(block, handler_name, self.request)
+        self.request.body = _fix_ajax_request_body(self.request.body)
+
+        etag = None
+        if is_cacheable_handler(block, handler_name):
+            etag = rt.get_handler_etag(block, handler_name, self.request.body)
+            # Match only explicit ETags; "*" matches any response, even one
+            # for state the client has not seen
+            if etag in getattr(self.request.if_none_match, 'etags', ()):
+                self.response.status = 304
+                self.response.etag = etag
+                return
+
+        try:
+            response = block.runtime.handle(block, handler_name, self.request)
+        finally:
+            rt.flush_events()
         self.response.body = response.body
         self.response.headers.update(response.headers)
 
+        if etag is not None:
+            self.response.etag = etag
+            self.response.cache_control.private = True
+            self.response.cache_control.no_cache = True
+
     def get(self):
         self._handle_request()
 
@@ -460,9 +1209,170 @@ class XBlockActionHandler(utils.BaseHandler):
         self._handle_request()
 
 
+class XBlockBatchActionHandler(utils.BaseHandler):
+    """Runs a batch of XBlock handler calls against a single runtime.
+
+    The POST body is a JSON object of the form
+        {"calls": [{"usage": ..., "handler": ..., "body": ...}, ...]}
+    and the response is a JSON list with an object for each call, giving its
+    "status", "content_type" and "body". Calls to cacheable handlers also get
+    an "etag", and a call with a matching "if_none_match" gets a 304 with an
+    empty body. The XSRF check, the student lookup,
+    the runtime and the blocks it loads are shared by all the calls in the
+    batch, and a failed call does not prevent the others from running.
+    """
+
+    def _handle_call(self, rt, blocks, call):
+        usage_id = call.get('usage')
+        handler_name = call.get('handler')
+        body = call.get('body') or ''
+        if not isinstance(body, basestring):
+            body = transforms.dumps(body)
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+
+        try:
+            request = webapp2.Request.blank('%s?%s' % (
+                HANDLER_URI, urllib.urlencode({
+                    'usage': usage_id, 'handler': handler_name})))
+            request.method = 'POST'
+            request.content_type = call.get(
+                'content_type', 'application/x-www-form-urlencoded')
+            request.body = _fix_ajax_request_body(body)
+
+            if usage_id not in blocks:
+                blocks[usage_id] = rt.get_block(usage_id)
+            block = blocks[usage_id]
+
+            etag = None
+            if is_cacheable_handler(block, handler_name):
+                etag = rt.get_handler_etag(block, handler_name, request.body)
+                if etag == call.get('if_none_match'):
+                    return {
+                        'status': 304, 'content_type': None, 'body': '',
+                        'etag': etag}
+
+            response = rt.handle(block, handler_name, request)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception(
+                'XBlock handler call failed: %s %s', usage_id, handler_name)
+            return {'status': 500, 'content_type': 'text/plain', 'body': ''}
+
+        result = {
+            'status': response.status_int,
+            'content_type': response.content_type,
+            'body': response.body.decode('utf-8', 'replace')}
+        if etag is not None:
+            result['etag'] = etag
+        return result
+
+    @ndb.toplevel
+    def post(self):
+        token = self.request.get('xsrf_token')
+        if not utils.XsrfTokenManager.is_xsrf_token_valid(
+                token, XBLOCK_XSRF_TOKEN_NAME):
+            self.error(400)
+            return
+
+        try:
+            calls = transforms.loads(self.request.body).get('calls')
+        except (AttributeError, ValueError):
+            calls = None
+        if (not isinstance(calls, list) or
+                len(calls) > MAX_BATCH_HANDLER_CALLS or
+                not all(isinstance(call, dict) for call in calls)):
+            self.error(400)
+            return
+
+        student_id = get_enrolled_user_id_or_guest_user_id(self)
+        rt = Runtime(self, student_id=student_id)
+        # The usages of the batch are loaded together, their gets batched by
+        # NDB
+        ndb.Future.wait_all([
+            rt.prefetch_block_async(usage_id)
+            for usage_id in set(
+                call['usage'] for call in calls
+                if isinstance(call.get('usage'), basestring))])
+
+        blocks = {}
+        try:
+            responses = [self._handle_call(rt, blocks, call) for call in calls]
+        finally:
+            rt.flush_events()
+
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(transforms.dumps(responses))
+
+
 # Data model section
 
 
+def _get_description_sort_key(entity):
+    if not entity.data:
+        return u''
+    description = transforms.loads(entity.data).get('description', u'')
+    return description.lower()[:DESCRIPTION_SORT_KEY_LENGTH]
+
+
+class XmlExportEntity(ndb.Model):
+    """The cached XML export of the tree of XBlocks under a usage.
+
+    The key id is the usage id of the root of the tree. See Runtime.get_xml.
+
+    The XML is compressed here rather than by the property, so that
+    dbmodels.XmlExportEntity, the db model of the same kind used for ETL,
+    reads and writes the same bytes. Keep the two in step.
+    """
+    generation = ndb.IntegerProperty(indexed=False)
+    # The version of the course content when the export was made
+    content_version = ndb.StringProperty(indexed=False)
+    compressed_xml = ndb.BlobProperty()
+
+    @classmethod
+    def create(cls, key, content_version, xml):
+        return cls(
+            key=key, generation=XML_EXPORT_GENERATION,
+            content_version=content_version,
+            compressed_xml=zlib.compress(xml))
+
+    @property
+    def xml(self):
+        return zlib.decompress(self.compressed_xml)
+
+    @xml.setter
+    def xml(self, value):
+        self.compressed_xml = zlib.compress(value)
+
+    def is_current(self, content_version):
+        """Whether the export was made at the given content version."""
+        return (
+            self.generation == XML_EXPORT_GENERATION and
+            self.content_version == content_version)
+
+
+class XBlockContentVersionEntity(ndb.Model):
+    """The version of the XBlock content of a course.
+
+    There is one per course, with key id XBLOCK_CONTENT_VERSION_ID. A new
+    version is started whenever authored fields are written other than by
+    Runtime.parse_xml_string, which refreshes the cached export of the tree it
+    writes. Cached exports made at an earlier version are not used.
+    """
+    version = ndb.StringProperty(indexed=False)
+
+
+def _get_content_version():
+    entity = ndb.Key(
+        XBlockContentVersionEntity, XBLOCK_CONTENT_VERSION_ID).get()
+    return entity.version if entity else None
+
+
+def _new_content_version():
+    """Start a new content version. Call this after the write it records."""
+    XBlockContentVersionEntity(
+        id=XBLOCK_CONTENT_VERSION_ID, version=uuid.uuid4().hex).put()
+
+
 class RootUsageEntity(m_models.BaseEntity):
     """Datastore entiry for root usage objects.
 
@@ -470,6 +1380,9 @@ class RootUsageEntity(m_models.BaseEntity):
     and RootUsageDao instead.
     """
     data = db.TextProperty(indexed=False)
+    # Lower-cased description, indexed so that root usages can be listed in
+    # order a page at a time. It is recomputed from data on every put.
+    description_lower = db.ComputedProperty(_get_description_sort_key)
 
 
 class RootUsageDto(object):
@@ -495,8 +1408,9 @@ class RootUsageDto(object):
     def is_imported(self):
         """Whether the usage was created as an import of an archive file.
 
-        Imported root usage entities are wiped and re-inserted when a new
-        archive is merged in; non-imported entities are left alone.
+        Imported root usage entities are matched by usage id and updated or
+        deleted when a new archive is merged in; non-imported entities are left
+        alone.
 
         Returns:
             bool. Whether the usage was created as part of an import.
@@ -509,64 +1423,575 @@ class RootUsageDao(m_models.BaseJsonDao):
     DTO = RootUsageDto
     ENTITY = RootUsageEntity
 
+    # The select data for each namespace, cached in instance memory as a pair
+    # (version, select_data). See get_select_data.
+    _select_data_cache = {}
+    # The usage ids of the root usages in each namespace, cached in instance
+    # memory as a pair (version, {root_id: usage_id}). See get_usage_ids.
+    _usage_id_cache = {}
 
-# XBlock editor section
+    @classmethod
+    def get_select_data(cls):
+        """Get (id, description) pairs for all the root usages, for a select.
 
-EDITOR_HANDLERS = ['add_xblock', 'edit_xblock', 'import_xblock']
+        The list is cached in instance memory, together with the version of the
+        list of root usages that it was built from. The current version is kept
+        in memcache and is changed by every write to the root usages, so all
+        instances rebuild their lists after a write.
 
+        Returns:
+            list of (unicode, unicode). The pairs, ordered by case-insensitive
+            description. Callers must not modify the list.
+        """
+        version = cls._get_list_version()
+        namespace = namespace_manager.get_namespace()
+        cached = cls._select_data_cache.get(namespace)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        select_data = [
+            (unicode(dto.id), dto.description) for dto in cls.iter_all()]
+        select_data.sort(key=lambda x: x[1].lower())
+        cls._select_data_cache[namespace] = (version, select_data)
+        return select_data
 
-_orig_get_template = dashboard.DashboardHandler.get_template
+    @classmethod
+    def get_usage_ids(cls, root_ids):
+        """Resolve root usage ids to the usage ids of their XBlocks.
 
+        The results are cached in instance memory in the same way as
+        get_select_data, and the ids which are not cached are loaded with a
+        single batched get.
 
-def _get_template(the_dashboard, template_name, dirs):
-    return _orig_get_template(
-        the_dashboard, template_name, dirs + [os.path.join(
-            appengine_config.BUNDLE_ROOT, 'modules', 'xblock_module')])
+        Args:
+            root_ids: list of str. The ids of the root usages.
 
+        Returns:
+            dict. The usage id for each root id. Root ids which do not exist
+            are omitted.
+        """
+        version = cls._get_list_version()
+        namespace = namespace_manager.get_namespace()
+        cached = cls._usage_id_cache.get(namespace)
+        if cached is None or cached[0] != version:
+            cached = (version, {})
+            cls._usage_id_cache[namespace] = cached
+        usage_ids = cached[1]
+
+        root_ids = [unicode(root_id) for root_id in root_ids]
+        misses = list(set(
+            root_id for root_id in root_ids if root_id not in usage_ids))
+        if misses:
+            entities = db.get([
+                db.Key.from_path(cls.ENTITY.kind(), long(root_id))
+                for root_id in misses])
+            for root_id, entity in zip(misses, entities):
+                if entity is not None:
+                    usage_ids[root_id] = transforms.loads(
+                        entity.data).get('usage_id', '')
+
+        return {
+            root_id: usage_ids[root_id]
+            for root_id in root_ids if root_id in usage_ids}
 
-def _add_editor_to_dashboard():
-    for handler in EDITOR_HANDLERS:
-        dashboard.DashboardHandler.get_actions.append(handler)
-        setattr(
-            dashboard.DashboardHandler, 'get_%s' % handler,
-            globals()['_get_%s' % handler])
+    @classmethod
+    def _get_list_version(cls):
+        version = m_models.MemcacheManager.get(ROOT_USAGE_LIST_VERSION_KEY)
+        if version is None:
+            version = cls._new_list_version()
+        return version
 
-    setattr(dashboard.DashboardHandler, 'get_template', _get_template)
+    @classmethod
+    def _new_list_version(cls):
+        """Start a new version of the list of root usages.
 
-    dashboard.DashboardHandler.contrib_asset_listers.append(list_xblocks)
-    dashboard.DashboardHandler.child_routes.append(
-        [XBlockEditorRESTHandler.URI, XBlockEditorRESTHandler])
-    dashboard.DashboardHandler.child_routes.append(
-        [XBlockArchiveRESTHandler.URI, XBlockArchiveRESTHandler])
-    dashboard.DashboardHandler.child_routes.append(
-        [XBlockArchiveProgressQueryHandler.URI, XBlockArchiveProgressQueryHandler])
+        This must be called after the write which changes the list, so that a
+        list built concurrently from the old data is not tagged with the new
+        version.
+        """
+        version = uuid.uuid4().hex
+        m_models.MemcacheManager.set(ROOT_USAGE_LIST_VERSION_KEY, version)
+        return version
 
+    @classmethod
+    def iter_all(cls):
+        """Iterate over all the DTO's, without the limit applied by get_all."""
+        for entity in cls.ENTITY.all().run(batch_size=DATASTORE_BATCH_SIZE):
+            yield cls.DTO(entity.key().id(), transforms.loads(entity.data))
 
-def _remove_editor_from_dashboard():
-    for handler in EDITOR_HANDLERS:
-        dashboard.DashboardHandler.get_actions.remove(handler)
-        delattr(dashboard.DashboardHandler, 'get_%s' % handler)
+    @classmethod
+    def get_page(cls, cursor=None, page_size=None):
+        """Get a page of DTO's, ordered by case-insensitive description.
 
-    setattr(dashboard.DashboardHandler, 'get_template', _orig_get_template)
+        Args:
+            cursor: str. The cursor returned with the previous page, or None
+                for the first page.
+            page_size: int. The maximum number of DTO's in the page. Defaults
+                to XBLOCK_LIST_PAGE_SIZE.
 
-    dashboard.DashboardHandler.contrib_asset_listers.remove(list_xblocks)
-    dashboard.DashboardHandler.child_routes.remove(
-        [XBlockEditorRESTHandler.URI, XBlockEditorRESTHandler])
-    dashboard.DashboardHandler.child_routes.remove(
-        [XBlockArchiveRESTHandler.URI, XBlockArchiveRESTHandler])
-    dashboard.DashboardHandler.child_routes.remove(
-        [XBlockArchiveProgressQueryHandler.URI, XBlockArchiveProgressQueryHandler])
+        Returns:
+            A pair (dtos, next_cursor) of the list of DTO's in the page and the
+            cursor for the next page, or None if this is the last page.
+        """
+        page_size = page_size or XBLOCK_LIST_PAGE_SIZE
+        query = cls.ENTITY.all().order('description_lower')
+        if cursor:
+            query.with_cursor(cursor)
+        entities = query.fetch(page_size)
+
+        next_cursor = query.cursor()
+        if len(entities) < page_size or not query.with_cursor(
+                next_cursor).count(limit=1):
+            next_cursor = None
+
+        dtos = [
+            cls.DTO(entity.key().id(), transforms.loads(entity.data))
+            for entity in entities]
+        return dtos, next_cursor
 
+    @classmethod
+    def is_description_taken(cls, description, the_id=None):
+        """Whether a root usage other than the_id has the given description.
 
-def list_xblocks(the_dashboard):
-    """Prepare a list of the root XBlock usages installed."""
-    if not filer.is_editable_fs(the_dashboard.app_context):
+        A marker left by a root usage which no longer exists (e.g., one removed
+        by a course restore) does not count.
+        """
+        marker = RootUsageDescriptionEntity.get(
+            _get_description_marker_key(description))
+        return (
+            marker is not None and
+            marker.root_usage_id != (long(the_id) if the_id else None) and
+            not cls._is_marker_orphaned(marker))
+
+    @classmethod
+    def _is_marker_orphaned(cls, marker):
+        """Whether the root usage which took a description no longer exists."""
+        return not marker.reserved and cls.ENTITY.get_by_id(
+            marker.root_usage_id) is None
+
+    @classmethod
+    def reserve_description(cls, description, the_id=None):
+        """Mark a description as taken by a root usage before it is saved.
+
+        This lets callers find out that a description is taken before doing
+        work which would be orphaned if save raised DuplicateDescriptionError.
+
+        Args:
+            description: unicode. The description to reserve.
+            the_id: The id of the root usage, or None for a new root usage, in
+                which case an id is allocated.
+
+        Returns:
+            A pair (the_id, reserved) of the id of the root usage, and whether
+            a new marker was written. If it was, release_description must be
+            called if the root usage is not then saved.
+
+        Raises:
+            DuplicateDescriptionError: The description is taken by another
+                root usage.
+        """
+        if the_id:
+            the_id = long(the_id)
+        else:
+            the_id = db.allocate_ids(
+                db.Key.from_path(cls.ENTITY.kind(), 1), 1)[0]
+        marker_key = _get_description_marker_key(description)
+
+        def reserve_in_txn():
+            marker = db.get(marker_key)
+            if marker is not None and marker.root_usage_id == the_id:
+                return False
+            if marker is not None and not cls._is_marker_orphaned(marker):
+                raise DuplicateDescriptionError(description)
+            RootUsageDescriptionEntity(
+                key=marker_key, root_usage_id=the_id, reserved=True).put()
+            return True
+
+        return the_id, db.run_in_transaction_options(
+            db.create_transaction_options(xg=True), reserve_in_txn)
+
+    @classmethod
+    def release_description(cls, description, the_id):
+        """Release a description reserved for a root usage not then saved."""
+        marker_key = _get_description_marker_key(description)
+
+        def release_in_txn():
+            marker = db.get(marker_key)
+            if marker is not None and marker.root_usage_id == long(the_id):
+                db.delete(marker)
+
+        db.run_in_transaction(release_in_txn)
+
+    @classmethod
+    def save(cls, dto, unique_description=False):
+        """Save a DTO and mark its description as taken, in one transaction.
+
+        Args:
+            dto: RootUsageDto. The DTO to save. A new DTO has id None.
+            unique_description: bool. If set True, raise
+                DuplicateDescriptionError rather than save a DTO whose
+                description is already taken by another root usage.
+
+        Returns:
+            long. The id of the saved DTO.
+        """
+        if dto.id:
+            the_id = long(dto.id)
+        else:
+            the_id = db.allocate_ids(
+                db.Key.from_path(cls.ENTITY.kind(), 1), 1)[0]
+        key = db.Key.from_path(cls.ENTITY.kind(), the_id)
+        marker_key = _get_description_marker_key(dto.description)
+
+        def save_in_txn():
+            entity, marker = db.get([key, marker_key])
+            if (
+                    unique_description and marker is not None and
+                    marker.root_usage_id != the_id and
+                    not cls._is_marker_orphaned(marker)):
+                raise DuplicateDescriptionError(dto.description)
+
+            if entity is None:
+                entity = cls.ENTITY(key=key)
+            else:
+                cls._delete_description_marker(
+                    entity, the_id, new_description=dto.description)
+            entity.data = transforms.dumps(dto.dict)
+            db.put([entity, RootUsageDescriptionEntity(
+                key=marker_key, root_usage_id=the_id)])
+
+        db.run_in_transaction_options(
+            db.create_transaction_options(xg=True), save_in_txn)
+        m_models.MemcacheManager.delete(cls._memcache_key(the_id))
+        cls._new_list_version()
+        return the_id
+
+    @classmethod
+    def delete(cls, dto):
+        """Delete a DTO and release its description, in one transaction."""
+        the_id = long(dto.id)
+        key = db.Key.from_path(cls.ENTITY.kind(), the_id)
+
+        def delete_in_txn():
+            entity = db.get(key)
+            if entity is not None:
+                cls._delete_description_marker(entity, the_id)
+                db.delete(entity)
+
+        db.run_in_transaction_options(
+            db.create_transaction_options(xg=True), delete_in_txn)
+        m_models.MemcacheManager.delete(cls._memcache_key(the_id))
+        cls._new_list_version()
+
+    @classmethod
+    def _delete_description_marker(cls, entity, the_id, new_description=None):
+        """Delete the marker for an entity's description if the entity owns it.
+
+        The marker key is derived from the description stored in the entity, so
+        this must be called before the entity's data is changed. The marker is
+        kept if the description is not changing.
+        """
+        old_description = transforms.loads(entity.data).get('description', '')
+        if old_description == new_description:
+            return
+        old_marker = db.get(_get_description_marker_key(old_description))
+        if old_marker is not None and old_marker.root_usage_id == the_id:
+            db.delete(old_marker)
+
+    @classmethod
+    def save_all(cls, dtos):
+        """Save a list of DTO's using batched datastore puts.
+
+        The description markers are updated in batches too, but not
+        transactionally, and a taken description is not an error. A marker
+        owned by another root usage is left alone, so that the description
+        stays unique for that root usage. This is for use by the importer,
+        which generates the descriptions of the root usages it saves.
+
+        Args:
+            dtos: list of RootUsageDto. The DTO's to save. New DTO's have id
+                None.
+
+        Returns:
+            list of long. The ids of the saved DTO's, in the same order.
+        """
+        ids = []
+        for chunk in _chunks(dtos, DATASTORE_BATCH_SIZE):
+            old_descriptions = cls._get_descriptions(
+                [dto.id for dto in chunk if dto.id])
+
+            entities = []
+            for dto in chunk:
+                if dto.id:
+                    entity = cls.ENTITY(key=db.Key.from_path(
+                        cls.ENTITY.kind(), long(dto.id)))
+                else:
+                    entity = cls.ENTITY()
+                entity.data = transforms.dumps(dto.dict)
+                entities.append(entity)
+
+            chunk_ids = [key.id() for key in db.put(entities)]
+            for the_id in chunk_ids:
+                m_models.MemcacheManager.delete(cls._memcache_key(the_id))
+
+            cls._delete_description_markers([
+                (the_id, old_descriptions[the_id])
+                for the_id, dto in zip(chunk_ids, chunk)
+                if the_id in old_descriptions and
+                old_descriptions[the_id] != dto.description])
+            marker_keys = [
+                _get_description_marker_key(dto.description) for dto in chunk]
+            db.put([
+                RootUsageDescriptionEntity(key=marker_key, root_usage_id=the_id)
+                for the_id, marker_key, marker in zip(
+                    chunk_ids, marker_keys, db.get(marker_keys))
+                if marker is None or marker.root_usage_id == the_id or
+                cls._is_marker_orphaned(marker)])
+            ids += chunk_ids
+        cls._new_list_version()
+        return ids
+
+    @classmethod
+    def delete_all(cls, dtos):
+        """Delete a list of DTO's using batched datastore deletes."""
+        for chunk in _chunks(dtos, DATASTORE_BATCH_SIZE):
+            ids = [long(dto.id) for dto in chunk]
+            old_descriptions = cls._get_descriptions(ids)
+            db.delete([
+                db.Key.from_path(cls.ENTITY.kind(), the_id) for the_id in ids])
+            for the_id in ids:
+                m_models.MemcacheManager.delete(cls._memcache_key(the_id))
+            cls._delete_description_markers(old_descriptions.items())
+        cls._new_list_version()
+
+    @classmethod
+    def _get_descriptions(cls, ids):
+        """Get a dict of the stored descriptions of the entities with ids."""
+        entities = db.get([
+            db.Key.from_path(cls.ENTITY.kind(), long(the_id))
+            for the_id in ids])
+        return {
+            entity.key().id(): transforms.loads(entity.data).get(
+                'description', '')
+            for entity in entities if entity is not None}
+
+    @classmethod
+    def _delete_description_markers(cls, id_description_pairs):
+        """Delete the markers of the descriptions which the ids own."""
+        keys = [
+            _get_description_marker_key(description)
+            for _, description in id_description_pairs]
+        markers = db.get(keys) if keys else []
+        db.delete([
+            marker.key()
+            for (the_id, _), marker in zip(id_description_pairs, markers)
+            if marker is not None and marker.root_usage_id == the_id])
+
+
+class DuplicateDescriptionError(Exception):
+    """Raised when saving a root usage whose description is already taken."""
+
+
+class RootUsageDescriptionEntity(m_models.BaseEntity):
+    """Marks a root usage description as taken.
+
+    The key name is derived from the description by
+    _get_description_marker_key, so that descriptions can be checked for
+    uniqueness with a get by key, inside the transaction which saves the root
+    usage.
+    """
+    root_usage_id = db.IntegerProperty(indexed=False)
+    # Whether the marker was written by RootUsageDao.reserve_description for a
+    # root usage which has not been saved yet
+    reserved = db.BooleanProperty(indexed=False, default=False)
+
+
+def _get_description_marker_key(description):
+    return db.Key.from_path(
+        RootUsageDescriptionEntity.kind(),
+        hashlib.sha1(description.encode('utf8')).hexdigest())
+
+
+class RootUsageIndexJob(jobs.DurableJob):
+    """Re-saves every root usage so that it is in the description indexes.
+
+    Root usages saved before RootUsageEntity.description_lower and
+    RootUsageDescriptionEntity were added are missing from the index used to
+    list them, and their descriptions are not marked as taken. The dashboard
+    runs this job once per course, the first time the list is shown.
+
+    Each root usage is read again and re-saved in its own transaction, so that
+    an edit saved while the job runs is not overwritten. A description marker
+    is only added where none exists or the root usage holding it is gone, so
+    the marker of another root usage is never replaced.
+    """
+
+    def run(self):
+        count = 0
+        query = RootUsageEntity.all(keys_only=True)
+        while True:
+            keys = query.fetch(DATASTORE_BATCH_SIZE)
+            if not keys:
+                break
+            for key in keys:
+                if self._reindex(key):
+                    count += 1
+            query.with_cursor(query.cursor())
+        return {'success': True, 'message': 'Indexed %s XBlocks.' % count}
+
+    def _reindex(self, key):
+        """Re-save one root usage and mark its description as taken.
+
+        Returns:
+            bool. Whether the root usage still existed.
+        """
+        def reindex_in_txn():
+            entity = db.get(key)
+            if entity is None:
+                return False
+            marker_key = _get_description_marker_key(
+                transforms.loads(entity.data).get('description', ''))
+            to_put = [entity]
+            marker = db.get(marker_key)
+            # pylint: disable=protected-access
+            is_free = marker is None or RootUsageDao._is_marker_orphaned(marker)
+            # pylint: enable=protected-access
+            if is_free:
+                to_put.append(RootUsageDescriptionEntity(
+                    key=marker_key, root_usage_id=key.id()))
+            db.put(to_put)
+            return True
+
+        return db.run_in_transaction_options(
+            db.create_transaction_options(xg=True), reindex_in_txn)
+
+
+def _ensure_root_usage_index(app_context):
+    """Queue RootUsageIndexJob if it has never run, or if its last run failed.
+
+    Returns:
+        RootUsageIndexJob. The job, so that callers can check if it is active.
+    """
+    index_job = RootUsageIndexJob(app_context)
+    job_entity = index_job.load()
+    if job_entity is None or job_entity.status_code == jobs.STATUS_CODE_FAILED:
+        index_job.submit()
+    return index_job
+
+
+class StaticFileDigestEntity(m_models.BaseEntity):
+    """Records the digest of a static file installed by the importer.
+
+    The key name is the physical path of the file (e.g.,
+    /assets/img/static/test.png) and the digest is the SHA-1 hex digest of the
+    file content at the time it was last written by the importer.
+    """
+    digest = db.StringProperty(indexed=False)
+
+
+def _chunks(items, size):
+    """Split a list into consecutive sublists of at most the given size."""
+    return [items[i:i + size] for i in xrange(0, len(items), size)]
+
+
+# XBlock editor section
+
+EDITOR_HANDLERS = [
+    'add_xblock', 'edit_xblock', 'import_xblock', 'export_xblock',
+    'collect_xblock_garbage', 'pack_xblock_fields']
+
+
+_orig_get_template = dashboard.DashboardHandler.get_template
+
+
+def _get_template(the_dashboard, template_name, dirs):
+    return _orig_get_template(
+        the_dashboard, template_name, dirs + [os.path.join(
+            appengine_config.BUNDLE_ROOT, 'modules', 'xblock_module')])
+
+
+def _add_editor_to_dashboard():
+    for handler in EDITOR_HANDLERS:
+        dashboard.DashboardHandler.get_actions.append(handler)
+        setattr(
+            dashboard.DashboardHandler, 'get_%s' % handler,
+            globals()['_get_%s' % handler])
+
+    setattr(dashboard.DashboardHandler, 'get_template', _get_template)
+
+    dashboard.DashboardHandler.contrib_asset_listers.append(list_xblocks)
+    dashboard.DashboardHandler.child_routes.append(
+        [XBlockEditorRESTHandler.URI, XBlockEditorRESTHandler])
+    dashboard.DashboardHandler.child_routes.append(
+        [XBlockArchiveRESTHandler.URI, XBlockArchiveRESTHandler])
+    dashboard.DashboardHandler.child_routes.append(
+        [XBlockArchiveProgressQueryHandler.URI, XBlockArchiveProgressQueryHandler])
+    dashboard.DashboardHandler.child_routes.append(
+        [XBlockExportRESTHandler.URI, XBlockExportRESTHandler])
+    dashboard.DashboardHandler.child_routes.append(
+        [XBlockExportProgressQueryHandler.URI, XBlockExportProgressQueryHandler])
+    dashboard.DashboardHandler.child_routes.append(
+        [XBlockExportDownloadHandler.URI, XBlockExportDownloadHandler])
+    dashboard.DashboardHandler.child_routes.append(
+        [XBlockGarbageCollectionRESTHandler.URI,
+         XBlockGarbageCollectionRESTHandler])
+    dashboard.DashboardHandler.child_routes.append(
+        [XBlockGarbageCollectionProgressQueryHandler.URI,
+         XBlockGarbageCollectionProgressQueryHandler])
+    dashboard.DashboardHandler.child_routes.append(
+        [PackedFieldMigrationRESTHandler.URI, PackedFieldMigrationRESTHandler])
+    dashboard.DashboardHandler.child_routes.append(
+        [PackedFieldMigrationProgressQueryHandler.URI,
+         PackedFieldMigrationProgressQueryHandler])
+
+
+def _remove_editor_from_dashboard():
+    for handler in EDITOR_HANDLERS:
+        dashboard.DashboardHandler.get_actions.remove(handler)
+        delattr(dashboard.DashboardHandler, 'get_%s' % handler)
+
+    setattr(dashboard.DashboardHandler, 'get_template', _orig_get_template)
+
+    dashboard.DashboardHandler.contrib_asset_listers.remove(list_xblocks)
+    dashboard.DashboardHandler.child_routes.remove(
+        [XBlockEditorRESTHandler.URI, XBlockEditorRESTHandler])
+    dashboard.DashboardHandler.child_routes.remove(
+        [XBlockArchiveRESTHandler.URI, XBlockArchiveRESTHandler])
+    dashboard.DashboardHandler.child_routes.remove(
+        [XBlockArchiveProgressQueryHandler.URI, XBlockArchiveProgressQueryHandler])
+    dashboard.DashboardHandler.child_routes.remove(
+        [XBlockExportRESTHandler.URI, XBlockExportRESTHandler])
+    dashboard.DashboardHandler.child_routes.remove(
+        [XBlockExportProgressQueryHandler.URI, XBlockExportProgressQueryHandler])
+    dashboard.DashboardHandler.child_routes.remove(
+        [XBlockExportDownloadHandler.URI, XBlockExportDownloadHandler])
+    dashboard.DashboardHandler.child_routes.remove(
+        [XBlockGarbageCollectionRESTHandler.URI,
+         XBlockGarbageCollectionRESTHandler])
+    dashboard.DashboardHandler.child_routes.remove(
+        [XBlockGarbageCollectionProgressQueryHandler.URI,
+         XBlockGarbageCollectionProgressQueryHandler])
+    dashboard.DashboardHandler.child_routes.remove(
+        [PackedFieldMigrationRESTHandler.URI, PackedFieldMigrationRESTHandler])
+    dashboard.DashboardHandler.child_routes.remove(
+        [PackedFieldMigrationProgressQueryHandler.URI,
+         PackedFieldMigrationProgressQueryHandler])
+
+
+def list_xblocks(the_dashboard):
+    """Prepare a list of the root XBlock usages installed.
+
+    The root usages are listed a page at a time, using the cursor passed in the
+    xblock_cursor request parameter.
+    """
+    if not filer.is_editable_fs(the_dashboard.app_context):
         return safe_dom.NodeList()
 
     output = safe_dom.NodeList()
 
+    # Use the course already loaded for this request rather than a new one
     import_button_text = 'Import'
-    if courses.Course(the_dashboard).get_units():
+    if the_dashboard.get_course().get_units():
         import_button_text = 'Merge'
     output.append(
         safe_dom.Element(
@@ -575,6 +2000,28 @@ def list_xblocks(the_dashboard):
         ).add_text(import_button_text)
     )
 
+    output.append(
+        safe_dom.Element(
+            'a', className='gcb-button gcb-pull-right',
+            href='dashboard?action=export_xblock'
+        ).add_text('Export')
+    )
+
+    output.append(
+        safe_dom.Element(
+            'a', className='gcb-button gcb-pull-right',
+            href='dashboard?action=collect_xblock_garbage'
+        ).add_text('Clean Up')
+    )
+
+    if XBLOCK_PACKED_FIELD_STORAGE.value:
+        output.append(
+            safe_dom.Element(
+                'a', className='gcb-button gcb-pull-right',
+                href='dashboard?action=pack_xblock_fields'
+            ).add_text('Pack Student Data')
+        )
+
     output.append(
         safe_dom.Element(
             'a', className='gcb-button gcb-pull-right',
@@ -584,8 +2031,17 @@ def list_xblocks(the_dashboard):
         safe_dom.Element('div', style='clear: both; padding-top: 2px;')
     ).append(safe_dom.Element('h3').add_text('XBlocks'))
 
-    root_usages = sorted(
-        RootUsageDao.get_all(), key=lambda x: x.description.lower())
+    index_job = _ensure_root_usage_index(the_dashboard.app_context)
+    if index_job.is_active():
+        output.append(safe_dom.Element('p').add_text(
+            messages.XBLOCK_LIST_INDEXING))
+
+    cursor = the_dashboard.request.get('xblock_cursor') or None
+    try:
+        root_usages, next_cursor = RootUsageDao.get_page(cursor=cursor)
+    except (db.BadRequestError, db.BadValueError):
+        root_usages, next_cursor = RootUsageDao.get_page()
+        cursor = None
 
     if root_usages:
         ol = safe_dom.Element('ol')
@@ -600,6 +2056,15 @@ def list_xblocks(the_dashboard):
         output.append(ol)
     else:
         output.append(safe_dom.Element('blockquote').add_text('< none >'))
+
+    if cursor:
+        output.append(safe_dom.Element(
+            'a', href='dashboard?action=assets').add_text('[First page]'))
+    if next_cursor:
+        output.append(safe_dom.Element(
+            'a', href='dashboard?action=assets&%s' % urllib.urlencode(
+                {'xblock_cursor': next_cursor})
+        ).add_text('[Next page]'))
     return output
 
 
@@ -651,7 +2116,7 @@ def _get_import_xblock(the_dashboard):
     extra_js_files = []
 
     extra_js_files.append('resources/import.js')
-    if courses.Course(the_dashboard).get_units():
+    if the_dashboard.get_course().get_units():
         extra_js_files.append('resources/merge.js')
 
     main_content = oeditor.ObjectEditor.get_html_for(
@@ -673,6 +2138,81 @@ def _get_import_xblock(the_dashboard):
     the_dashboard.render_page(template_values)
 
 
+def _get_export_xblock(the_dashboard):
+    """Render the screen for exporting the course as an XBlock archive."""
+    rest_url = the_dashboard.canonicalize_url(XBlockExportRESTHandler.URI)
+    exit_url = the_dashboard.canonicalize_url('/dashboard?action=assets')
+
+    main_content = oeditor.ObjectEditor.get_html_for(
+        the_dashboard,
+        XBlockExportRESTHandler.SCHEMA.get_json_schema(),
+        XBlockExportRESTHandler.SCHEMA.get_schema_dict(),
+        None, rest_url, exit_url,
+        delete_url=None,
+        auto_return=False,
+        save_button_caption='Export',
+        required_modules=XBlockExportRESTHandler.REQUIRED_MODULES,
+        extra_css_files=['resources/import.css'],
+        extra_js_files=['resources/job_progress.js'])
+    template_values = {
+        'page_title': messages.EXPORT_COURSE_PAGE_TITLE,
+        'page_description': messages.EXPORT_COURSE_PAGE_DESCRIPTION,
+        'main_content': main_content}
+    the_dashboard.render_page(template_values)
+
+
+def _get_collect_xblock_garbage(the_dashboard):
+    """Render the screen for deleting the XBlock data no longer in use."""
+    rest_url = the_dashboard.canonicalize_url(
+        XBlockGarbageCollectionRESTHandler.URI)
+    exit_url = the_dashboard.canonicalize_url('/dashboard?action=assets')
+
+    main_content = oeditor.ObjectEditor.get_html_for(
+        the_dashboard,
+        XBlockGarbageCollectionRESTHandler.SCHEMA.get_json_schema(),
+        XBlockGarbageCollectionRESTHandler.SCHEMA.get_schema_dict(),
+        None, rest_url, exit_url,
+        delete_url=None,
+        auto_return=False,
+        save_button_caption='Clean Up',
+        required_modules=XBlockGarbageCollectionRESTHandler.REQUIRED_MODULES,
+        extra_css_files=['resources/import.css'],
+        extra_js_files=['resources/job_progress.js'])
+    template_values = {
+        'page_title': messages.GARBAGE_COLLECTION_PAGE_TITLE,
+        'page_description': messages.GARBAGE_COLLECTION_PAGE_DESCRIPTION,
+        'main_content': main_content}
+    the_dashboard.render_page(template_values)
+
+
+def _get_pack_xblock_fields(the_dashboard):
+    """Render the screen for moving student fields to the packed layout."""
+    rest_url = the_dashboard.canonicalize_url(
+        PackedFieldMigrationRESTHandler.URI)
+    exit_url = the_dashboard.canonicalize_url('/dashboard?action=assets')
+
+    main_content = oeditor.ObjectEditor.get_html_for(
+        the_dashboard,
+        PackedFieldMigrationRESTHandler.SCHEMA.get_json_schema(),
+        PackedFieldMigrationRESTHandler.SCHEMA.get_schema_dict(),
+        None, rest_url, exit_url,
+        delete_url=None,
+        auto_return=False,
+        save_button_caption='Pack',
+        required_modules=PackedFieldMigrationRESTHandler.REQUIRED_MODULES,
+        extra_css_files=['resources/import.css'],
+        extra_js_files=['resources/job_progress.js'])
+    template_values = {
+        'page_title': messages.PACKED_FIELD_MIGRATION_PAGE_TITLE,
+        'page_description': messages.PACKED_FIELD_MIGRATION_PAGE_DESCRIPTION,
+        'main_content': main_content}
+    the_dashboard.render_page(template_values)
+
+
+DUPLICATE_DESCRIPTION_ERROR = (
+    'The description must be different from existing XBlocks.')
+
+
 class XBlockEditorRESTHandler(utils.BaseRESTHandler):
     URI = '/rest/xblock'
 
@@ -700,11 +2240,8 @@ class XBlockEditorRESTHandler(utils.BaseRESTHandler):
         if key:
             root_usage = RootUsageDao.load(key)
             rt = Runtime(self, is_admin=True)
-            block = rt.get_block(root_usage.usage_id)
-            xml_buffer = StringIO()
-            rt.export_to_xml(block, xml_buffer)
             payload_dict = {
-                'xml': xml_buffer.getvalue(),
+                'xml': rt.get_xml(root_usage.usage_id),
                 'description': root_usage.description}
 
         transforms.send_json_response(
@@ -724,13 +2261,9 @@ class XBlockEditorRESTHandler(utils.BaseRESTHandler):
 
         if not validated_dict.get('description'):
             errors.append('Missing description field')
-
-        descriptions = {
-            root.description for root in RootUsageDao.get_all()
-            if not key or root.id != long(key)}
-        if validated_dict['description'] in descriptions:
-            errors.append(
-                'The description must be different from existing XBlocks.')
+        elif RootUsageDao.is_description_taken(
+                validated_dict['description'], the_id=key):
+            errors.append(DUPLICATE_DESCRIPTION_ERROR)
 
         if not validated_dict.get('xml'):
             errors.append('Missing XML data')
@@ -751,26 +2284,49 @@ class XBlockEditorRESTHandler(utils.BaseRESTHandler):
                 self, 401, 'Access denied.', {'key': key})
             return
 
+        if XBlockGarbageCollectionJob(self.app_context).is_active():
+            transforms.send_json_response(
+                self, 412, messages.GARBAGE_COLLECTION_IN_PROGRESS,
+                {'key': key})
+            return
+
         payload, errors = self.import_and_validate(
             key, transforms.loads(request.get('payload')))
         if errors:
             self.validation_error('\n'.join(errors), key=key)
             return
 
+        # Claim the description before writing the tree, so that a tree is
+        # not left orphaned if the description was taken since it was checked
+        try:
+            root_id, reserved = RootUsageDao.reserve_description(
+                payload['description'], the_id=key)
+        except DuplicateDescriptionError:
+            self.validation_error(DUPLICATE_DESCRIPTION_ERROR, key=key)
+            return
+
+        write_counts = {}
         try:
             rt = Runtime(self, is_admin=True)
             usage_id = rt.parse_xml_string(
-                unicode(payload['xml']).encode('utf_8'), None)
+                unicode(payload['xml']).encode('utf_8'), None,
+                write_counts=write_counts)
         except Exception as e:  # pylint: disable=broad-except
+            if reserved:
+                RootUsageDao.release_description(
+                    payload['description'], root_id)
             transforms.send_json_response(self, 412, str(e))
             return
 
         root_usage = RootUsageDto(
-            key, {'description': payload['description'], 'usage_id': usage_id})
-        key = RootUsageDao.save(root_usage)
+            root_id,
+            {'description': payload['description'], 'usage_id': usage_id})
+        key = RootUsageDao.save(root_usage, unique_description=True)
 
+        payload_dict = {'key': key}
+        payload_dict.update(write_counts)
         transforms.send_json_response(
-            self, 200, 'Saved.', payload_dict={'key': key})
+            self, 200, 'Saved.', payload_dict=payload_dict)
 
     def delete(self):
         key = self.request.get('key')
@@ -784,7 +2340,8 @@ class XBlockEditorRESTHandler(utils.BaseRESTHandler):
                 self, 401, 'Access denied.', {'key': key})
             return
 
-        # TODO(jorr): Remove the tree from the UsageStore?
+        # The XBlock tree is left in the datastore, and is reclaimed by
+        # XBlockGarbageCollectionJob.
         RootUsageDao.delete(RootUsageDto(key, {}))
         transforms.send_json_response(self, 200, 'Deleted.')
 
@@ -804,6 +2361,10 @@ class XBlockArchiveRESTHandler(utils.BaseRESTHandler):
         schema_fields.SchemaField(
             'dry_run', 'Dry Run', 'boolean', optional=True,
             description=messages.XBLOCK_ARCHIVE_DRY_RUN))
+    SCHEMA.add_property(
+        schema_fields.SchemaField(
+            'validate_only', 'Quick Check', 'boolean', optional=True,
+            description=messages.XBLOCK_ARCHIVE_VALIDATE_ONLY))
 
     REQUIRED_MODULES = ['inputex-file', 'io-upload-iframe', 'inputex-checkbox']
 
@@ -838,6 +2399,11 @@ class XBlockArchiveRESTHandler(utils.BaseRESTHandler):
                 self, 401, 'Access denied.')
             return
 
+        if XBlockGarbageCollectionJob(self.app_context).is_active():
+            transforms.send_file_upload_response(
+                self, 412, messages.GARBAGE_COLLECTION_IN_PROGRESS)
+            return
+
         try:
             payload = transforms.json_to_dict(
                 transforms.loads(request.get('payload')),
@@ -847,6 +2413,7 @@ class XBlockArchiveRESTHandler(utils.BaseRESTHandler):
             return
 
         dry_run = payload.get('dry_run', False)
+        validate_only = payload.get('validate_only', False)
 
         upload = self.request.POST['file']
 
@@ -857,7 +2424,8 @@ class XBlockArchiveRESTHandler(utils.BaseRESTHandler):
 
         blob_key = blobstore.parse_blob_info(upload).key()
         XBlockArchiveJob(
-            self.app_context, blob_key=blob_key, dry_run=dry_run).submit()
+            self.app_context, blob_key=blob_key, dry_run=dry_run,
+            validate_only=validate_only).submit()
 
         # Pass a new upload url back to the page for future uploads
         new_upload_url = blobstore.create_upload_url(
@@ -869,13 +2437,21 @@ class XBlockArchiveRESTHandler(utils.BaseRESTHandler):
 
 
 class XBlockArchiveJob(jobs.DurableJob):
-    """The offline job which handles installing an uploaded archive file."""
+    """The offline job which handles installing an uploaded archive file.
 
-    def __init__(self, app_context, blob_key=None, dry_run=True):
+    If validate_only is set, the archive is checked without building any
+    XBlocks: the structure, file references, block types, and static file sizes
+    are validated, and the planned changes to units and lessons are reported.
+    """
+
+    def __init__(
+            self, app_context, blob_key=None, dry_run=True,
+            validate_only=False):
         super(XBlockArchiveJob, self).__init__(app_context)
         self.app_context = app_context
         self.blob_key = blob_key
-        self.dry_run = dry_run
+        self.dry_run = dry_run or validate_only
+        self.validate_only = validate_only
 
     @ndb.toplevel
     def run(self):
@@ -898,17 +2474,25 @@ class XBlockArchiveJob(jobs.DurableJob):
             journal = []
             importer = Importer(
                 archive=archive, course=course, fs=self.app_context.fs.impl,
-                rt=rt, dry_run=self.dry_run, journal=journal)
+                rt=rt, dry_run=self.dry_run, journal=journal,
+                validate_only=self.validate_only)
             importer.parse()
 
             validation_errors = importer.validate()
+            if self.validate_only:
+                validation_errors += importer.validate_content()
             if validation_errors:
                 return status(
                     False, 'Import failed: %s' % '\n'.join(validation_errors))
 
             importer.do_import()
 
-            if self.dry_run:
+            if self.validate_only:
+                return status(
+                    True,
+                    'Upload structure successfully validated:\n%s' %
+                    '\n'.join(journal))
+            elif self.dry_run:
                 return status(
                     True,
                     'Upload successfully validated:\n%s' % '\n'.join(journal))
@@ -948,6 +2532,35 @@ class BadImportException(Exception):
     pass
 
 
+def _parse_xml_file(xml_file):
+    return cElementTree.parse(xml_file).getroot()
+
+
+def _parse_html_file(html_file):
+    return tags.html_string_to_element_tree(html_file.read().decode('utf8'))
+
+
+def _copy_element_tree(root):
+    """Make a deep copy of an element tree without using recursion."""
+
+    def copy_element(elt, parent=None):
+        if parent is None:
+            new_elt = cElementTree.Element(elt.tag, dict(elt.attrib))
+        else:
+            new_elt = cElementTree.SubElement(parent, elt.tag, dict(elt.attrib))
+        new_elt.text = elt.text
+        new_elt.tail = elt.tail
+        return new_elt
+
+    new_root = copy_element(root)
+    stack = [(root, new_root)]
+    while stack:
+        elt, new_elt = stack.pop()
+        for child in elt:
+            stack.append((child, copy_element(child, parent=new_elt)))
+    return new_root
+
+
 class Differ(object):
     """Base class for tracking the difference between two lists of objects.
 
@@ -1027,44 +2640,135 @@ class Chapter2UnitMapper(Differ):
 
 
 class Importer(object):
-    """Manages the import of an XBlock archive file."""
+    """Manages the import of an XBlock archive file.
+
+    If validate_only is set, do_import only plans the changes to the units and
+    lessons, and does not build any XBlocks or install any files.
+    """
 
     def __init__(
             self, archive=None, course=None, fs=None, rt=None, dry_run=False,
-            journal=None):
+            journal=None, validate_only=False):
         self.archive = archive
         self.course = course
         self.fs = fs
         self.rt = rt
-        self.dry_run = dry_run
+        self.dry_run = dry_run or validate_only
+        self.validate_only = validate_only
         self.base = self._get_base_folder_name()
         self.course_root = None
         self.journal = journal if journal is not None else []
+        # Problems found while assembling the course DOM
+        self.parse_errors = []
+        # Numbers of XBlock entities written and skipped as unchanged
+        self.write_counts = {}
+        # Maps the path of each file parsed to the time in seconds it took
+        self.parse_timings = collections.OrderedDict()
+        self._parsed_files = {}
+        # Bookkeeping for the root usages created by previous imports
+        self._old_root_usages = {}
+        self._duplicate_root_usages = []
+        self._new_root_usages = []
+        self._updated_root_usages = []
 
     def parse(self):
-        """Assemble the XML files in the archive into a single DOM."""
-        course_file = self.archive.extractfile('%s/course.xml' % self.base)
-        self.course_root = self._walk_tree(
-            cElementTree.parse(course_file).getroot())
+        """Assemble the XML files in the archive into a single DOM.
+
+        Files which are referenced but missing from the archive are recorded in
+        parse_errors, and are reported by validate().
+        """
+        course_root = self._load_file(
+            '%s/course.xml' % self.base, _parse_xml_file)
+        if course_root is not None:
+            self.course_root = self._walk_tree(course_root)
+
+        if self.parse_timings:
+            slowest_path, slowest_time = max(
+                self.parse_timings.iteritems(), key=lambda item: item[1])
+            logging.info(
+                'Parsed %s archive files in %.3fs; slowest was %s (%.3fs)',
+                len(self.parse_timings), sum(self.parse_timings.values()),
+                slowest_path, slowest_time)
 
     def validate(self):
         """Check that the course structure is compatible with CB."""
-        errors = []
+        errors = list(self.parse_errors)
+        if self.course_root is None:
+            return errors
 
         # the root must be a course
         if self.course_root.tag != 'course':
             errors.append('There is no root course tag.')
 
+        # The tree must be shallow enough to serialize and build as XBlocks
+        stack = [(self.course_root, 1)]
+        while stack:
+            node, depth = stack.pop()
+            if depth > MAX_IMPORT_XML_DEPTH:
+                errors.append(
+                    'Content may be nested at most %s levels deep, but <%s> '
+                    '(%s) is nested deeper.' % (
+                        MAX_IMPORT_XML_DEPTH, node.tag,
+                        node.get('usage_id', 'no usage id')))
+                break
+            stack.extend((child, depth + 1) for child in node)
+
         # The immediate children must be chapters
         for child in self.course_root:
             if child.tag != 'chapter':
-                errors.append('All content must be in chapters.')
-                break
+                errors.append(
+                    'All content must be in chapters, but found <%s>.' %
+                    child.tag)
+                continue
             # The grandchildren must be sequentials
             for grandchild in child:
                 if grandchild.tag != 'sequential':
-                    errors.append('Chapters may only contain sequentials.')
-                    break
+                    errors.append(
+                        'Chapters may only contain sequentials, but '
+                        '\'%s\' contains <%s>.' % (
+                            child.get('display_name'), grandchild.tag))
+
+        return errors
+
+    def validate_content(self):
+        """Check block types and static files without building XBlocks.
+
+        Returns:
+            list of str. All the problems found, rather than only the first.
+        """
+        errors = []
+
+        # Every block in the sequentials must be of a whitelisted type. Only
+        # the children of container blocks are blocks; the content of other
+        # blocks (e.g., HTML or Capa problems) is parsed by the block itself.
+        stack = [
+            sequential for chapter in self.course_root for sequential in chapter
+            if chapter.tag == 'chapter' and sequential.tag == 'sequential']
+        block_classes = {}
+        while stack:
+            node = stack.pop()
+            if node.tag not in block_classes:
+                try:
+                    block_classes[node.tag] = xblock.core.XBlock.load_class(
+                        node.tag, select=select_xblock)
+                except (ForbiddenXBlockError,
+                        xblock.plugin.PluginMissingError):
+                    block_classes[node.tag] = None
+            block_class = block_classes[node.tag]
+            if block_class is None:
+                errors.append('Unsupported block type <%s> (%s).' % (
+                    node.tag, node.get('usage_id', 'no usage id')))
+            elif block_class.has_children:
+                stack.extend(node)
+
+        for member in self.archive.getmembers():
+            if (
+                    member.isfile() and
+                    member.name.startswith('%s/static/' % self.base) and
+                    member.size > MAX_ASSET_UPLOAD_SIZE_K * 1024):
+                errors.append(
+                    'Cannot upload files bigger than %s K: \'%s\'' % (
+                        MAX_ASSET_UPLOAD_SIZE_K, member.name))
 
         return errors
 
@@ -1113,7 +2817,8 @@ class Importer(object):
 
         usage_id = self.rt.parse_xml_string(
             xml_buffer.getvalue(), None, orig_xml_str=orig_xml_buff.getvalue(),
-            dry_run=self.dry_run, log=new_xml_buff)
+            dry_run=self.dry_run, log=new_xml_buff,
+            write_counts=self.write_counts)
 
         # Journal the effect of the update
         if orig_xml_buff.getvalue() == new_xml_buff.getvalue():
@@ -1127,33 +2832,73 @@ class Importer(object):
             'XBlock content %(action)s in \'%(title)s\' (%(id)s)' % {
                 'action': action, 'title': lesson.title, 'id': usage_id})
 
-        # Insert a RootUsageEntity to link the lesson to the XBlock
+        # Link the lesson to the XBlock with a RootUsageEntity, reusing the
+        # one from the previous import of this usage if there is one.
         description = 'Unit %s, Lesson %s: %s' % (
             unit.index, lesson.index, lesson.title)
-        root_usage = RootUsageDto(
-            None, {
-                'description': description,
-                'usage_id': usage_id,
-                'is_imported': True})
-        root_id = RootUsageDao.save(root_usage) if not self.dry_run else 'xxx'
+        root_usage = self._old_root_usages.pop(usage_id, None)
+        if root_usage is None:
+            root_usage = RootUsageDto(
+                None, {
+                    'description': description,
+                    'usage_id': usage_id,
+                    'is_imported': True})
+            self._new_root_usages.append((root_usage, lesson))
+            root_id = 'xxx'
+        else:
+            if root_usage.description != description:
+                root_usage.dict['description'] = description
+                self._updated_root_usages.append(root_usage)
+            root_id = root_usage.id
 
         # insert the xblock asset into lesson content
+        self._set_lesson_root_id(lesson, root_id)
+
+    def _set_lesson_root_id(self, lesson, root_id):
         lesson.objectives = '<xblock root_id="%s"></xblock>' % root_id
 
-    def _delete_all_imported_root_usage_dtos(self):
-        dao = RootUsageDao()
-        for dto in RootUsageDao.get_all():
-            if dto.is_imported:
-                dao.delete(dto)
+    def _load_imported_root_usages(self):
+        """Index the root usages created by previous imports by usage id."""
+        for dto in RootUsageDao.iter_all():
+            if not dto.is_imported:
+                continue
+            if dto.usage_id in self._old_root_usages:
+                self._duplicate_root_usages.append(dto)
+            else:
+                self._old_root_usages[dto.usage_id] = dto
 
-    def do_import(self):
-        """Perform the import and create resources in CB."""
-        finalize_writes_callback = self._import_static_files()
+    def _save_imported_root_usages(self):
+        """Write only the changes to the imported root usages, in batches.
 
-        if not self.dry_run:
-            self._delete_all_imported_root_usage_dtos()
+        Root usages whose usage is still in the course are kept (with their
+        description updated if needed), so that the root ids in the lesson
+        bodies do not change. New usages get new root usages, and the root
+        usages of usages which are no longer in the course are deleted.
+        """
+        if self.dry_run:
+            return
 
-        cu_mapper = Chapter2UnitMapper(self)
+        RootUsageDao.save_all(self._updated_root_usages)
+
+        new_root_ids = RootUsageDao.save_all(
+            [dto for dto, unused_lesson in self._new_root_usages])
+        for (unused_dto, lesson), root_id in zip(
+                self._new_root_usages, new_root_ids):
+            self._set_lesson_root_id(lesson, root_id)
+
+        RootUsageDao.delete_all(
+            self._old_root_usages.values() + self._duplicate_root_usages)
+
+    def do_import(self):
+        """Perform the import and create resources in CB."""
+        if self.validate_only:
+            # No XBlocks are built, so the root usages are not needed
+            finalize_writes_callback = lambda: None
+        else:
+            finalize_writes_callback = self._import_static_files()
+            self._load_imported_root_usages()
+
+        cu_mapper = Chapter2UnitMapper(self)
         for chapter in self.course_root:
             chapter_usage_id = chapter.attrib['usage_id']
             unit = cu_mapper.bindings.get(chapter_usage_id)
@@ -1174,7 +2919,9 @@ class Importer(object):
                     lesson = self._create_lesson(sequential, unit)
 
                 sl_mapper.bind(sequential, lesson)
-                self._update_lesson_xblock_content(sequential, unit, lesson)
+                if not self.validate_only:
+                    self._update_lesson_xblock_content(
+                        sequential, unit, lesson)
 
             for lesson in sl_mapper.orphans:
                 self.journal.append('Delete lesson \'%s\'' % lesson.title)
@@ -1184,6 +2931,13 @@ class Importer(object):
             self.journal.append('Delete unit \'%s\'' % unit.title)
             self.course.delete_unit(unit)
 
+        self._save_imported_root_usages()
+
+        if self.write_counts:
+            self.journal.append(
+                'XBlock entities: %(written)s written, %(skipped)s unchanged' %
+                self.write_counts)
+
         # Wait for async db operations to complete
         finalize_writes_callback()
 
@@ -1193,71 +2947,1208 @@ class Importer(object):
                 return member.name
         return None
 
-    def _walk_tree(self, node):
-        if 'url_name' in node.attrib:
-            # If the node refers to another file. open it and merge it in
+    def _load_file(self, path, parse_fn):
+        """Parse a file in the archive, reading and parsing each file only once.
+
+        The first caller receives the parsed tree itself, and later callers a
+        copy of it. By then the tree may have been partly merged into the
+        course DOM, but merging is idempotent (expanded references and html
+        filenames are removed, and rebased links no longer start with
+        /static/), so the copy is merged to the same result.
+
+        Args:
+            path: str. The path of the file in the archive.
+            parse_fn: callable. Reads a file object and returns an Element.
+
+        Returns:
+            Element. The root of the parsed file or a copy of it, or None if
+            the file is missing.
+        """
+        if path in self._parsed_files:
+            if self._parsed_files[path] is None:
+                return None
+            return _copy_element_tree(self._parsed_files[path])
+
+        start = time.time()
+        try:
+            target_file = self.archive.extractfile(path)
+        except KeyError:
+            self.parse_errors.append(
+                'The archive is missing the file \'%s\'.' % path)
+            self._parsed_files[path] = None
+            return None
+        self._parsed_files[path] = parse_fn(target_file)
+        self.parse_timings[path] = time.time() - start
+        return self._parsed_files[path]
+
+    def _expand_url_name(self, node, ancestors):
+        """Replace a node which refers to another file by that file's content.
+
+        Args:
+            node: Element. The node to expand.
+            ancestors: frozenset. The paths of the files which have been
+                expanded on the way down to this node.
+
+        Returns:
+            A pair (node, ancestors) of the expanded node and the set of paths
+            extended with any files loaded to expand it.
+        """
+        if 'url_name' not in node.attrib:
+            return node, ancestors
+
+        usage_id = node.attrib['url_name']
+        while 'url_name' in node.attrib:
             target_path = '%s/%s/%s.xml' % (
                 self.base, node.tag, node.attrib['url_name'])
-            target_file = self.archive.extractfile(target_path)
-            sub_tree = self._walk_tree(
-                cElementTree.parse(target_file).getroot())
-            sub_tree.attrib['usage_id'] = node.attrib['url_name']
-            return sub_tree
-        elif node.tag == 'html':
-            if 'filename' in node.attrib:
-                # If the node is an <html/> block with externalized content,
-                # read it in.
-                target_path = '%s/html/%s.html' % (
-                    self.base, node.attrib['filename'])
-                target_file = self.archive.extractfile(target_path)
-                node.append(tags.html_string_to_element_tree(
-                    target_file.read().decode('utf8')))
-                del node.attrib['filename']
+            if target_path in ancestors:
+                raise BadImportException(
+                    'Circular reference to \'%s\'' % target_path)
+            ancestors = ancestors.union([target_path])
+            target = self._load_file(target_path, _parse_xml_file)
+            if target is None:
+                # Leave a placeholder so that the rest can be validated
+                target = cElementTree.Element(node.tag)
+            node = target
+        node.attrib['usage_id'] = usage_id
+        return node, ancestors
+
+    def _insert_html_file(self, node):
+        """Read in the content of an <html/> block with externalized content."""
+        if 'filename' in node.attrib:
+            target_path = '%s/html/%s.html' % (
+                self.base, node.attrib['filename'])
+            content = self._load_file(target_path, _parse_html_file)
+            if content is not None:
+                node.append(content)
+            del node.attrib['filename']
+
+    def _walk_tree(self, root):
+        """Merge all the files referred to by the tree into a single DOM.
+
+        The tree is walked with an explicit stack rather than by recursion, so
+        that deeply nested courses do not exceed the recursion limit.
+
+        Args:
+            root: Element. The root of the course tree.
+
+        Returns:
+            Element. The root of the assembled tree.
+        """
+        html_nodes = []
+        root, ancestors = self._expand_url_name(root, frozenset())
+        stack = [(root, ancestors)]
+
+        while stack:
+            node, ancestors = stack.pop()
+            if node.tag == 'html':
+                self._insert_html_file(node)
+                html_nodes.append(node)
+                continue
+            for index, child in enumerate(list(node)):
+                child, child_ancestors = self._expand_url_name(child, ancestors)
+                node[index] = child
+                stack.append((child, child_ancestors))
+
+        for node in html_nodes:
             self._rebase_html_refs(node)
-            return node
-        else:
-            for index, child in enumerate(node):
-                new_child = self._walk_tree(child)
-                node.remove(child)
-                node.insert(index, new_child)
-            return node
+
+        return root
 
     def _rebase_html_refs(self, node):
         """Rebase HTML references based on /static to use CB namespace."""
-        for attr in ['href', 'src']:
-            if node.attrib.get(attr, '').startswith('/static/'):
-                node.attrib[attr] = 'assets/img%s' % node.attrib[attr]
-        for child in node:
-            self._rebase_html_refs(child)
+        for elt in node.iter():
+            for attr in ['href', 'src']:
+                if elt.attrib.get(attr, '').startswith('/static/'):
+                    elt.attrib[attr] = 'assets/img%s' % elt.attrib[attr]
 
     def _import_static_files(self):
-        filedata_list = []
-        for member in self.archive.getmembers():
+        """Install the archive's /static files into /assets/img/static.
+
+        The existence and the content digests of all the target files are
+        looked up in batches up front, so that unchanged files can be skipped.
+        New and changed files are uploaded in batches of
+        STATIC_FILE_UPLOAD_BATCH_SIZE, with at most
+        STATIC_FILE_UPLOAD_MAX_PENDING_BATCHES batches in flight at a time.
+
+        Note that digests are only recorded for files written by the importer,
+        so a file which was replaced by other means since the last import will
+        not be overwritten unless its content in the archive has changed.
+
+        Returns:
+            callable. A callback which blocks until all the writes are complete.
+        """
+        members = [
+            member for member in self.archive.getmembers()
             if member.isfile() and member.name.startswith(
-                    '%s/static/' % self.base):
-                self._insert_filedata(filedata_list, member)
+                '%s/static/' % self.base)]
+
+        for member in members:
+            if member.size > MAX_ASSET_UPLOAD_SIZE_K * 1024:
+                raise BadImportException(
+                    'Cannot upload files bigger than %s K' %
+                    MAX_ASSET_UPLOAD_SIZE_K)
+
+        ph_paths = [
+            '/assets/img/%s' % member.name[len(self.base) + 1:]
+            for member in members]
+        existing_paths = set(self.fs.list(
+            self.fs.physical_to_logical('/assets/img/static/')))
+        old_digests = {}
+        for chunk in _chunks(ph_paths, DATASTORE_BATCH_SIZE):
+            for entity in StaticFileDigestEntity.get_by_key_name(chunk):
+                if entity is not None:
+                    old_digests[entity.key().name()] = entity.digest
+
+        stats = collections.OrderedDict(
+            (action, {'count': 0, 'bytes': 0})
+            for action in ['inserted', 'updated', 'skipped'])
+        filedata_list = []
+        new_digest_entities = []
+        pending_callbacks = collections.deque()
+
+        def flush_filedata_list():
+            if len(pending_callbacks) >= STATIC_FILE_UPLOAD_MAX_PENDING_BATCHES:
+                pending_callbacks.popleft()()
+            pending_callbacks.append(self.fs.put_multi_async(filedata_list[:]))
+            del filedata_list[:]
+
+        for member, ph_path in zip(members, ph_paths):
+            path = self.fs.physical_to_logical(ph_path)
+            data = self.archive.extractfile(member)
+            digest = hashlib.sha1(data.read()).hexdigest()
+
+            if path not in existing_paths:
+                action = 'inserted'
+                self.journal.append('Inserting file \'%s\'' % ph_path)
+            elif old_digests.get(ph_path) != digest:
+                action = 'updated'
+                self.journal.append('Updating file \'%s\'' % ph_path)
+            else:
+                action = 'skipped'
+                self.journal.append(
+                    'Skipping unchanged file \'%s\'' % ph_path)
+            stats[action]['count'] += 1
+            stats[action]['bytes'] += member.size
+
+            if self.dry_run or action == 'skipped':
+                continue
+
+            data.seek(0)
+            filedata_list.append((path, data))
+            new_digest_entities.append(
+                StaticFileDigestEntity(key_name=ph_path, digest=digest))
+            if len(filedata_list) >= STATIC_FILE_UPLOAD_BATCH_SIZE:
+                flush_filedata_list()
+
+        if filedata_list:
+            flush_filedata_list()
 
-        return self.fs.put_multi_async(filedata_list)
+        if members:
+            self.journal.append('Static files: %s' % ', '.join(
+                '%s %s (%s bytes)' % (item['count'], action, item['bytes'])
+                for action, item in stats.iteritems()))
 
-    def _insert_filedata(self, filedata_list, member):
-        """Extract the tarfile member into /assets/img/static."""
-        ph_path = '/assets/img/%s' % member.name[len(self.base) + 1:]
-        path = self.fs.physical_to_logical(ph_path)
+        def wait_and_finalize():
+            while pending_callbacks:
+                pending_callbacks.popleft()()
+            # Only record the digests once the file writes have succeeded
+            for chunk in _chunks(new_digest_entities, DATASTORE_BATCH_SIZE):
+                db.put(chunk)
 
-        if self.fs.isfile(path):
-            self.journal.append('Updating file \'%s\'' % ph_path)
+        return wait_and_finalize
+
+
+# XBlock export section
+
+
+class XBlockExportRESTHandler(utils.BaseRESTHandler):
+    """Provide the REST API for exporting the course as an XBlock archive."""
+
+    URI = '/rest/xblock_export'
+
+    SCHEMA = schema_fields.FieldRegistry(
+        'XBlock Export', description='XBlock course export')
+
+    REQUIRED_MODULES = []
+
+    XSRF_TOKEN = 'xblock-export'
+
+    def get(self):
+        """Provide empty inital content for export editor."""
+        transforms.send_json_response(
+            self, 200, 'Success',
+            payload_dict={
+                'poller_url': self.canonicalize_url(
+                    XBlockExportProgressQueryHandler.URI)},
+            xsrf_token=utils.XsrfTokenManager.create_xsrf_token(
+                self.XSRF_TOKEN))
+
+    def put(self):
+        request = transforms.loads(self.request.get('request'))
+        if not self.assert_xsrf_token_or_fail(
+                request, self.XSRF_TOKEN, {'key': ''}):
+            return
+
+        # The export reads all the course content and writes a blob, so it
+        # needs the same rights as an import
+        if not unit_lesson_editor.CourseOutlineRights.can_edit(self):
+            transforms.send_json_response(self, 401, 'Access denied.')
+            return
+
+        job = XBlockExportJob(self.app_context)
+        if job.is_active():
+            transforms.send_json_response(
+                self, 412, 'An export is already in progress.')
+            return
+        job.submit()
+
+        transforms.send_json_response(self, 200, 'Exporting course...')
+
+
+class XBlockExportProgressQueryHandler(utils.BaseRESTHandler):
+    """A handler to respond to Ajax polling on the progress of the export."""
+
+    URI = '/rest/xblock_export_progress'
+
+    def get(self):
+        job = XBlockExportJob(self.app_context)
+        if job.is_active():
+            payload_dict = {'complete': False}
         else:
-            self.journal.append('Inserting file \'%s\'' % ph_path)
+            # The export tasks report the outcome of a run which got that far
+            state = job.load_export_state()
+            if state is not None and state.message:
+                output = transforms.dumps(
+                    {'success': state.success, 'message': state.message})
+            else:
+                job_entity = job.load()
+                output = job_entity.output if job_entity else None
+            payload_dict = {'complete': True, 'output': output}
+            if state is not None and state.blob_key:
+                payload_dict['download_url'] = self.canonicalize_url(
+                    XBlockExportDownloadHandler.URI)
 
-        if member.size > MAX_ASSET_UPLOAD_SIZE_K * 1024:
-            raise BadImportException(
-                'Cannot upload files bigger than %s K' %
-                MAX_ASSET_UPLOAD_SIZE_K)
+        transforms.send_json_response(
+            self, 200, 'Polling', payload_dict=payload_dict)
 
-        if self.dry_run:
+
+class XBlockExportDownloadHandler(utils.BaseHandler):
+    """Serve the archive written by the most recent export of the course."""
+
+    URI = '/xblock_export_download'
+
+    def get(self):
+        if not unit_lesson_editor.CourseOutlineRights.can_view(self):
+            self.error(401)
             return
 
-        filedata_list.append((path, self.archive.extractfile(member)))
+        state = XBlockExportJob(self.app_context).load_export_state()
+        if state is None or not state.blob_key:
+            self.error(404)
+            return
+
+        # The blob is streamed to the client by App Engine rather than by this
+        # handler.
+        self.response.headers[blobstore.BLOB_KEY_HEADER] = state.blob_key
+        self.response.headers['Content-Type'] = 'application/x-gzip'
+        self.response.headers['Content-Disposition'] = (
+            'attachment; filename=%s.tar.gz' % EXPORT_BASE_FOLDER)
+
+
+class XBlockExportStateEntity(ndb.Model):
+    """The progress of XBlockExportJob, and the archive it last wrote.
+
+    There is one per course, with key id EXPORT_STATE_ID.
+    """
+    _use_cache = False
+    _use_memcache = False
+
+    run_id = ndb.StringProperty(indexed=False)
+    # The files API name of the blob being written
+    file_name = ndb.StringProperty(indexed=False)
+    # JSON lists of the ids of the units to export and of the chapters written
+    unit_ids = ndb.TextProperty()
+    chapter_ids = ndb.TextProperty()
+    # The index of the next task: one per unit, then one per batch of files
+    step = ndb.IntegerProperty(indexed=False, default=0)
+    static_count = ndb.IntegerProperty(indexed=False, default=0)
+    static_size = ndb.IntegerProperty(indexed=False, default=0)
+    # JSON list of the lines of the export journal
+    journal = ndb.TextProperty()
+    complete = ndb.BooleanProperty(indexed=False, default=False)
+    success = ndb.BooleanProperty(indexed=False, default=False)
+    message = ndb.TextProperty()
+    # The blob key of the last archive written successfully
+    blob_key = ndb.StringProperty(indexed=False)
+
+
+class XBlockExportJob(jobs.DurableJob):
+    """The offline job which exports the course as an XBlock archive.
+
+    The archive has the layout read by Importer: course.xml lists the chapters,
+    each unit is written to chapter/<id>.xml and each lesson to
+    sequential/<id>.xml, the content of HTML blocks is written to html/<id>.html
+    and the files in /assets/img/static are written to static/.
+
+    The job itself only lists the units and opens the blob. The archive is
+    built by a chain of deferred tasks, one for each unit and one for each
+    batch of EXPORT_STATIC_FILE_BATCH_SIZE static files, each of which
+    appends a gzip member to the blob. Gzip readers treat the concatenated
+    members as a single stream, so the blob reads as one compressed tar. Its
+    progress is kept in an XBlockExportStateEntity, and the job counts as
+    active until the archive is complete. The archive of the previous export
+    is deleted once the new one has been written.
+    """
+
+    def __init__(self, app_context):
+        super(XBlockExportJob, self).__init__(app_context)
+        self.app_context = app_context
+
+    def is_active(self):
+        if super(XBlockExportJob, self).is_active():
+            return True
+        state = self.load_export_state()
+        return state is not None and not state.complete
+
+    def load_export_state(self):
+        """Load the XBlockExportStateEntity of the course."""
+        old_namespace = namespace_manager.get_namespace()
+        try:
+            namespace_manager.set_namespace(
+                self.app_context.get_namespace_name())
+            return ndb.Key(XBlockExportStateEntity, EXPORT_STATE_ID).get()
+        finally:
+            namespace_manager.set_namespace(old_namespace)
+
+    def run(self):
+        def status(success_flag, message):
+            return {
+                'success': success_flag,
+                'message': message}
+
+        if XBlockArchiveJob(self.app_context).is_active():
+            return status(
+                False, 'Export not started: an import is in progress.')
+
+        course = courses.Course(None, app_context=self.app_context)
+        unit_ids = [unit.unit_id for unit in course.get_units()]
+
+        file_name = files.blobstore.create(
+            mime_type='application/x-gzip',
+            _blobinfo_uploaded_filename='%s.tar.gz' % EXPORT_BASE_FOLDER)
+        with files.open(file_name, 'a') as blob_file:
+            archive = _ArchiveMemberWriter(blob_file)
+            Exporter(archive=archive).add_folder(EXPORT_BASE_FOLDER)
+            archive.close()
+
+        # Keep the key of the previous archive until the new one is written
+        old_state = ndb.Key(XBlockExportStateEntity, EXPORT_STATE_ID).get()
+        state = XBlockExportStateEntity(
+            id=EXPORT_STATE_ID, run_id=uuid.uuid4().hex, file_name=file_name,
+            unit_ids=transforms.dumps(unit_ids),
+            chapter_ids=transforms.dumps([]), journal=transforms.dumps([]),
+            blob_key=old_state.blob_key if old_state else None)
+        self._defer_step(state, transactional=False)
+
+        return status(True, 'Exporting %s units.' % len(unit_ids))
+
+    def export_step(self, run_id, step):
+        """Append one unit or one batch of static files to the archive.
+
+        Args:
+            run_id: str. The id of the export run.
+            step: int. The index of the unit to write, or the number of units
+                plus the index of the batch of static files to write.
+        """
+        state = ndb.Key(XBlockExportStateEntity, EXPORT_STATE_ID).get()
+        if (state is None or state.run_id != run_id or state.complete or
+                state.step != step):
+            # The step belongs to another run, or has already been written
+            return
+
+        unit_ids = transforms.loads(state.unit_ids)
+        chapter_ids = transforms.loads(state.chapter_ids)
+        journal = transforms.loads(state.journal)
+        old_blob_key = None
+        try:
+            with files.open(state.file_name, 'a') as blob_file:
+                archive = _ArchiveMemberWriter(blob_file)
+                exporter = Exporter(
+                    archive=archive,
+                    course=courses.Course(None, app_context=self.app_context),
+                    fs=self.app_context.fs.impl,
+                    rt=Runtime(self, is_admin=True), journal=journal)
+                if step < len(unit_ids):
+                    chapter_id = exporter.export_unit_by_id(unit_ids[step])
+                    if chapter_id:
+                        chapter_ids.append(chapter_id)
+                else:
+                    if step == len(unit_ids):
+                        exporter.export_course_xml(chapter_ids)
+                    paths = exporter.get_static_file_paths()
+                    start = (
+                        (step - len(unit_ids)) * EXPORT_STATIC_FILE_BATCH_SIZE)
+                    batch = paths[start:start + EXPORT_STATIC_FILE_BATCH_SIZE]
+                    count, size = exporter.export_static_files(batch)
+                    state.static_count += count
+                    state.static_size += size
+                    state.complete = (
+                        start + EXPORT_STATIC_FILE_BATCH_SIZE >= len(paths))
+                    if state.complete:
+                        archive.add_end_of_archive()
+                archive.close()
+
+            if state.complete:
+                files.finalize(state.file_name)
+                if state.static_count:
+                    journal.append('Static files: %s exported (%s bytes)' % (
+                        state.static_count, state.static_size))
+                old_blob_key = state.blob_key
+                state.blob_key = str(
+                    files.blobstore.get_blob_key(state.file_name))
+                state.success = True
+                state.message = (
+                    'Course successfully exported:\n%s' % '\n'.join(journal))
+        except Exception as e:  # pylint: disable=broad-except
+            # The partly written blob cannot be resumed, so give up the run
+            # rather than let the task be retried.
+            logging.exception('Export failed')
+            state.complete = True
+            state.success = False
+            state.message = 'Export failed: %s' % e
+
+        state.step += 1
+        state.chapter_ids = transforms.dumps(chapter_ids)
+        state.journal = transforms.dumps(journal)
+        ndb.transaction(lambda: self._defer_step(state, transactional=True))
+
+        if old_blob_key:
+            blobstore.delete(old_blob_key)
+
+    def _defer_step(self, state, transactional):
+        """Save the state, and queue the next step unless it is complete."""
+        state.put()
+        if not state.complete:
+            deferred.defer(
+                _export_xblock_step, self.app_context.get_namespace_name(),
+                state.run_id, state.step, _transactional=transactional)
+
+
+def _export_xblock_step(namespace, run_id, step):
+    """Deferred task writing one step of XBlockExportJob."""
+    old_namespace = namespace_manager.get_namespace()
+    try:
+        namespace_manager.set_namespace(namespace)
+        XBlockExportJob(
+            sites.get_app_context_for_namespace(namespace)).export_step(
+                run_id, step)
+    finally:
+        namespace_manager.set_namespace(old_namespace)
+
+
+class _ArchiveMemberWriter(object):
+    """Writes tar entries to the blob of an archive as one gzip member.
+
+    The writer has the addfile method of tarfile.TarFile, but does not write
+    the end of archive marker on close, so that the members written by
+    successive tasks can be concatenated. The compressed data is sent to the
+    blob in chunks of EXPORT_WRITE_BUFFER_SIZE.
+    """
+
+    def __init__(self, blob_file):
+        self._blob_file = blob_file
+        self._buffer = StringIO()
+        self._gzip = gzip.GzipFile(filename='', mode='wb', fileobj=self._buffer)
+
+    def addfile(self, info, fileobj=None):
+        self._write(info.tobuf())
+        if fileobj is not None:
+            self._write(fileobj.read())
+            remainder = info.size % tarfile.BLOCKSIZE
+            if remainder:
+                self._write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+
+    def add_end_of_archive(self):
+        self._write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+
+    def close(self):
+        self._gzip.close()
+        self._flush()
+
+    def _write(self, data):
+        self._gzip.write(data)
+        if self._buffer.tell() >= EXPORT_WRITE_BUFFER_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self._blob_file.write(self._buffer.getvalue())
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+
+class Exporter(object):
+    """Writes the units, lessons and static files of a course to an archive.
+
+    This is the inverse of Importer: exporting a course and importing the
+    archive into another course reproduces the units, the lessons and their
+    XBlock content.
+    """
+
+    def __init__(
+            self, archive=None, course=None, fs=None, rt=None, journal=None):
+        self.archive = archive
+        self.course = course
+        self.fs = fs
+        self.rt = rt
+        self.journal = journal if journal is not None else []
+
+    def add_folder(self, path):
+        info = tarfile.TarInfo(name=path)
+        info.type = tarfile.DIRTYPE
+        info.mode = 0755
+        info.mtime = time.time()
+        self.archive.addfile(info)
+
+    def export_unit_by_id(self, unit_id):
+        """Write a unit and its lessons to a chapter file.
+
+        Returns:
+            str. The id of the chapter, or None if the unit was not exported.
+        """
+        unit = self.course.find_unit_by_id(unit_id)
+        if unit is None:
+            return None
+        if unit.type != verify.UNIT_TYPE_UNIT:
+            self.journal.append(
+                'Skipping \'%s\' which is not a unit' % unit.title)
+            return None
+
+        chapter_id = unit.properties.get('xblock.usage_id') or uuid.uuid4().hex
+        chapter = etree.Element('chapter', display_name=unit.title)
+        for lesson in self.course.get_lessons(unit.unit_id):
+            sequential_id = self._export_lesson(lesson)
+            if sequential_id:
+                etree.SubElement(chapter, 'sequential', url_name=sequential_id)
+        self._add_xml_file('chapter/%s.xml' % chapter_id, chapter)
+        self.journal.append('Exported unit \'%s\'' % unit.title)
+        return chapter_id
+
+    def export_course_xml(self, chapter_ids):
+        course_root = etree.Element('course')
+        for chapter_id in chapter_ids:
+            etree.SubElement(course_root, 'chapter', url_name=chapter_id)
+        self._add_xml_file('course.xml', course_root)
+
+    def get_static_file_paths(self):
+        """List the static files of the course, in a stable order."""
+        return sorted(self.fs.list(
+            self.fs.physical_to_logical('/assets/img/static/')))
+
+    def export_static_files(self, paths):
+        """Write static files to the archive.
+
+        Returns:
+            (int, int). The number of files written and their total size.
+        """
+        static_folder = self.fs.physical_to_logical('/assets/img/static/')
+        count = 0
+        size = 0
+        for path in paths:
+            stream = self.fs.get(path)
+            if stream is None:
+                continue
+            data = stream.read()
+            self._add_file(
+                'static/%s' % os.path.relpath(path, static_folder), data)
+            count += 1
+            size += len(data)
+        return count, size
+
+    def _export_lesson(self, lesson):
+        """Write the XBlocks in a lesson to a sequential file.
+
+        A lesson whose only content is a sequential block is exported as that
+        block. Otherwise the XBlocks in the lesson are wrapped in a new
+        sequential.
+
+        Returns:
+            str. The id of the sequential, or None if the lesson has no XBlocks.
+        """
+        root_ids = self._get_root_ids(lesson.objectives)
+        usage_ids = RootUsageDao.get_usage_ids(root_ids)
+        blocks = [
+            self.rt.get_block(usage_ids[root_id])
+            for root_id in root_ids if root_id in usage_ids]
+
+        if not blocks:
+            self.journal.append(
+                'Skipping lesson \'%s\' which has no XBlocks' % lesson.title)
+            return None
+
+        sequential = etree.Element('unknown_root')
+        if len(blocks) == 1 and blocks[0].xml_element_name() == 'sequential':
+            sequential_id = blocks[0].scope_ids.usage_id
+            sequential.set('usage_id', sequential_id)
+            blocks[0].export_xml(sequential)
+        else:
+            sequential_id = uuid.uuid4().hex
+            sequential.tag = 'sequential'
+            for block in blocks:
+                self.rt.add_block_as_child_node(block, sequential)
+        sequential.set('display_name', lesson.title)
+
+        for html in list(sequential.iter('html')):
+            self._export_html_content(html)
+
+        self._add_xml_file('sequential/%s.xml' % sequential_id, sequential)
+        return sequential_id
+
+    def _get_root_ids(self, html_string):
+        if not html_string:
+            return []
+        root = tags.html_string_to_element_tree(html_string)
+        return [
+            elt.attrib['root_id'] for elt in root.iter(XBlockTag.binding_name)
+            if elt.attrib.get('root_id')]
+
+    def _export_html_content(self, html):
+        """Move the content of an HTML block into an html/ file."""
+        for elt in html.iter():
+            for attr in ['href', 'src']:
+                value = elt.get(attr) or ''
+                if value.startswith('assets/img/static/'):
+                    elt.set(attr, value[len('assets/img'):])
+
+        content = (html.text or '') + ''.join(
+            etree.tostring(child, method='html', encoding=unicode)
+            for child in html)
+        html_id = html.get('usage_id') or uuid.uuid4().hex
+        self._add_file('html/%s.html' % html_id, content.encode('utf8'))
+
+        html.text = None
+        for child in list(html):
+            html.remove(child)
+        html.set('filename', html_id)
+
+    def _add_xml_file(self, path, root):
+        self._add_file(path, etree.tostring(
+            root, xml_declaration=True, encoding='utf8', pretty_print=True))
+
+    def _add_file(self, path, data):
+        info = tarfile.TarInfo(name='%s/%s' % (EXPORT_BASE_FOLDER, path))
+        info.size = len(data)
+        info.mode = 0644
+        info.mtime = time.time()
+        self.archive.addfile(info, StringIO(data))
+
+
+# Garbage collection section
+
+
+class XBlockGarbageMarkEntity(ndb.Model):
+    """Marks a block reachable in a run of XBlockGarbageCollectionJob.
+
+    The key id is the usage id or definition id of the block. The marks are
+    deleted at the end of the run.
+    """
+    _use_cache = False
+    _use_memcache = False
+
+    run_id = ndb.StringProperty(indexed=False)
+
+
+class XBlockGarbageCollectionStateEntity(ndb.Model):
+    """The progress of the sweep of XBlockGarbageCollectionJob.
+
+    There is one per course, with key id GC_STATE_ID.
+    """
+    _use_cache = False
+    _use_memcache = False
+
+    run_id = ndb.StringProperty(indexed=False)
+    dry_run = ndb.BooleanProperty(indexed=False)
+    # The index in SWEEP_PHASES and the cursor of the next batch
+    phase = ndb.IntegerProperty(indexed=False, default=0)
+    cursor = ndb.StringProperty(indexed=False)
+    # The version of the list of root usages when the roots were last marked
+    root_list_version = ndb.StringProperty(indexed=False)
+    # JSON dict of the numbers of blocks marked and entities collected
+    counts = ndb.TextProperty()
+    complete = ndb.BooleanProperty(indexed=False, default=False)
+    message = ndb.TextProperty()
+
+
+class XBlockGarbageCollectionJob(jobs.DurableJob):
+    """The offline job which deletes XBlock data no longer in any content tree.
+
+    Editing an XBlock or merging an archive can detach blocks from their tree,
+    and deleting a root usage detaches a whole tree, but the definitions,
+    usages, and field data of the detached blocks are left in the datastore.
+    This job marks every block reachable from a root usage or from a lesson
+    imported from an archive, and then sweeps away the unreachable entities.
+    In a dry run the unreachable entities are counted but not deleted.
+
+    The job itself only marks the reachable blocks, writing an
+    XBlockGarbageMarkEntity for each. The sweep runs in a chain of deferred
+    tasks, each of which reads one batch of keys from a cursor, and which are
+    spaced by GC_SWEEP_DELAY_SEC to limit the load on the datastore. Its
+    progress is kept in an XBlockGarbageCollectionStateEntity, and the job
+    counts as active until the sweep is complete.
+
+    Imports and editor saves are refused while the job is active. Any roots
+    added since marking began are marked at the start of each phase of the
+    sweep, and whenever the list of root usages changes, so that blocks
+    attached to a root are kept.
+    """
+
+    # The models swept, in order, with the name under which each is counted
+    SWEEP_PHASES = [
+        (store.UsageEntity, 'usages'),
+        (store.DefinitionEntity, 'definitions'),
+        (store.KeyValueEntity, 'key_values'),
+        (PackedKeyValueEntity, 'key_values'),
+        (XmlExportEntity, 'exports'),
+        (XBlockGarbageMarkEntity, None)]
+
+    def __init__(self, app_context, dry_run=True):
+        super(XBlockGarbageCollectionJob, self).__init__(app_context)
+        self.app_context = app_context
+        self.dry_run = dry_run
+
+    def is_active(self):
+        if super(XBlockGarbageCollectionJob, self).is_active():
+            return True
+        state = self.load_sweep_state()
+        return state is not None and not state.complete
+
+    def load_sweep_state(self):
+        """Load the XBlockGarbageCollectionStateEntity of the course."""
+        old_namespace = namespace_manager.get_namespace()
+        try:
+            namespace_manager.set_namespace(
+                self.app_context.get_namespace_name())
+            return ndb.Key(
+                XBlockGarbageCollectionStateEntity, GC_STATE_ID).get()
+        finally:
+            namespace_manager.set_namespace(old_namespace)
+
+    def run(self):
+        def status(success_flag, message):
+            return {
+                'success': success_flag,
+                'message': message}
+
+        # Drop the state of the previous run
+        ndb.Key(XBlockGarbageCollectionStateEntity, GC_STATE_ID).delete()
+
+        if XBlockArchiveJob(self.app_context).is_active():
+            return status(
+                False, 'Garbage collection cannot run during an import.')
+
+        run_id = uuid.uuid4().hex
+        # pylint: disable=protected-access
+        root_list_version = RootUsageDao._get_list_version()
+        # pylint: enable=protected-access
+        reachable_count = self._mark(self._get_root_usage_ids(), run_id)
+
+        XBlockGarbageCollectionStateEntity(
+            id=GC_STATE_ID, run_id=run_id, dry_run=self.dry_run,
+            root_list_version=root_list_version,
+            counts=transforms.dumps({'reachable': reachable_count})).put()
+        deferred.defer(
+            _sweep_xblock_garbage, self.app_context.get_namespace_name(),
+            run_id, 0, None, _countdown=GC_SWEEP_DELAY_SEC)
+
+        return status(True, 'Marked %s blocks in use.' % reachable_count)
+
+    def sweep_batch(self, run_id, phase, cursor):
+        """Sweep one batch of keys, and queue the task for the next batch.
+
+        Args:
+            run_id: str. The id of the run being swept.
+            phase: int. The index in SWEEP_PHASES of the model to sweep.
+            cursor: str. The urlsafe cursor of the batch, or None to start
+                the phase.
+        """
+        state = ndb.Key(XBlockGarbageCollectionStateEntity, GC_STATE_ID).get()
+        if (state is None or state.run_id != run_id or state.complete or
+                state.phase != phase or state.cursor != cursor):
+            # The batch belongs to another run, or has already been swept
+            return
+
+        model, count_name = self.SWEEP_PHASES[phase]
+        counts = transforms.loads(state.counts)
+        if count_name is not None:
+            # pylint: disable=protected-access
+            root_list_version = RootUsageDao._get_list_version()
+            # pylint: enable=protected-access
+            if cursor is None or root_list_version != state.root_list_version:
+                counts['reachable'] += self._mark(
+                    self._get_root_usage_ids(), run_id)
+                state.root_list_version = root_list_version
+
+        keys, next_cursor, more = model.query().fetch_page(
+            GC_SWEEP_BATCH_SIZE, keys_only=True,
+            start_cursor=ndb.Cursor(urlsafe=cursor) if cursor else None)
+        if count_name is None:
+            # The marks are no longer needed
+            ndb.delete_multi(keys)
+        else:
+            keys = self._get_collectable(model, keys, run_id)
+            if not state.dry_run:
+                ndb.delete_multi(keys)
+            counts[count_name] = counts.get(count_name, 0) + len(keys)
+
+        if more and next_cursor is not None:
+            state.cursor = next_cursor.urlsafe()
+        else:
+            state.phase += 1
+            state.cursor = None
+        state.counts = transforms.dumps(counts)
+        if state.phase == len(self.SWEEP_PHASES):
+            state.complete = True
+            state.message = (
+                '%(action)s %(usages)s usages, %(definitions)s definitions and '
+                '%(key_values)s field values not reachable from the '
+                '%(reachable)s blocks in use.') % {
+                    'action': 'Found' if state.dry_run else 'Deleted',
+                    'usages': counts.get('usages', 0),
+                    'definitions': counts.get('definitions', 0),
+                    'key_values': counts.get('key_values', 0),
+                    'reachable': counts['reachable']}
+
+        def save_state():
+            state.put()
+            if not state.complete:
+                deferred.defer(
+                    _sweep_xblock_garbage,
+                    self.app_context.get_namespace_name(), run_id,
+                    state.phase, state.cursor, _countdown=GC_SWEEP_DELAY_SEC,
+                    _transactional=True)
+
+        ndb.transaction(save_state)
+
+    def _get_root_usage_ids(self):
+        usage_ids = set(
+            root.usage_id for root in RootUsageDao.iter_all() if root.usage_id)
+        course = courses.Course(None, app_context=self.app_context)
+        for lesson in course.get_lessons_for_all_units():
+            usage_id = lesson.properties.get('xblock.usage_id')
+            if usage_id:
+                usage_ids.add(usage_id)
+        return usage_ids
+
+    def _mark(self, root_usage_ids, run_id):
+        """Mark all the blocks in the trees under the given roots.
+
+        The trees are walked one level at a time, reading the usages and the
+        children fields of each level with batched gets. Blocks already marked
+        in this run are not walked again.
+
+        Args:
+            root_usage_ids: set of str. The usage ids of the tree roots.
+            run_id: str. The id of the run.
+
+        Returns:
+            int. The number of usages newly marked.
+        """
+        count = 0
+        frontier = set(root_usage_ids)
+
+        while frontier:
+            usage_ids = self._mark_ids(frontier, run_id)
+            count += len(usage_ids)
+
+            definition_ids = set()
+            for chunk in _chunks(list(usage_ids), DATASTORE_BATCH_SIZE):
+                for usage in ndb.get_multi(
+                        [ndb.Key(store.UsageEntity, usage_id)
+                         for usage_id in chunk]):
+                    if usage is not None:
+                        definition_ids.add(usage.definition_id)
+            definition_ids = self._mark_ids(definition_ids, run_id)
+
+            frontier = set()
+            for chunk in _chunks(list(definition_ids), DATASTORE_BATCH_SIZE):
+                for kv_entity in ndb.get_multi(
+                        [ndb.Key(store.KeyValueEntity, _children_key_string(
+                            def_id)) for def_id in chunk]):
+                    if kv_entity is not None:
+                        frontier.update(kv_entity.value or [])
+
+        return count
+
+    def _mark_ids(self, block_ids, run_id):
+        """Mark blocks as reachable, returning the ids not already marked."""
+        new_ids = set()
+        for chunk in _chunks(list(block_ids), DATASTORE_BATCH_SIZE):
+            keys = [ndb.Key(XBlockGarbageMarkEntity, block_id)
+                    for block_id in chunk]
+            marks = [
+                XBlockGarbageMarkEntity(key=key, run_id=run_id)
+                for key, mark in zip(keys, ndb.get_multi(keys))
+                if mark is None or mark.run_id != run_id]
+            ndb.put_multi(marks)
+            new_ids.update(mark.key.id() for mark in marks)
+        return new_ids
+
+    def _get_collectable(self, model, keys, run_id):
+        """Filter keys of a model to those of blocks which are not marked."""
+        block_ids = []
+        for key in keys:
+            if model in (store.KeyValueEntity, PackedKeyValueEntity):
+                key_list = key.id().split('.')
+                # Type- and all-scoped fields are not attached to any block
+                if key_list[0] in {'type', 'all'} or len(key_list) < 2:
+                    block_ids.append(None)
+                else:
+                    block_ids.append(key_list[1])
+            else:
+                block_ids.append(key.id())
+
+        mark_keys = [
+            ndb.Key(XBlockGarbageMarkEntity, block_id)
+            for block_id in set(block_ids) if block_id is not None]
+        marked = set(
+            key.id() for key, mark in zip(mark_keys, ndb.get_multi(mark_keys))
+            if mark is not None and mark.run_id == run_id)
+        return [
+            key for key, block_id in zip(keys, block_ids)
+            if block_id is not None and block_id not in marked]
+
+
+def _sweep_xblock_garbage(namespace, run_id, phase, cursor):
+    """Deferred task sweeping one batch for XBlockGarbageCollectionJob."""
+    old_namespace = namespace_manager.get_namespace()
+    try:
+        namespace_manager.set_namespace(namespace)
+        XBlockGarbageCollectionJob(
+            sites.get_app_context_for_namespace(namespace)).sweep_batch(
+                run_id, phase, cursor)
+    finally:
+        namespace_manager.set_namespace(old_namespace)
+
+
+class XBlockGarbageCollectionRESTHandler(utils.BaseRESTHandler):
+    """Provide the REST API for starting the XBlock garbage collector."""
+
+    URI = '/rest/xblock_garbage_collection'
+
+    SCHEMA = schema_fields.FieldRegistry(
+        'XBlock Garbage Collection', description='XBlock data clean up')
+    SCHEMA.add_property(
+        schema_fields.SchemaField(
+            'dry_run', 'Dry Run', 'boolean', optional=True,
+            description=messages.GARBAGE_COLLECTION_DRY_RUN))
+
+    REQUIRED_MODULES = ['inputex-checkbox']
+
+    XSRF_TOKEN = 'xblock-garbage-collection'
+
+    def get(self):
+        """Provide the initial content for the garbage collection editor."""
+        transforms.send_json_response(
+            self, 200, 'Success',
+            payload_dict={
+                'dry_run': True,
+                'poller_url': self.canonicalize_url(
+                    XBlockGarbageCollectionProgressQueryHandler.URI)},
+            xsrf_token=utils.XsrfTokenManager.create_xsrf_token(
+                self.XSRF_TOKEN))
+
+    def put(self):
+        request = transforms.loads(self.request.get('request'))
+        if not self.assert_xsrf_token_or_fail(
+                request, self.XSRF_TOKEN, {'key': ''}):
+            return
+
+        if not unit_lesson_editor.CourseOutlineRights.can_edit(self):
+            transforms.send_json_response(self, 401, 'Access denied.')
+            return
+
+        try:
+            payload = transforms.json_to_dict(
+                transforms.loads(request.get('payload')),
+                self.SCHEMA.get_json_schema_dict())
+        except ValueError as err:
+            transforms.send_json_response(self, 412, str(err))
+            return
+
+        job = XBlockGarbageCollectionJob(
+            self.app_context, dry_run=payload.get('dry_run', False))
+        if job.is_active():
+            transforms.send_json_response(
+                self, 412, 'A clean up is already in progress.')
+            return
+        job.submit()
+
+        transforms.send_json_response(self, 200, 'Cleaning up...')
+
+
+class XBlockGarbageCollectionProgressQueryHandler(utils.BaseRESTHandler):
+    """A handler to respond to Ajax polling on the progress of a clean up."""
+
+    URI = '/rest/xblock_garbage_collection_progress'
+
+    def get(self):
+        job = XBlockGarbageCollectionJob(self.app_context)
+        if job.is_active():
+            payload_dict = {'complete': False}
+        else:
+            # The sweep reports the outcome of a run which got that far
+            state = job.load_sweep_state()
+            if state is not None:
+                output = transforms.dumps(
+                    {'success': True, 'message': state.message})
+            else:
+                job_entity = job.load()
+                output = job_entity.output if job_entity else None
+            payload_dict = {'complete': True, 'output': output}
+
+        transforms.send_json_response(
+            self, 200, 'Polling', payload_dict=payload_dict)
+
+
+def _children_key_string(def_id):
+    """The key name of the KeyValueEntity holding a block's children."""
+    return store.key_string(xblock.runtime.KeyValueStore.Key(
+        scope=xblock.fields.Scope.children,
+        user_id=None,
+        block_scope_id=def_id,
+        field_name='children'))
+
+
+class PackedFieldMigrationJob(jobs.DurableJob):
+    """Copies the student fields of XBlocks into the packed storage layout.
+
+    The KeyValueEntity's holding fields in student scope are grouped by block
+    and student, and each group is written to a PackedKeyValueEntity, unless
+    one already exists. The KeyValueEntity's are left in place.
+
+    The job runs only once gcb_xblock_packed_field_storage is enabled, when
+    the KeyValueEntity's are no longer written. An existing
+    PackedKeyValueEntity already holds the merged state of the student, so it
+    is never replaced. Thus there is no window in which writes can be lost,
+    and the job may be re-run at any time. It only spares PackedKeyValueStore
+    reading the default layout for the blocks which have not yet been
+    written.
+    """
+
+    def run(self):
+        if not XBLOCK_PACKED_FIELD_STORAGE.value:
+            return {
+                'success': False,
+                'message': (
+                    'Packed field storage must be enabled before fields are '
+                    'migrated.')}
+
+        @ndb.transactional_tasklet
+        def put_if_absent_async(packed_key_name, data):
+            key = ndb.Key(PackedKeyValueEntity, packed_key_name)
+            entity = yield key.get_async()
+            if entity is not None:
+                raise ndb.Return(0)
+            yield PackedKeyValueEntity(key=key, data=data).put_async()
+            raise ndb.Return(1)
+
+        @ndb.tasklet
+        def pack_async(packed_key_name):
+            # The query may not yet see the latest writes, so it only finds
+            # the blocks and students, and their fields are read by key
+            fields = yield _get_unpacked_student_fields_async(packed_key_name)
+            if not fields:
+                raise ndb.Return(0)
+            count = yield put_if_absent_async(
+                packed_key_name, transforms.dumps(fields))
+            raise ndb.Return(count)
+
+        def iter_packed_key_names():
+            # Keys are in key name order, so each group of fields is contiguous
+            for key in store.KeyValueEntity.query().iter(
+                    keys_only=True, batch_size=DATASTORE_BATCH_SIZE):
+                packed_key_name = dbmodels.KeyValueEntity.get_packed_key_name(
+                    key.id())
+                if packed_key_name is not None:
+                    yield packed_key_name
+
+        count = 0
+        futures = []
+        for packed_key_name, _ in itertools.groupby(iter_packed_key_names()):
+            futures.append(pack_async(packed_key_name))
+            if len(futures) >= DATASTORE_BATCH_SIZE:
+                count += sum(future.get_result() for future in futures)
+                futures = []
+        count += sum(future.get_result() for future in futures)
+
+        return {
+            'success': True,
+            'message': 'Packed the student fields of %s blocks.' % count}
+
+
+class PackedFieldMigrationRESTHandler(utils.BaseRESTHandler):
+    """Provide the REST API for starting the packed field migration."""
+
+    URI = '/rest/xblock_packed_field_migration'
+
+    SCHEMA = schema_fields.FieldRegistry(
+        'XBlock Packed Field Migration', description='XBlock student data')
+
+    REQUIRED_MODULES = []
+
+    XSRF_TOKEN = 'xblock-packed-field-migration'
+
+    def get(self):
+        """Provide the initial content for the migration editor."""
+        transforms.send_json_response(
+            self, 200, 'Success',
+            payload_dict={
+                'poller_url': self.canonicalize_url(
+                    PackedFieldMigrationProgressQueryHandler.URI)},
+            xsrf_token=utils.XsrfTokenManager.create_xsrf_token(
+                self.XSRF_TOKEN))
+
+    def put(self):
+        request = transforms.loads(self.request.get('request'))
+        if not self.assert_xsrf_token_or_fail(
+                request, self.XSRF_TOKEN, {'key': ''}):
+            return
+
+        if not unit_lesson_editor.CourseOutlineRights.can_edit(self):
+            transforms.send_json_response(self, 401, 'Access denied.')
+            return
+
+        if not XBLOCK_PACKED_FIELD_STORAGE.value:
+            transforms.send_json_response(
+                self, 412, 'Packed field storage is not enabled.')
+            return
+
+        job = PackedFieldMigrationJob(self.app_context)
+        if job.is_active():
+            transforms.send_json_response(
+                self, 412, 'Student data is already being packed.')
+            return
+        job.submit()
+
+        transforms.send_json_response(self, 200, 'Packing...')
+
+
+class PackedFieldMigrationProgressQueryHandler(utils.BaseRESTHandler):
+    """A handler to respond to Ajax polling on the progress of a migration."""
+
+    URI = '/rest/xblock_packed_field_migration_progress'
+
+    def get(self):
+        job = PackedFieldMigrationJob(self.app_context)
+        if job.is_active():
+            payload_dict = {'complete': False}
+        else:
+            job_entity = job.load()
+            payload_dict = {
+                'complete': True,
+                'output': job_entity.output if job_entity else None}
+
+        transforms.send_json_response(
+            self, 200, 'Polling', payload_dict=payload_dict)
 
 
 # XBlock component tag section
@@ -1265,21 +4156,52 @@ class Importer(object):
 
 GUEST_USER_SESSION_COOKIE = 'cb-guest-session'
 GUEST_USER_SESSION_COOKIE_MAX_AGE_SEC = 48 * 60 * 60  # 48 hours
+# The guest session cookie is refreshed when it has less than this time to live
+GUEST_USER_SESSION_COOKIE_REFRESH_SEC = 24 * 60 * 60  # 24 hours
+# The cookie holds the session id and the time it was issued
+GUEST_USER_SESSION_COOKIE_RE = re.compile(r'^([0-9a-f]{32})(?:\.([0-9]+))?$')
+# Number of seconds for which a user's enrollment status is held in memcache
+ENROLLMENT_CACHE_TTL_SEC = 60
 
 
 def get_session_id_for_guest_user(handler):
-    session_cookie = handler.request.cookies.get(
-        GUEST_USER_SESSION_COOKIE, '')
+    """Return the guest user id for the session.
+
+    The session cookie is only written when it is missing or invalid, or when
+    it is within GUEST_USER_SESSION_COOKIE_REFRESH_SEC of expiring. Thus most
+    guest responses carry no Set-Cookie header and can be cached. The session
+    id is memoized on the handler for the rest of the request.
+
+    Args:
+        handler: BaseHandler. The request handler for the user session.
+
+    Returns:
+        string. A guest user ID.
+    """
+    # pylint: disable=protected-access
+    session_id = getattr(handler, '_xblock_guest_session_id', None)
+    if session_id is None:
+        match = GUEST_USER_SESSION_COOKIE_RE.match(
+            handler.request.cookies.get(GUEST_USER_SESSION_COOKIE, ''))
+        now = int(time.time())
+
+        # If the session cookie is missing or invalid, generate a new one
+        if match:
+            session_id, issued_at = match.group(1), match.group(2)
+        else:
+            session_id, issued_at = uuid.uuid4().hex, None
 
-    # If the session cookie is missing or invalid, generate a new one
-    if not re.match('^[0-9a-f]{32}$', session_cookie):
-        session_cookie = uuid.uuid4().hex
+        if issued_at is None or (
+                now - int(issued_at) > GUEST_USER_SESSION_COOKIE_MAX_AGE_SEC -
+                GUEST_USER_SESSION_COOKIE_REFRESH_SEC):
+            handler.response.set_cookie(
+                GUEST_USER_SESSION_COOKIE, '%s.%s' % (session_id, now),
+                max_age=GUEST_USER_SESSION_COOKIE_MAX_AGE_SEC)
 
-    handler.response.set_cookie(
-        GUEST_USER_SESSION_COOKIE, session_cookie,
-        max_age=GUEST_USER_SESSION_COOKIE_MAX_AGE_SEC)
+        handler._xblock_guest_session_id = session_id
+    # pylint: enable=protected-access
 
-    return 'guest-%s' % session_cookie
+    return 'guest-%s' % session_id
 
 
 def get_enrolled_user_id_or_guest_user_id(handler):
@@ -1297,10 +4219,92 @@ def get_enrolled_user_id_or_guest_user_id(handler):
     user = handler.get_user()
     if user is None:
         return get_session_id_for_guest_user(handler)
-    elif m_models.Student.get_enrolled_student_by_email(user.email()) is None:
+    student_id = _get_enrolled_student_id(handler, user)
+    if student_id is None:
         return get_session_id_for_guest_user(handler)
     else:
-        return str(user.user_id())
+        return student_id
+
+
+def _enrollment_memcache_key(user_id):
+    return 'xblock_module:enrolled_student_id:%s' % user_id
+
+
+def _get_enrolled_student_id(handler, user):
+    """Get the user id of the user if they are enrolled in the course.
+
+    The result is memoized on the handler for the rest of the request, and is
+    held in memcache for ENROLLMENT_CACHE_TTL_SEC. The memcache entry is cleared
+    whenever the user's Student entity is saved or deleted, so enrollment and
+    unenrollment take effect immediately.
+
+    Args:
+        handler: BaseHandler. The request handler for the user session.
+        user: users.User. The user in session.
+
+    Returns:
+        string. The user id, or None if the user is not enrolled.
+    """
+    # pylint: disable=protected-access
+    if not hasattr(handler, '_xblock_enrolled_student_ids'):
+        handler._xblock_enrolled_student_ids = {}
+    memo = handler._xblock_enrolled_student_ids
+    # pylint: enable=protected-access
+
+    user_id = str(user.user_id())
+    if user_id not in memo:
+        key = _enrollment_memcache_key(user_id)
+        student_id = m_models.MemcacheManager.get(key)
+        if student_id is None:
+            student = m_models.Student.get_enrolled_student_by_email(
+                user.email())
+            student_id = user_id if student else ''
+            m_models.MemcacheManager.set(
+                key, student_id, ttl=ENROLLMENT_CACHE_TTL_SEC)
+        memo[user_id] = student_id or None
+    return memo[user_id]
+
+
+_orig_student_put = None
+_orig_student_delete = None
+
+
+def _student_put(student, *args, **kwargs):
+    try:
+        return _orig_student_put(student, *args, **kwargs)
+    finally:
+        _clear_enrollment_cache(student)
+
+
+def _student_delete(student, *args, **kwargs):
+    try:
+        return _orig_student_delete(student, *args, **kwargs)
+    finally:
+        _clear_enrollment_cache(student)
+
+
+def _clear_enrollment_cache(student):
+    if student.user_id:
+        m_models.MemcacheManager.delete(
+            _enrollment_memcache_key(student.user_id))
+
+
+def _set_new_student_methods():
+    """Register put and delete methods which clear the enrollment cache."""
+    global _orig_student_put, _orig_student_delete
+    _orig_student_put = m_models.Student.put
+    _orig_student_delete = m_models.Student.delete
+    m_models.Student.put = _student_put
+    m_models.Student.delete = _student_delete
+
+
+def _set_orig_student_methods():
+    """Restore the original put and delete methods on Student."""
+    global _orig_student_put, _orig_student_delete
+    m_models.Student.put = _orig_student_put
+    m_models.Student.delete = _orig_student_delete
+    _orig_student_put = None
+    _orig_student_delete = None
 
 
 class XBlockTag(tags.ContextAwareTag):
@@ -1317,12 +4321,10 @@ class XBlockTag(tags.ContextAwareTag):
     def get_icon_url(self):
         return RESOURCES_URI + '/xblock.png'
 
-    def get_schema(self, unused_handler):
+    def get_schema(self, handler):
         """Get the schema for specifying the question."""
-        root_list = [
-            (unicode(root.id), root.description)
-            for root in RootUsageDao.get_all()]
-        root_list.sort(key=lambda x: x[1].lower())
+        _ensure_root_usage_index(handler.app_context)
+        root_list = RootUsageDao.get_select_data()
 
         if not root_list:
             return self.unavailable_schema('No XBlocks available')
@@ -1335,11 +4337,16 @@ class XBlockTag(tags.ContextAwareTag):
 
     def render(self, node, context):
         root_id = node.attrib.get('root_id')
-        usage_id = RootUsageDao.load(root_id).usage_id
+        usage_id = RootUsageDao.get_usage_ids([root_id])[root_id]
         student_id = get_enrolled_user_id_or_guest_user_id(context.handler)
         runtime = Runtime(context.handler, student_id=student_id)
         block = runtime.get_block(usage_id)
-        fragment = runtime.render(block, 'student_view')
+        try:
+            fragment = runtime.render(block, 'student_view')
+        finally:
+            # Page handlers are not decorated with @ndb.toplevel, so the writes
+            # are completed when the NDB event loop next runs
+            runtime.flush_events()
 
         fragment_list = context.env.get('fragment_list')
         if fragment_list is None:
@@ -1393,8 +4400,11 @@ class XBlockLocalResourceHandler(webapp2.RequestHandler):
 
 XBLOCK_EVENT_EXPORT_WHITELIST = {
     'sequential', 'video', 'cbquestion', 'html', 'vertical'}
+# Matches the type at the start of the data of an event written by publish
+_XBLOCK_EVENT_TYPE_RE = re.compile(r'^\{"type": "([^"\\]*)"')
 
 _orig_event_entity_for_export = None
+_orig_event_entity_record = None
 
 
 def _set_new_event_entity_for_export_method():
@@ -1411,11 +4421,49 @@ def _set_orig_event_entity_for_export_method():
     _orig_event_entity_for_export = None
 
 
+def _set_new_event_entity_record_method():
+    """Register the new record method on EventEntity."""
+    global _orig_event_entity_record
+    _orig_event_entity_record = m_models.EventEntity.__dict__['record']
+    m_models.EventEntity.record = classmethod(_event_entity_record)
+
+
+def _set_orig_event_entity_record_method():
+    """Restore the original record method on EventEntity."""
+    global _orig_event_entity_record
+    m_models.EventEntity.record = _orig_event_entity_record
+    _orig_event_entity_record = None
+
+
+def _event_entity_record(cls, source, user, data):
+    """Apply the XBlock event limits to events sent through the tag path.
+
+    The limits are looked up by the block type and event name carried by the
+    event, as for published events. Events which carry no block type are not
+    limited.
+    """
+    if source == XBLOCK_TAG_EVENT_SOURCE_NAME:
+        try:
+            wrapper = transforms.loads(data)
+            block_type = wrapper.get('type')
+            event_name = wrapper.get('event')
+        except (AttributeError, ValueError):
+            block_type = None
+        if block_type and not should_record_event(
+                user.user_id(), _get_event_limit_keys(block_type, event_name)):
+            return
+    _orig_event_entity_record.__get__(None, cls)(source, user, data)
+
+
 def _event_entity_for_export(model, transform_fn):
-    global _orig_event_entity_for_export
     model = _orig_event_entity_for_export(model, transform_fn)
 
     if model.source == XBLOCK_EVENT_SOURCE_NAME:
+        # Whitelisted events written with their type first are passed through
+        # without decoding their data
+        match = _XBLOCK_EVENT_TYPE_RE.match(model.data)
+        if match and match.group(1) in XBLOCK_EVENT_EXPORT_WHITELIST:
+            return model
         wrapper = transforms.loads(model.data)
         if wrapper.get('type') not in XBLOCK_EVENT_EXPORT_WHITELIST:
             model.data = transforms.dumps({
@@ -1425,11 +4473,14 @@ def _event_entity_for_export(model, transform_fn):
             })
     elif model.source == XBLOCK_TAG_EVENT_SOURCE_NAME:
         wrapper = transforms.loads(model.data)
-        model.data = transforms.dumps({
+        safe_wrapper = {
             'event': wrapper.get('event'),
             'message': transform_fn(wrapper.get('message')),
             'location': wrapper.get('location'),
-            'data': transform_fn(transforms.dumps(wrapper.get('data')))})
+            'data': transform_fn(transforms.dumps(wrapper.get('data')))}
+        if 'type' in wrapper:
+            safe_wrapper['type'] = wrapper['type']
+        model.data = transforms.dumps(safe_wrapper)
 
     return model
 
@@ -1448,9 +4499,13 @@ def register_module():
         tags.Registry.remove_tag_binding(XBlockTag.binding_name)
         for entity in  [
                 dbmodels.DefinitionEntity, dbmodels.UsageEntity,
-                dbmodels.KeyValueEntity, RootUsageEntity]:
+                dbmodels.KeyValueEntity, dbmodels.PackedKeyValueEntity,
+                dbmodels.XmlExportEntity, RootUsageEntity,
+                RootUsageDescriptionEntity, StaticFileDigestEntity]:
             courses.COURSE_CONTENT_ENTITIES.remove(entity)
         _set_orig_event_entity_for_export_method()
+        _set_orig_event_entity_record_method()
+        _set_orig_student_methods()
 
     def on_module_enabled():
         _add_editor_to_dashboard()
@@ -1461,8 +4516,12 @@ def register_module():
                 TEMPLATE_DIRS=[XBLOCK_TEMPLATES_PATH])
         courses.COURSE_CONTENT_ENTITIES += [
             dbmodels.DefinitionEntity, dbmodels.UsageEntity,
-            dbmodels.KeyValueEntity, RootUsageEntity]
+            dbmodels.KeyValueEntity, dbmodels.PackedKeyValueEntity,
+            dbmodels.XmlExportEntity, RootUsageEntity,
+            RootUsageDescriptionEntity, StaticFileDigestEntity]
         _set_new_event_entity_for_export_method()
+        _set_new_event_entity_record_method()
+        _set_new_student_methods()
 
     global_routes = [
         (RESOURCES_URI + '/.*', tags.ResourcesHandler),
@@ -1475,7 +4534,9 @@ def register_module():
         (MATHJAX_URI + '/(.*)', sites.make_zip_handler(os.path.join(
             appengine_config.BUNDLE_ROOT, 'lib', 'MathJax.zip')))]
 
-    namespaced_routes = [(HANDLER_URI, XBlockActionHandler)]
+    namespaced_routes = [
+        (HANDLER_URI, XBlockActionHandler),
+        (BATCH_HANDLER_URI, XBlockBatchActionHandler)]
 
     global custom_module
 
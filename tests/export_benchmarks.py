@@ -0,0 +1,188 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for the ETL export sanitization of XBlock data.
+
+Run this from the command line with the same PYTHONPATH as used by
+scripts/tests.sh, e.g.,
+
+$ python tests/export_benchmarks.py --row_count=100000 --user_count=500
+
+A batch of synthetic EventEntity's and KeyValueEntity keys is sanitized first
+with a copy of the original per-entity implementation, and then with the
+current implementation. The rows per second of each are reported.
+"""
+
+import argparse
+import collections
+import hashlib
+import hmac
+import random
+import re
+import time
+import uuid
+
+from models import transforms
+import models.models as m_models
+from modules.xblock_module import dbmodels
+from modules.xblock_module import xblock_module
+
+from google.appengine.ext import db
+from google.appengine.ext import testbed
+
+
+# command line arguments parser
+PARSER = argparse.ArgumentParser()
+PARSER.add_argument(
+    '--row_count', help='Number of synthetic entities of each kind.',
+    default=20000, type=int)
+PARSER.add_argument(
+    '--user_count', help='Number of distinct users in the synthetic data.',
+    default=200, type=int)
+
+SECRET = 'benchmark_secret'
+
+
+def transform(value):
+    """A transform_fn with the same cost as the ETL HMAC transform."""
+    return hmac.new(SECRET, value, hashlib.sha256).hexdigest()
+
+
+def make_events(row_count, user_ids):
+    events = []
+    for i in xrange(row_count):
+        user_id = random.choice(user_ids)
+        kind = i % 3
+        if kind == 0:
+            source = xblock_module.XBLOCK_EVENT_SOURCE_NAME
+            # Ordered as written by Runtime.publish
+            data = collections.OrderedDict([
+                ('type', 'sequential'), ('usage', uuid.uuid4().hex),
+                ('event', {'position': i % 7})])
+        elif kind == 1:
+            source = xblock_module.XBLOCK_EVENT_SOURCE_NAME
+            data = collections.OrderedDict([
+                ('type', 'problem'), ('usage', uuid.uuid4().hex),
+                ('event', {'answers': {'input_%s' % i: 'value'}})])
+        else:
+            source = xblock_module.XBLOCK_TAG_EVENT_SOURCE_NAME
+            data = {
+                'event': 'xblock-problem', 'message': 'Problem Checked',
+                'location': 'http://my.app/course/unit?unit=1&lesson=3',
+                'data': {'problem_id': 'X', 'answers': 'input_X_2_1=%s' % i}}
+        events.append(m_models.EventEntity(
+            key=db.Key.from_path('EventEntity', i + 1), source=source,
+            user_id=user_id, data=transforms.dumps(data)))
+    return events
+
+
+def make_keys(row_count, user_ids):
+    block_ids = [uuid.uuid4().hex for _ in xrange(100)]
+    keys = []
+    for i in xrange(row_count):
+        if i % 2:
+            name = 'usage.%s.%s.field' % (
+                random.choice(block_ids), random.choice(user_ids))
+        else:
+            name = 'definition.%s.field' % random.choice(block_ids)
+        keys.append(db.Key.from_path('KeyValueEntity', name))
+    return keys
+
+
+def legacy_event_for_export(model, transform_fn, base_for_export):
+    """The event sanitization, before whitelisted events were passed through."""
+    model = base_for_export(model, transform_fn)
+    if model.source == xblock_module.XBLOCK_EVENT_SOURCE_NAME:
+        wrapper = transforms.loads(model.data)
+        if wrapper.get('type') not in (
+                xblock_module.XBLOCK_EVENT_EXPORT_WHITELIST):
+            model.data = transforms.dumps({
+                'usage': wrapper.get('usage'),
+                'type': wrapper.get('type'),
+                'event': transform_fn(transforms.dumps(wrapper.get('event')))
+            })
+    elif model.source == xblock_module.XBLOCK_TAG_EVENT_SOURCE_NAME:
+        wrapper = transforms.loads(model.data)
+        model.data = transforms.dumps({
+            'event': wrapper.get('event'),
+            'message': transform_fn(wrapper.get('message')),
+            'location': wrapper.get('location'),
+            'data': transform_fn(transforms.dumps(wrapper.get('data')))})
+    return model
+
+
+def legacy_safe_key(db_key, transform_fn):
+    """The KeyValueEntity key sanitization, before the key regex was added."""
+    key_list = db_key.name().split('.')
+    assert len(key_list) in {3, 4}
+    assert key_list[0] in {
+        'children', 'parent', 'usage', 'definition', 'type', 'all'}
+    assert re.match('^[0-9a-zA-Z]{32}$', key_list[1])
+    if len(key_list) == 4:
+        key_list[2] = transform_fn(key_list[2])
+    return db.Key.from_path('KeyValueEntity', '.'.join(key_list))
+
+
+def rows_per_second(fn, rows):
+    start = time.time()
+    result = fn(rows)
+    return result, len(rows) / max(time.time() - start, 1e-6)
+
+
+def run(row_count, user_count, base_for_export):
+    user_ids = [str(random.randint(10 ** 20, 10 ** 21))
+                for _ in xrange(user_count)]
+    events = make_events(row_count, user_ids)
+    keys = make_keys(row_count, user_ids)
+
+    legacy_events, legacy_rate = rows_per_second(
+        lambda rows: [
+            legacy_event_for_export(m, transform, base_for_export)
+            for m in rows],
+        events)
+    new_events, new_rate = rows_per_second(
+        lambda rows: [m.for_export(transform) for m in rows], events)
+    assert [m.data for m in legacy_events] == [m.data for m in new_events]
+    print 'EventEntity:    before %8.0f rows/s, after %8.0f rows/s' % (
+        legacy_rate, new_rate)
+
+    legacy_keys, legacy_rate = rows_per_second(
+        lambda rows: [legacy_safe_key(k, transform) for k in rows], keys)
+    new_keys, new_rate = rows_per_second(
+        lambda rows: [
+            dbmodels.KeyValueEntity.safe_key(k, transform) for k in rows],
+        keys)
+    assert legacy_keys == new_keys
+    print 'KeyValueEntity: before %8.0f rows/s, after %8.0f rows/s' % (
+        legacy_rate, new_rate)
+
+
+def main():
+    args = PARSER.parse_args()
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+    # pylint: disable=protected-access
+    legacy_for_export = m_models.EventEntity.for_export
+    xblock_module._set_new_event_entity_for_export_method()
+    try:
+        run(args.row_count, args.user_count, legacy_for_export)
+    finally:
+        xblock_module._set_orig_event_entity_for_export_method()
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
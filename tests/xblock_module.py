@@ -17,8 +17,12 @@
 __author__ = 'jorr@google.com (John Orr)'
 
 from cStringIO import StringIO
+import hashlib
 import os
 import re
+import sys
+import tarfile
+import time
 import urllib
 import urlparse
 from xml.etree import cElementTree
@@ -26,6 +30,7 @@ from xml.etree import cElementTree
 from controllers import sites
 from controllers import utils
 import html5lib
+import webapp2
 from models import config
 from models import courses
 from models import transforms
@@ -39,9 +44,12 @@ from xblock import fragment
 from tests.functional import actions
 from tests.functional import test_classes
 
+from google.appengine.api import datastore
+from google.appengine.api import datastore_types
 from google.appengine.api import files
 from google.appengine.api import namespace_manager
 from google.appengine.api import users
+from google.appengine.ext import blobstore
 from google.appengine.ext import db
 from google.appengine.ext import ndb
 
@@ -68,12 +76,28 @@ def parse_xml_string(rt, xml_str, dry_run=False):
     return rt.parse_xml_string(xml_str, None, dry_run=dry_run)
 
 
+@ndb.toplevel
+def flush_events(rt):
+    rt.flush_events()
+
+
 class MockHandler(object):
 
     def canonicalize_url(self, location):
         return '/new_course' + location
 
 
+class MockUserHandler(object):
+
+    def __init__(self, user):
+        self.user = user
+        self.request = webapp2.Request.blank('/')
+        self.response = webapp2.Response()
+
+    def get_user(self):
+        return self.user
+
+
 class TestBase(actions.TestBase):
 
     def setUp(self):
@@ -274,6 +298,55 @@ class KeyValueEntitySanitizationTests(TestBase):
         with self.assertRaises(AssertionError):
             safe_model = orig_model.for_export(self.transform)
 
+    def test_get_packed_key_name(self):
+        student_key = self.get_key(
+            xblock.fields.Scope.user_state, '1234567890',
+            '0d40c9be8e254416b4782bf8e19a538f', 'my_field')
+        self.assertEquals(
+            'usage.0d40c9be8e254416b4782bf8e19a538f.1234567890',
+            dbmodels.KeyValueEntity.get_packed_key_name(student_key.name()))
+
+        content_key = self.get_key(
+            xblock.fields.Scope.content, None,
+            '0d40c9be8e254416b4782bf8e19a538f', 'my_field')
+        self.assertIsNone(
+            dbmodels.KeyValueEntity.get_packed_key_name(content_key.name()))
+        self.assertIsNone(
+            dbmodels.KeyValueEntity.get_packed_key_name('totally_bad_key'))
+
+    def test_packed_entity_for_export_transforms_key_and_value(self):
+        key = db.Key.from_path(
+            'PackedKeyValueEntity',
+            'usage.0d40c9be8e254416b4782bf8e19a538f.1234567890')
+        orig_model = dbmodels.PackedKeyValueEntity(
+            key=key, data='{"my_field": 1}')
+        safe_model = orig_model.for_export(self.transform)
+        self.assertEquals(
+            'usage.0d40c9be8e254416b4782bf8e19a538f.tr_1234567890',
+            safe_model.safe_key.name())
+        self.assertEquals('tr_{"my_field": 1}', safe_model.data)
+
+    def test_packed_entity_rejects_malformed_keys(self):
+        bad_key = db.Key.from_path(
+            'PackedKeyValueEntity',
+            'usage.0d40c9be8e254416b4782bf8e19a538f.1234567890.my_field')
+        with self.assertRaises(AssertionError):
+            dbmodels.PackedKeyValueEntity.safe_key(bad_key, self.transform)
+
+    def test_xml_export_entity_reads_runtime_export(self):
+        xml = '<html usage_id="123">text</html>'
+        xblock_module.XmlExportEntity.create(
+            ndb.Key(xblock_module.XmlExportEntity, '123'), 'v1', xml).put()
+        model = dbmodels.XmlExportEntity.get_by_key_name('123')
+        self.assertEquals('v1', model.content_version)
+
+        # The XML written back by ETL reads the same in the runtime
+        dbmodels.XmlExportEntity(
+            key_name='456', generation=model.generation,
+            content_version='v1', compressed_xml=model.compressed_xml).put()
+        self.assertEquals(xml, ndb.Key(
+            xblock_module.XmlExportEntity, '456').get().xml)
+
 
 class EventEntitySanitizationTests(TestBase):
     """Tests that ETL's data sanitization methods are implemented correctly."""
@@ -340,6 +413,25 @@ class EventEntitySanitizationTests(TestBase):
             'location': 'http://my.app/new_course/unit?unit=1&lesson=3',
             'data': 'tr_{"problem_id": "X", "answers": "input_X_2_1=1"}'})
 
+    def test_published_whitelisted_events_are_not_decoded(self):
+        rt = xblock_module.Runtime(
+            MockHandler(), student_id='1234567890', is_admin=True)
+        usage_id = parse_xml_string(rt, '<html>Test</html>')
+        rt.publish(rt.get_block(usage_id), {'data': 1234})
+        flush_events(rt)
+        orig_event = m_models.EventEntity.all().fetch(1)[0]
+
+        def fail(unused_data):
+            self.fail('Event data decoded')
+        old_loads = xblock_module.transforms.loads
+        xblock_module.transforms.loads = fail
+        try:
+            safe_event = orig_event.for_export(self.transform)
+        finally:
+            xblock_module.transforms.loads = old_loads
+        self.assertEquals(orig_event.data, safe_event.data)
+        self.assertEquals('tr_1234567890', safe_event.user_id)
+
 
 class RuntimeTestCase(TestBase):
     """Functional tests for the XBlock runtime."""
@@ -355,6 +447,78 @@ class RuntimeTestCase(TestBase):
         rt.export_to_xml(block, xml_buffer)
         self.assertIn(xml, xml_buffer.getvalue())
 
+    def test_parse_xml_string_refreshes_cached_export(self):
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        usage_id = parse_xml_string(rt, '<html>foo</html>')
+        key = ndb.Key(xblock_module.XmlExportEntity, usage_id)
+        self.assertIn('>foo</html>', key.get().xml)
+
+        parse_xml_string(rt, '<html usage_id="%s">bar</html>' % usage_id)
+        self.assertIn('>bar</html>', key.get().xml)
+
+        # A dry run does not touch the cache
+        parse_xml_string(
+            rt, '<html usage_id="%s">baz</html>' % usage_id, dry_run=True)
+        self.assertIn('>bar</html>', key.get().xml)
+
+    def test_parse_xml_string_writes_only_changed_entities(self):
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+
+        @ndb.toplevel
+        def parse(xml):
+            write_counts = {}
+            usage_id = rt.parse_xml_string(
+                xml, None, write_counts=write_counts)
+            return usage_id, write_counts
+
+        usage_id, write_counts = parse(
+            '<vertical><html>one</html><html>two</html></vertical>')
+        self.assertEqual(0, write_counts['skipped'])
+        self.assertLess(0, write_counts['written'])
+
+        # Change the content of one of the children
+        xml = rt.get_xml(usage_id).replace('two', 'three')
+        _, write_counts = parse(xml)
+        # Only the changed field is written. The refreshed cached export is
+        # not counted.
+        self.assertEqual(1, write_counts['written'])
+        self.assertLess(0, write_counts['skipped'])
+        block = rt.get_block(usage_id)
+        self.assertEqual('three', rt.get_block(block.children[1]).content)
+
+    def test_get_xml_uses_cached_export(self):
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        usage_id = parse_xml_string(rt, '<html>text</html>')
+        key = ndb.Key(xblock_module.XmlExportEntity, usage_id)
+
+        key.delete()
+        xml_buffer = StringIO()
+        rt.export_to_xml(rt.get_block(usage_id), xml_buffer)
+        self.assertEqual(xml_buffer.getvalue(), rt.get_xml(usage_id))
+        self.assertEqual(xml_buffer.getvalue(), key.get().xml)
+
+        entity = key.get()
+        entity.xml = 'cached'
+        entity.put()
+        self.assertEqual('cached', rt.get_xml(usage_id))
+
+        # Exports for a student are neither read from nor added to the cache
+        student_rt = xblock_module.Runtime(MockHandler(), student_id='s1')
+        self.assertEqual(xml_buffer.getvalue(), student_rt.get_xml(usage_id))
+
+    def test_get_xml_ignores_export_cached_before_authored_write(self):
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        usage_id = parse_xml_string(rt, '<html>foo</html>')
+        self.assertIn('>foo</html>', rt.get_xml(usage_id))
+
+        # A write outside parse_xml_string starts a new content version
+        block = rt.get_block(usage_id)
+        block.content = 'bar'
+        block.save()
+        self.assertIn('>bar</html>', rt.get_xml(usage_id))
+        self.assertIn('>bar</html>', ndb.Key(
+            xblock_module.XmlExportEntity, usage_id).get().xml)
+
     def test_runtime_updates_blocks_with_ids(self):
         """The workbench should update blocks in place when they have ids."""
         rt = xblock_module.Runtime(MockHandler(), is_admin=True)
@@ -471,6 +635,7 @@ class RuntimeTestCase(TestBase):
         xblock_event_data = {'data': 1234}
 
         rt.publish(block, xblock_event_data)
+        flush_events(rt)
 
         expected_event_data = {
             'usage': usage_id,
@@ -494,6 +659,7 @@ class RuntimeTestCase(TestBase):
             xblock_event_data = {'data': 1234}
 
             rt.publish(block, xblock_event_data)
+            flush_events(rt)
 
             events = m_models.EventEntity.all().fetch(1)
             self.assertEqual(0, len(events))
@@ -501,6 +667,150 @@ class RuntimeTestCase(TestBase):
             config.Registry.test_overrides[
                 utils.CAN_PERSIST_TAG_EVENTS.name] = True
 
+    def test_publish_buffers_events_until_flushed(self):
+        rt = xblock_module.Runtime(
+            MockHandler(), student_id='the_student', is_admin=True)
+        usage_id = parse_xml_string(rt, '<html>Test</html>')
+        block = rt.get_block(usage_id)
+
+        rt.publish(block, {'data': 1})
+        rt.publish(block, {'data': 2})
+        self.assertEqual(0, m_models.EventEntity.all().count())
+
+        flush_events(rt)
+        events = m_models.EventEntity.all().fetch(10)
+        self.assertEqual(
+            [1, 2],
+            sorted(transforms.loads(e.data)['event']['data'] for e in events))
+
+    def test_publish_drops_events_when_buffer_is_full(self):
+        old_max_buffered_events = xblock_module.MAX_BUFFERED_EVENTS
+        xblock_module.MAX_BUFFERED_EVENTS = 3
+        try:
+            rt = xblock_module.Runtime(
+                MockHandler(), student_id='the_student', is_admin=True)
+            usage_id = parse_xml_string(rt, '<html>Test</html>')
+            block = rt.get_block(usage_id)
+            dropped = xblock_module.XBLOCK_EVENTS_DROPPED.value
+
+            for i in xrange(5):
+                rt.publish(block, {'data': i})
+            flush_events(rt)
+
+            self.assertEqual(3, m_models.EventEntity.all().count())
+            self.assertEqual(
+                dropped + 2, xblock_module.XBLOCK_EVENTS_DROPPED.value)
+
+            # Flushing makes room for new events
+            rt.publish(block, {'data': 5})
+            flush_events(rt)
+            self.assertEqual(4, m_models.EventEntity.all().count())
+        finally:
+            xblock_module.MAX_BUFFERED_EVENTS = old_max_buffered_events
+
+    def test_publish_writes_events_in_batches(self):
+        rt = xblock_module.Runtime(
+            MockHandler(), student_id='the_student', is_admin=True)
+        usage_id = parse_xml_string(rt, '<html>Test</html>')
+        block = rt.get_block(usage_id)
+
+        for i in xrange(xblock_module.EVENT_WRITE_BATCH_SIZE + 1):
+            rt.publish(block, {'data': i})
+        # pylint: disable=protected-access
+        self.assertEqual(1, len(rt._event_buffer))
+        # pylint: enable=protected-access
+
+        flush_events(rt)
+        self.assertEqual(
+            xblock_module.EVENT_WRITE_BATCH_SIZE + 1,
+            m_models.EventEntity.all().count())
+
+    def _publish_with_event_limits(self, limits, events):
+        rt = xblock_module.Runtime(
+            MockHandler(), student_id='the_student', is_admin=True)
+        usage_id = parse_xml_string(rt, '<html>Test</html>')
+        block = rt.get_block(usage_id)
+        try:
+            config.Registry.test_overrides[
+                xblock_module.XBLOCK_EVENT_LIMITS.name] = limits
+            config.Registry.test_overrides[
+                m_models.CAN_USE_MEMCACHE.name] = True
+            for event in events:
+                rt.publish(block, event)
+            flush_events(rt)
+        finally:
+            del config.Registry.test_overrides[
+                xblock_module.XBLOCK_EVENT_LIMITS.name]
+            del config.Registry.test_overrides[m_models.CAN_USE_MEMCACHE.name]
+        return [
+            transforms.loads(e.data)['event']
+            for e in m_models.EventEntity.all().fetch(100)]
+
+    def test_publish_applies_event_sampling(self):
+        sampled_out = xblock_module.XBLOCK_EVENTS_SAMPLED_OUT.value
+        events = self._publish_with_event_limits(
+            '{"html": {"sample_rate": 0}}', [{'data': 1}, {'data': 2}])
+        self.assertEqual([], events)
+        self.assertEqual(
+            sampled_out + 2, xblock_module.XBLOCK_EVENTS_SAMPLED_OUT.value)
+
+    def test_publish_applies_per_user_rate_limit(self):
+        rate_limited = xblock_module.XBLOCK_EVENTS_RATE_LIMITED.value
+        events = self._publish_with_event_limits(
+            '{"html:vote": {"max_per_minute": 1, "burst": 2}}', [
+                {'event_type': 'vote', 'data': 1},
+                {'event_type': 'vote', 'data': 2},
+                {'event_type': 'vote', 'data': 3},
+                {'event_type': 'view', 'data': 4}])
+        self.assertEqual([1, 2, 4], sorted(e['data'] for e in events))
+        self.assertEqual(
+            rate_limited + 1, xblock_module.XBLOCK_EVENTS_RATE_LIMITED.value)
+
+    def test_event_limits_are_validated(self):
+        # pylint: disable=protected-access
+        bad_limits = [
+            '[]', '{"html": 1}', '{"html": {"rate": 1}}',
+            '{"html": {"sample_rate": 2}}', '{"html": {"max_per_minute": 0}}',
+            '{"html": {"max_per_minute": 1, "burst": "x"}}', '{']
+        for limits in bad_limits:
+            errors = []
+            xblock_module._validate_event_limits(limits, errors)
+            self.assertEqual(1, len(errors), limits)
+
+        errors = []
+        xblock_module._validate_event_limits(
+            '{"video": {"sample_rate": 0.5, "max_per_minute": 6}}', errors)
+        self.assertEqual([], errors)
+
+    def test_tag_events_are_sampled(self):
+        actions.login('user@example.com')
+        user = users.get_current_user()
+        sampled_out = xblock_module.XBLOCK_EVENTS_SAMPLED_OUT.value
+        try:
+            config.Registry.test_overrides[
+                xblock_module.XBLOCK_EVENT_LIMITS.name] = (
+                    '{"problem:xblock-problem": {"sample_rate": 0}}')
+            for block_type, event_name in [
+                    ('problem', 'xblock-problem'), ('problem', 'xblock-other'),
+                    ('video', 'xblock-problem')]:
+                m_models.EventEntity.record(
+                    xblock_module.XBLOCK_TAG_EVENT_SOURCE_NAME, user,
+                    transforms.dumps(
+                        {'type': block_type, 'event': event_name}))
+        finally:
+            del config.Registry.test_overrides[
+                xblock_module.XBLOCK_EVENT_LIMITS.name]
+
+        # Only the event of the configured block type and name is sampled
+        events = m_models.EventEntity.all().fetch(10)
+        self.assertEqual(
+            [('problem', 'xblock-other'), ('video', 'xblock-problem')],
+            sorted(
+                (transforms.loads(e.data)['type'],
+                 transforms.loads(e.data)['event']) for e in events))
+        self.assertEqual(
+            sampled_out + 1, xblock_module.XBLOCK_EVENTS_SAMPLED_OUT.value)
+
 
 class XBlockActionHandlerTestCase(TestBase):
     """Functional tests for the XBlock callback handler."""
@@ -539,6 +849,167 @@ class XBlockActionHandlerTestCase(TestBase):
             expect_errors=True)
         self.assertEqual(400, response.status_int)
 
+    def test_cacheable_handler_answers_if_none_match_with_304(self):
+        actions.login('user@example.com')
+        m_models.Student.add_new_student_for_current_user('User', None)
+        student_id = users.get_current_user().user_id()
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        usage_id = parse_xml_string(rt, '<thumbs/>')
+        xsrf_token = utils.XsrfTokenManager.create_xsrf_token(
+            xblock_module.XBLOCK_XSRF_TOKEN_NAME)
+        url = '%s?%s' % (xblock_module.HANDLER_URI, urllib.urlencode({
+            'usage': usage_id,
+            'handler': 'vote',
+            'xsrf_token': xsrf_token}))
+        body = '{"voteType":"up"}'
+
+        # Use the vote handler to observe whether the handler runs
+        vote_fn = rt.get_block(usage_id).vote.__func__
+        xblock_module.cacheable_handler(vote_fn)
+        try:
+            response = self.post(url, body, {})
+            self.assertEqual('{"down": 0, "up": 1}', response.body)
+            first_etag = response.etag
+            self.assertIsNotNone(first_etag)
+            self.assertTrue(response.cache_control.private)
+
+            # The vote changed the state, so the first ETag no longer matches
+            response = self.testapp.post(
+                url, body, {'If-None-Match': '"%s"' % first_etag})
+            self.assertEqual(200, response.status_int)
+            self.assertEqual('{"down": 0, "up": 2}', response.body)
+
+            # An ETag for the current state is answered without the handler
+            student_rt = xblock_module.Runtime(
+                MockHandler(), student_id=student_id)
+            etag = student_rt.get_handler_etag(
+                student_rt.get_block(usage_id), 'vote', body)
+            self.assertNotEqual(first_etag, etag)
+            response = self.testapp.post(
+                url, body, {'If-None-Match': '"%s"' % etag})
+            self.assertEqual(304, response.status_int)
+            self.assertEqual(etag, response.etag)
+            self.assertEqual(2, rt.get_block(usage_id).upvotes)
+
+            # A wildcard does not match
+            response = self.testapp.post(url, body, {'If-None-Match': '*'})
+            self.assertEqual(200, response.status_int)
+            self.assertEqual(3, rt.get_block(usage_id).upvotes)
+        finally:
+            del vote_fn.xblock_cacheable
+
+    def test_uncacheable_handler_sends_no_etag(self):
+        actions.login('user@example.com')
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        usage_id = parse_xml_string(rt, '<thumbs/>')
+        xsrf_token = utils.XsrfTokenManager.create_xsrf_token(
+            xblock_module.XBLOCK_XSRF_TOKEN_NAME)
+        response = self.post(
+            '%s?%s' % (xblock_module.HANDLER_URI, urllib.urlencode({
+                'usage': usage_id,
+                'handler': 'vote',
+                'xsrf_token': xsrf_token})),
+            '{"voteType":"up"}', {})
+        self.assertIsNone(response.etag)
+
+    def test_handler_etag_changes_with_student_state(self):
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        usage_id = parse_xml_string(rt, '<thumbs/>')
+        block = rt.get_block(usage_id)
+        etag = rt.get_handler_etag(block, 'vote', '')
+
+        self.assertEqual(etag, rt.get_handler_etag(block, 'vote', ''))
+        self.assertNotEqual(etag, rt.get_handler_etag(block, 'vote', 'x'))
+        block.upvotes = 5
+        block.save()
+        self.assertNotEqual(etag, rt.get_handler_etag(block, 'vote', ''))
+
+    def test_prefetch_block_loads_fields_into_context_cache(self):
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        usage_id = parse_xml_string(rt, '<thumbs/>')
+        block = rt.get_block(usage_id)
+        block.upvotes = 3
+        block.save()
+
+        # pylint: disable=protected-access
+        def_id = rt.id_reader.get_definition_id(usage_id)
+        self.assertEqual(
+            (def_id, 'thumbs'),
+            xblock_module._get_block_ids_async(usage_id).get_result())
+        self.assertIsNone(
+            xblock_module._get_block_ids_async('no_such_usage').get_result())
+
+        context = ndb.get_context()
+        context.clear_cache()
+        rt = xblock_module.Runtime(MockHandler(), student_id='s23')
+        rt.prefetch_block_async(usage_id).get_result()
+
+        upvotes_key = ndb.Key(
+            xblock_module.store.KeyValueEntity,
+            xblock_module.store.key_string(xblock.runtime.KeyValueStore.Key(
+                scope=xblock.fields.Scope.user_state_summary,
+                user_id=None,
+                block_scope_id=usage_id,
+                field_name='upvotes')))
+        self.assertIn(upvotes_key, context._cache)
+        # pylint: enable=protected-access
+
+        self.assertEqual(3, rt.get_block(usage_id).upvotes)
+
+
+class XBlockBatchActionHandlerTestCase(TestBase):
+    """Functional tests for the XBlock batch callback handler."""
+
+    def setUp(self):
+        super(XBlockBatchActionHandlerTestCase, self).setUp()
+        actions.login('user@example.com')
+        self.rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        self.usage_id = parse_xml_string(self.rt, '<thumbs/>')
+
+    def post_batch(self, calls, xsrf_token=None, expect_errors=False):
+        xsrf_token = xsrf_token or utils.XsrfTokenManager.create_xsrf_token(
+            xblock_module.XBLOCK_XSRF_TOKEN_NAME)
+        return self.testapp.post(
+            '%s?%s' % (
+                xblock_module.BATCH_HANDLER_URI,
+                urllib.urlencode({'xsrf_token': xsrf_token})),
+            transforms.dumps({'calls': calls}),
+            {'Content-Type': 'application/json'},
+            expect_errors=expect_errors)
+
+    def test_post_batch(self):
+        vote = {
+            'usage': self.usage_id,
+            'handler': 'vote',
+            'body': '{"voteType":"up"}'}
+        bad_call = {'usage': 'no_such_usage', 'handler': 'vote'}
+        response = self.post_batch([vote, bad_call, vote])
+
+        self.assertEqual('application/json', response.content_type)
+        responses = transforms.loads(response.body)
+        self.assertEqual(3, len(responses))
+        self.assertEqual(200, responses[0]['status'])
+        self.assertEqual('application/json', responses[0]['content_type'])
+        self.assertEqual('{"down": 0, "up": 1}', responses[0]['body'])
+        self.assertEqual(500, responses[1]['status'])
+        self.assertEqual('{"down": 0, "up": 2}', responses[2]['body'])
+        self.assertEqual(2, self.rt.get_block(self.usage_id).upvotes)
+
+    def test_post_batch_bad_xsrf_rejected(self):
+        response = self.post_batch(
+            [{'usage': self.usage_id, 'handler': 'vote'}],
+            xsrf_token='bad_token', expect_errors=True)
+        self.assertEqual(400, response.status_int)
+        self.assertEqual(0, self.rt.get_block(self.usage_id).upvotes)
+
+    def test_post_batch_too_many_calls_rejected(self):
+        call = {'usage': self.usage_id, 'handler': 'vote', 'body': '{}'}
+        response = self.post_batch(
+            [call] * (xblock_module.MAX_BATCH_HANDLER_CALLS + 1),
+            expect_errors=True)
+        self.assertEqual(400, response.status_int)
+        self.assertEqual(0, self.rt.get_block(self.usage_id).upvotes)
+
 
 class GuestUserTestCase(TestBase):
     """Functional tests for the handling of logged-in and guest users."""
@@ -629,7 +1100,7 @@ class GuestUserTestCase(TestBase):
 
         # The response has a coookie with a temporary user id
         session_cookie = self.testapp.cookies['cb-guest-session']
-        self.assertRegexpMatches(session_cookie, r'^[0-9a-f]{32}$')
+        self.assertRegexpMatches(session_cookie, r'^[0-9a-f]{32}\.[0-9]+$')
 
         # Click on the second tab
         self._post_tab_position(xsrf_token, 1)
@@ -643,7 +1114,7 @@ class GuestUserTestCase(TestBase):
         self.assertEqual(1, self._extract_position(sequence_elt))
 
         # There was an event recorded
-        student_id = 'guest-%s' % session_cookie
+        student_id = 'guest-%s' % session_cookie.split('.')[0]
         event = m_models.EventEntity.all().fetch(1)[0]
         self.assertEqual(student_id, event.user_id)
 
@@ -691,6 +1162,95 @@ class GuestUserTestCase(TestBase):
         rt = xblock_module.Runtime(MockHandler(), student_id=student_id)
         self.assertEqual(1, rt.get_block(self.usage_id).position)
 
+    def _get_guest_user_id(self, session_cookie=None):
+        handler = MockUserHandler(None)
+        if session_cookie is not None:
+            handler.request.headers['Cookie'] = 'cb-guest-session=%s' % (
+                session_cookie)
+        user_id = xblock_module.get_enrolled_user_id_or_guest_user_id(handler)
+        # The id is memoized for the rest of the request
+        self.assertEqual(
+            user_id,
+            xblock_module.get_enrolled_user_id_or_guest_user_id(handler))
+        return user_id, handler.response.headers.getall('Set-Cookie')
+
+    def test_guest_session_cookie_is_set_when_missing_or_invalid(self):
+        for session_cookie in [None, 'bad_cookie']:
+            user_id, set_cookies = self._get_guest_user_id(session_cookie)
+            self.assertRegexpMatches(user_id, r'^guest-[0-9a-f]{32}$')
+            self.assertEqual(1, len(set_cookies))
+            self.assertIn('cb-guest-session=%s.' % user_id[6:], set_cookies[0])
+
+    def test_guest_session_cookie_is_not_rewritten_when_fresh(self):
+        session_id = '0123456789abcdef0123456789abcdef'
+        user_id, set_cookies = self._get_guest_user_id(
+            '%s.%s' % (session_id, int(time.time()) - 60))
+        self.assertEqual('guest-%s' % session_id, user_id)
+        self.assertEqual([], set_cookies)
+
+    def test_guest_session_cookie_is_refreshed_near_expiry(self):
+        session_id = '0123456789abcdef0123456789abcdef'
+        issued_at = int(time.time()) - (
+            xblock_module.GUEST_USER_SESSION_COOKIE_MAX_AGE_SEC -
+            xblock_module.GUEST_USER_SESSION_COOKIE_REFRESH_SEC + 60)
+        for session_cookie in [
+                '%s.%s' % (session_id, issued_at), session_id]:
+            user_id, set_cookies = self._get_guest_user_id(session_cookie)
+            self.assertEqual('guest-%s' % session_id, user_id)
+            self.assertEqual(1, len(set_cookies))
+            self.assertIn('cb-guest-session=%s.' % session_id, set_cookies[0])
+
+    def test_enrollment_lookup_is_cached(self):
+        lookups = []
+        orig_get_enrolled_student_by_email = m_models.Student.__dict__[
+            'get_enrolled_student_by_email']
+
+        def get_enrolled_student_by_email(email):
+            lookups.append(email)
+            return orig_get_enrolled_student_by_email.__get__(
+                None, m_models.Student)(email)
+
+        actions.login('user@example.com')
+        m_models.Student.add_new_student_for_current_user('User', None)
+        user = users.get_current_user()
+        student_id = user.user_id()
+
+        config.Registry.test_overrides[m_models.CAN_USE_MEMCACHE.name] = True
+        m_models.Student.get_enrolled_student_by_email = staticmethod(
+            get_enrolled_student_by_email)
+        try:
+            handler = MockUserHandler(user)
+            self.assertEqual(
+                student_id,
+                xblock_module.get_enrolled_user_id_or_guest_user_id(handler))
+            self.assertEqual(1, len(lookups))
+
+            # Repeated calls in the request are memoized
+            self.assertEqual(
+                student_id,
+                xblock_module.get_enrolled_user_id_or_guest_user_id(handler))
+            self.assertEqual(1, len(lookups))
+
+            # Later requests use memcache
+            self.assertEqual(
+                student_id,
+                xblock_module.get_enrolled_user_id_or_guest_user_id(
+                    MockUserHandler(user)))
+            self.assertEqual(1, len(lookups))
+
+            # Unenrolling clears the cache
+            student = m_models.Student.get_by_email('user@example.com')
+            student.is_enrolled = False
+            student.put()
+            self.assertTrue(
+                xblock_module.get_enrolled_user_id_or_guest_user_id(
+                    MockUserHandler(user)).startswith('guest-'))
+            self.assertEqual(2, len(lookups))
+        finally:
+            m_models.Student.get_enrolled_student_by_email = (
+                orig_get_enrolled_student_by_email)
+            del config.Registry.test_overrides[m_models.CAN_USE_MEMCACHE.name]
+
 
 class RootUsageTestCase(TestBase):
     """Functional tests for the root usage DAO and DTO."""
@@ -715,6 +1275,237 @@ class RootUsageTestCase(TestBase):
         root_usage = xblock_module.RootUsageDao.load(root_usage_id)
         self.assertIsNone(root_usage)
 
+    def test_root_usage_save_all_and_delete_all(self):
+        root_usage_id = xblock_module.RootUsageDao.save(
+            xblock_module.RootUsageDto(
+                None, {'description': 'old', 'usage_id': '123'}))
+        # Prime the cache
+        xblock_module.RootUsageDao.load(root_usage_id)
+
+        dtos = [
+            xblock_module.RootUsageDto(
+                root_usage_id, {'description': 'new', 'usage_id': '123'}),
+            xblock_module.RootUsageDto(
+                None, {'description': 'other', 'usage_id': '456'})]
+        ids = xblock_module.RootUsageDao.save_all(dtos)
+        self.assertEqual(2, len(ids))
+        self.assertEqual(root_usage_id, ids[0])
+        self.assertEqual(
+            'new', xblock_module.RootUsageDao.load(ids[0]).description)
+        self.assertEqual(
+            'other', xblock_module.RootUsageDao.load(ids[1]).description)
+
+        xblock_module.RootUsageDao.delete_all(
+            [xblock_module.RootUsageDto(the_id, {}) for the_id in ids])
+        self.assertIsNone(xblock_module.RootUsageDao.load(ids[0]))
+        self.assertIsNone(xblock_module.RootUsageDao.load(ids[1]))
+        self.assertEqual(0, len(xblock_module.RootUsageDao.get_all()))
+
+
+    def test_root_usage_description_markers(self):
+        dao = xblock_module.RootUsageDao
+        root_usage_id = dao.save(xblock_module.RootUsageDto(
+            None, {'description': 'x', 'usage_id': '123'}))
+        self.assertTrue(dao.is_description_taken('x'))
+        self.assertFalse(dao.is_description_taken('x', the_id=root_usage_id))
+
+        # A unique description is enforced only when asked for
+        dto = xblock_module.RootUsageDto(
+            None, {'description': 'x', 'usage_id': '456'})
+        with self.assertRaises(xblock_module.DuplicateDescriptionError):
+            dao.save(dto, unique_description=True)
+        self.assertEqual(1, len(dao.get_all()))
+
+        # Renaming releases the old description
+        dto = xblock_module.RootUsageDto(
+            root_usage_id, {'description': 'y', 'usage_id': '123'})
+        dao.save(dto, unique_description=True)
+        self.assertFalse(dao.is_description_taken('x'))
+        self.assertTrue(dao.is_description_taken('y'))
+
+        dao.delete(xblock_module.RootUsageDto(root_usage_id, {}))
+        self.assertFalse(dao.is_description_taken('y'))
+
+    def test_root_usage_batch_description_markers(self):
+        dao = xblock_module.RootUsageDao
+        ids = dao.save_all([
+            xblock_module.RootUsageDto(
+                None, {'description': 'x', 'usage_id': '123'}),
+            xblock_module.RootUsageDto(
+                None, {'description': 'y', 'usage_id': '456'})])
+        self.assertTrue(dao.is_description_taken('x'))
+        self.assertTrue(dao.is_description_taken('y'))
+
+        # Swap the descriptions
+        dao.save_all([
+            xblock_module.RootUsageDto(
+                ids[0], {'description': 'y', 'usage_id': '123'}),
+            xblock_module.RootUsageDto(
+                ids[1], {'description': 'x', 'usage_id': '456'})])
+        self.assertFalse(dao.is_description_taken('y', the_id=ids[0]))
+        self.assertFalse(dao.is_description_taken('x', the_id=ids[1]))
+
+        dao.delete_all(
+            [xblock_module.RootUsageDto(the_id, {}) for the_id in ids])
+        self.assertFalse(dao.is_description_taken('x'))
+        self.assertFalse(dao.is_description_taken('y'))
+
+    def test_root_usage_batch_save_keeps_markers_of_others(self):
+        dao = xblock_module.RootUsageDao
+        root_usage_id = dao.save(xblock_module.RootUsageDto(
+            None, {'description': 'x', 'usage_id': '123'}))
+        ids = dao.save_all([xblock_module.RootUsageDto(
+            None, {'description': 'x', 'usage_id': '456'})])
+
+        self.assertFalse(dao.is_description_taken('x', the_id=root_usage_id))
+        self.assertTrue(dao.is_description_taken('x', the_id=ids[0]))
+
+    def test_orphaned_description_marker_is_free(self):
+        dao = xblock_module.RootUsageDao
+        root_usage_id = dao.save(xblock_module.RootUsageDto(
+            None, {'description': 'x', 'usage_id': '123'}))
+        # Remove the root usage but not its marker, as a course restore would
+        db.delete(db.Key.from_path(
+            xblock_module.RootUsageEntity.kind(), root_usage_id))
+
+        self.assertFalse(dao.is_description_taken('x'))
+        new_id = dao.save(xblock_module.RootUsageDto(
+            None, {'description': 'x', 'usage_id': '456'}),
+            unique_description=True)
+        self.assertTrue(dao.is_description_taken('x'))
+        self.assertFalse(dao.is_description_taken('x', the_id=new_id))
+
+    def test_root_usage_reserve_description(self):
+        dao = xblock_module.RootUsageDao
+        root_usage_id, reserved = dao.reserve_description('x')
+        self.assertTrue(reserved)
+        self.assertFalse(dao.is_description_taken('x', the_id=root_usage_id))
+        self.assertEqual(
+            (root_usage_id, False),
+            dao.reserve_description('x', the_id=root_usage_id))
+        with self.assertRaises(xblock_module.DuplicateDescriptionError):
+            dao.reserve_description('x')
+
+        # The reserved description is kept when the root usage is saved
+        dao.save(xblock_module.RootUsageDto(
+            root_usage_id, {'description': 'x', 'usage_id': '123'}),
+            unique_description=True)
+        self.assertFalse(dao.is_description_taken('x', the_id=root_usage_id))
+
+        # Only the owner can release a description
+        dao.release_description('x', root_usage_id + 1)
+        self.assertTrue(dao.is_description_taken('x'))
+        dao.release_description('x', root_usage_id)
+        self.assertFalse(dao.is_description_taken('x'))
+
+    def test_root_usage_select_data_is_cached_until_write(self):
+        dao = xblock_module.RootUsageDao
+        id_b = dao.save(xblock_module.RootUsageDto(
+            None, {'description': 'b', 'usage_id': '123'}))
+        id_a = dao.save(xblock_module.RootUsageDto(
+            None, {'description': 'A', 'usage_id': '456'}))
+
+        select_data = dao.get_select_data()
+        self.assertEqual(
+            [(unicode(id_a), 'A'), (unicode(id_b), 'b')], select_data)
+        self.assertIs(select_data, dao.get_select_data())
+
+        ids = dao.save_all([xblock_module.RootUsageDto(
+            None, {'description': 'c', 'usage_id': '789'})])
+        self.assertEqual(
+            [(unicode(id_a), 'A'), (unicode(id_b), 'b'),
+             (unicode(ids[0]), 'c')],
+            dao.get_select_data())
+
+        dao.delete(xblock_module.RootUsageDto(id_b, {}))
+        self.assertEqual(
+            [(unicode(id_a), 'A'), (unicode(ids[0]), 'c')],
+            dao.get_select_data())
+
+    def test_root_usage_get_usage_ids(self):
+        dao = xblock_module.RootUsageDao
+        id_1 = dao.save(xblock_module.RootUsageDto(
+            None, {'description': 'x', 'usage_id': '123'}))
+        id_2 = dao.save(xblock_module.RootUsageDto(
+            None, {'description': 'y', 'usage_id': '456'}))
+
+        self.assertEqual(
+            {unicode(id_1): '123', unicode(id_2): '456'},
+            dao.get_usage_ids([id_1, str(id_2), '999999']))
+
+        # The results are cached until the root usages are written through the
+        # DAO again
+        db.delete(db.Key.from_path(
+            xblock_module.RootUsageEntity.kind(), id_1))
+        self.assertEqual({unicode(id_1): '123'}, dao.get_usage_ids([id_1]))
+        dao.delete(xblock_module.RootUsageDto(id_2, {}))
+        self.assertEqual({}, dao.get_usage_ids([id_1, id_2]))
+
+    def test_root_usage_get_page(self):
+        for description in ['b', 'C', 'a', 'D', 'e']:
+            xblock_module.RootUsageDao.save(xblock_module.RootUsageDto(
+                None, {'description': description, 'usage_id': '123'}))
+
+        dtos, cursor = xblock_module.RootUsageDao.get_page(page_size=2)
+        self.assertEqual(['a', 'b'], [dto.description for dto in dtos])
+        dtos, cursor = xblock_module.RootUsageDao.get_page(
+            cursor=cursor, page_size=2)
+        self.assertEqual(['C', 'D'], [dto.description for dto in dtos])
+        dtos, cursor = xblock_module.RootUsageDao.get_page(
+            cursor=cursor, page_size=2)
+        self.assertEqual(['e'], [dto.description for dto in dtos])
+        self.assertIsNone(cursor)
+
+    def test_root_usage_index_job(self):
+        # Store an entity as it was written before the index was added
+        entity = datastore.Entity(xblock_module.RootUsageEntity.kind())
+        entity['data'] = datastore_types.Text(transforms.dumps(
+            {'description': 'Legacy', 'usage_id': '123'}))
+        datastore.Put(entity)
+        self.assertEqual([], xblock_module.RootUsageDao.get_page()[0])
+
+        app_context = sites.get_all_courses()[0]
+        xblock_module.RootUsageIndexJob(app_context).run()
+        dtos, _ = xblock_module.RootUsageDao.get_page()
+        self.assertEqual(['Legacy'], [dto.description for dto in dtos])
+        self.assertTrue(
+            xblock_module.RootUsageDao.is_description_taken('Legacy'))
+
+    def test_root_usage_index_job_keeps_other_description_markers(self):
+        the_id = xblock_module.RootUsageDao.save(xblock_module.RootUsageDto(
+            None, {'description': 'Taken', 'usage_id': '123'}))
+        entity = datastore.Entity(xblock_module.RootUsageEntity.kind())
+        entity['data'] = datastore_types.Text(transforms.dumps(
+            {'description': 'Taken', 'usage_id': '456'}))
+        datastore.Put(entity)
+
+        app_context = sites.get_all_courses()[0]
+        xblock_module.RootUsageIndexJob(app_context).run()
+        self.assertFalse(xblock_module.RootUsageDao.is_description_taken(
+            'Taken', the_id=the_id))
+
+    def test_failed_root_usage_index_job_is_requeued(self):
+        app_context = sites.get_all_courses()[0]
+        index_job = xblock_module.RootUsageIndexJob(app_context)
+
+        def fail(unused_self):
+            raise ValueError('Index failed')
+        old_run = xblock_module.RootUsageIndexJob.run
+        xblock_module.RootUsageIndexJob.run = fail
+        try:
+            # pylint: disable=protected-access
+            xblock_module._ensure_root_usage_index(app_context)
+            self.execute_all_deferred_tasks()
+        finally:
+            xblock_module.RootUsageIndexJob.run = old_run
+        self.assertFalse(index_job.is_active())
+
+        xblock_module._ensure_root_usage_index(app_context)
+        # pylint: enable=protected-access
+        self.assertTrue(index_job.is_active())
+        self.execute_all_deferred_tasks()
+        self.assertFalse(index_job.is_active())
+
 
 class XBlockEditorTestCase(TestBase):
     """Functional tests for the XBlock editor in the dashboard."""
@@ -740,6 +1531,31 @@ class XBlockEditorTestCase(TestBase):
         response = self.get('dashboard?action=assets')
         self.assertIn('an xblock', response.body)
 
+    def test_xblock_list_is_paginated(self):
+        old_page_size = xblock_module.XBLOCK_LIST_PAGE_SIZE
+        xblock_module.XBLOCK_LIST_PAGE_SIZE = 2
+        try:
+            for description in ['xblock 3', 'xblock 1', 'xblock 2']:
+                xblock_module.RootUsageDao.save(xblock_module.RootUsageDto(
+                    None, {'description': description, 'usage_id': '123'}))
+
+            body = self.get('dashboard?action=assets').body
+            self.assertIn('xblock 1', body)
+            self.assertIn('xblock 2', body)
+            self.assertNotIn('xblock 3', body)
+            self.assertNotIn('[First page]', body)
+
+            next_url = re.search(
+                r'href="(dashboard\?action=assets&amp;xblock_cursor=[^"]*)"',
+                body).group(1).replace('&amp;', '&')
+            body = self.get(next_url).body
+            self.assertNotIn('xblock 1', body)
+            self.assertIn('xblock 3', body)
+            self.assertIn('[First page]', body)
+            self.assertNotIn('[Next page]', body)
+        finally:
+            xblock_module.XBLOCK_LIST_PAGE_SIZE = old_page_size
+
     def test_add_xblock_editor_present(self):
         response = self.get('dashboard?action=assets')
         self.assertIn(
@@ -879,11 +1695,47 @@ class XBlockEditorRESTHandlerTestCase(TestBase):
         self.assertEqual(412, resp_dict['status'])
         self.assertEqual('Missing description field', resp_dict['message'])
 
+    def test_put_fails_with_duplicate_description(self):
+        insert_thumbs_block()
+        response = self.put(
+            'rest/xblock',
+            self.get_request(self.xsrf_token, description='an xblock'))
+        resp_dict = transforms.loads(response.body)
+        self.assertEqual(412, resp_dict['status'])
+        self.assertEqual(
+            'The description must be different from existing XBlocks.',
+            resp_dict['message'])
+
+    def test_put_with_description_taken_after_validation_writes_nothing(self):
+        insert_thumbs_block()
+        usage_count = len(dbmodels.UsageEntity.all().fetch(1000))
+
+        # Simulate another save of the description after it was checked
+        old_is_description_taken = xblock_module.RootUsageDao.__dict__[
+            'is_description_taken']
+        xblock_module.RootUsageDao.is_description_taken = staticmethod(
+            lambda description, the_id=None: False)
+        try:
+            response = self.put(
+                'rest/xblock',
+                self.get_request(self.xsrf_token, description='an xblock'))
+        finally:
+            xblock_module.RootUsageDao.is_description_taken = (
+                old_is_description_taken)
+
+        resp_dict = transforms.loads(response.body)
+        self.assertEqual(412, resp_dict['status'])
+        self.assertEqual(
+            usage_count, len(dbmodels.UsageEntity.all().fetch(1000)))
+        self.assertEqual(1, len(xblock_module.RootUsageDao.get_all()))
+
     def test_put_fails_with_invalid_xml(self):
         response = self.put(
             'rest/xblock', self.get_request(self.xsrf_token, xml='<html'))
         resp_dict = transforms.loads(response.body)
         self.assertEqual(412, resp_dict['status'])
+        self.assertFalse(
+            xblock_module.RootUsageDao.is_description_taken('html block'))
 
     def test_put_fails_with_empty_xml(self):
         response = self.put(
@@ -1006,7 +1858,8 @@ class XBlockArchiveRESTHandlerTestCase(TestBase):
         files.finalize(file_name)
         return files.blobstore.get_blob_key(file_name)
 
-    def _base_import_archive(self, archive_name=None, dry_run=False):
+    def _base_import_archive(
+            self, archive_name=None, dry_run=False, validate_only=False):
         archive_name = archive_name or 'functional_tests.tar.gz'
         archive = os.path.join(
             os.path.dirname(__file__), 'resources', archive_name)
@@ -1014,11 +1867,67 @@ class XBlockArchiveRESTHandlerTestCase(TestBase):
 
         app_context = sites.get_app_context_for_namespace('ns_test')
         job = xblock_module.XBlockArchiveJob(
-            app_context, blob_key=blob_key, dry_run=dry_run)
+            app_context, blob_key=blob_key, dry_run=dry_run,
+            validate_only=validate_only)
         resp_dict = job.run()
         self.assertTrue(resp_dict['success'])
         return resp_dict
 
+    def _run_import_job(self, archive_files):
+        """Run an import of an archive holding the given files."""
+        archive_buffer = StringIO()
+        archive = tarfile.open(fileobj=archive_buffer, mode='w:gz')
+        info = tarfile.TarInfo('course')
+        info.type = tarfile.DIRTYPE
+        archive.addfile(info)
+        for name, data in archive_files.iteritems():
+            info = tarfile.TarInfo('course/%s' % name)
+            info.size = len(data)
+            archive.addfile(info, StringIO(data))
+        archive.close()
+
+        blob_key = self._store_in_blobstore(archive_buffer.getvalue())
+        app_context = sites.get_app_context_for_namespace('ns_test')
+        return xblock_module.XBlockArchiveJob(
+            app_context, blob_key=blob_key).run()
+
+    def _deep_archive_files(self, depth):
+        # The course, chapter, sequential and html add four levels
+        vertical_count = depth - 4
+        return {
+            'course.xml': '<course><chapter url_name="c1"/></course>',
+            'chapter/c1.xml': (
+                '<chapter display_name="Deep"><sequential url_name="s1"/>'
+                '</chapter>'),
+            'sequential/s1.xml': (
+                '<sequential display_name="Deep">%s<html>deep</html>%s'
+                '</sequential>') % (
+                    '<vertical>' * vertical_count,
+                    '</vertical>' * vertical_count)}
+
+    def test_import_deeply_nested_archive(self):
+        depth = xblock_module.MAX_IMPORT_XML_DEPTH
+        resp_dict = self._run_import_job(self._deep_archive_files(depth))
+        self.assertTrue(resp_dict['success'])
+        self.assertIn('Upload successfully imported', resp_dict['message'])
+
+        rt = xblock_module.Runtime(MockHandler())
+        block = rt.get_block('s1')
+        for _ in xrange(depth - 4):
+            self.assertEqual(1, len(block.children))
+            block = rt.get_block(block.children[0])
+            self.assertEqual('vertical', block.xml_element_name())
+        self.assertEqual(1, len(block.children))
+        block = rt.get_block(block.children[0])
+        self.assertEqual('html', block.xml_element_name())
+        self.assertEqual('deep', block.content)
+
+    def test_import_rejects_too_deeply_nested_archive(self):
+        depth = xblock_module.MAX_IMPORT_XML_DEPTH + 1
+        resp_dict = self._run_import_job(self._deep_archive_files(depth))
+        self.assertFalse(resp_dict['success'])
+        self.assertIn('nested at most', resp_dict['message'])
+
     def _import_archive(self, archive_name=None):
         resp_dict = self._base_import_archive(archive_name, dry_run=False)
         self.assertIn('Upload successfully imported', resp_dict['message'])
@@ -1231,7 +2140,8 @@ class XBlockArchiveRESTHandlerTestCase(TestBase):
         resp_dict = self._import_dry_run_archive(
             archive_name='functional_tests_merge.tar.gz')
         expected_message = """Upload successfully validated:
-Updating file '/assets/img/static/test.png'
+Skipping unchanged file '/assets/img/static/test.png'
+Static files: 0 inserted (0 bytes), 0 updated (0 bytes), 1 skipped (5861 bytes)
 Update unit title from 'Section 1' to 'Section One'
 Update lesson title from 'Subsection 1.1' to 'Subsection One point one'
 XBlock content updated in 'Subsection One point one' (974d5439622e4012bd28998efa15e02d)
@@ -1241,6 +2151,39 @@ Create lesson 'Subsection 2.1'
 XBlock content inserted in 'Subsection 2.1' (4d005fc5b85f436cb029d8b0942b4662)"""
         self.assertEqual(expected_message, resp_dict['message'])
 
+    def test_merge_keeps_root_usages_of_existing_lessons(self):
+        self._import_archive(archive_name='functional_tests.tar.gz')
+        app_context = sites.get_all_courses()[0]
+        course = courses.Course(None, app_context=app_context)
+        unit1_lessons = course.get_lessons(course.get_units()[0].unit_id)
+        lesson_1_1_objectives = unit1_lessons[0].objectives
+        lesson_1_2_root_usage = self._get_root_usage(
+            unit1_lessons[1].objectives)
+
+        self._import_archive(archive_name='functional_tests_merge.tar.gz')
+        app_context = sites.get_all_courses()[0]
+        course = courses.Course(None, app_context=app_context)
+        unit1, unit2 = course.get_units()
+
+        # The lesson which was retained still refers to the same root usage,
+        # and its description has been updated
+        lesson = course.get_lessons(unit1.unit_id)[0]
+        self.assertEqual(lesson_1_1_objectives, lesson.objectives)
+        root_usage = self._get_root_usage(lesson.objectives)
+        self.assertEqual(
+            'Unit 1, Lesson 1: Subsection One point one',
+            root_usage.description)
+
+        # The root usage of the deleted lesson has been removed, and the new
+        # lesson has a new root usage
+        self.assertIsNone(
+            xblock_module.RootUsageDao.load(lesson_1_2_root_usage.id))
+        lesson = course.get_lessons(unit2.unit_id)[0]
+        root_usage = self._get_root_usage(lesson.objectives)
+        self.assertEqual(
+            '4d005fc5b85f436cb029d8b0942b4662', root_usage.usage_id)
+        self.assertEqual(2, len(xblock_module.RootUsageDao.get_all()))
+
     def test_merge_does_not_affect_non_imported_xblocks(self):
         # Insert XBlock content menually
         xsrf_token = utils.XsrfTokenManager.create_xsrf_token(
@@ -1286,6 +2229,22 @@ XBlock content inserted in 'Subsection 2.1' (4d005fc5b85f436cb029d8b0942b4662)""
         fs = app_context.fs.impl
         self.assertEqual(0, len(fs.list(fs.physical_to_logical(''))))
 
+    def test_validate_only_with_good_course_archive(self):
+        resp_dict = self._base_import_archive(validate_only=True)
+        self.assertIn(
+            'Upload structure successfully validated', resp_dict['message'])
+        self.assertIn('Create unit \'Section 1\'', resp_dict['message'])
+
+        # Confirm that nothing was installed
+        app_context = sites.get_all_courses()[0]
+        course = courses.Course(None, app_context=app_context)
+        self.assertEqual(0, len(course.get_units()))
+        self.assertEqual(0, len(xblock_module.RootUsageDao.get_all()))
+        self.assertEqual(0, len(dbmodels.DefinitionEntity.all().fetch(1000)))
+        self.assertEqual(0, len(dbmodels.KeyValueEntity.all().fetch(1000)))
+        fs = app_context.fs.impl
+        self.assertEqual(0, len(fs.list(fs.physical_to_logical(''))))
+
     def test_import_appends_new_units(self):
         app_context = sites.get_all_courses()[0]
         course = courses.Course(None, app_context=app_context)
@@ -1412,6 +2371,9 @@ class ImporterTestCase(TestBase):
 
         def __init__(self):
             self.course_xml = '<course/>'
+            self.files = {}
+            self.missing_files = []
+            self.extracted_paths = []
             self.members = [
                 self.MockMember('root', isdir=True),
                 self.MockMember('root/course.xml'),
@@ -1421,8 +2383,13 @@ class ImporterTestCase(TestBase):
             return self.members
 
         def extractfile(self, path):
-            if path == 'root/course.xml':
+            self.extracted_paths.append(path)
+            if path in self.missing_files:
+                raise KeyError(path)
+            elif path == 'root/course.xml':
                 return StringIO(self.course_xml)
+            elif path in self.files:
+                return StringIO(self.files[path])
             else:
                 return StringIO('file_data')
 
@@ -1433,6 +2400,7 @@ class ImporterTestCase(TestBase):
 
     class MockFileSystem(object):
         def __init__(self):
+            self.existing_files = []
             self.last_put = None
             self.last_filedata_list = None
             self.wait_and_finalize_called = False
@@ -1440,8 +2408,11 @@ class ImporterTestCase(TestBase):
         def physical_to_logical(self, path):
             return path
 
-        def isfile(self, unused_path):
-            return False
+        def isfile(self, path):
+            return path in self.existing_files
+
+        def list(self, unused_dir_name):
+            return self.existing_files
 
         def put(self, path, unused_data):
             self.last_put = path
@@ -1496,13 +2467,157 @@ class ImporterTestCase(TestBase):
         self.assertEqual(1, len(errors))
         self.assertIn('Chapters may only contain sequentials', errors[0])
 
-    def test_overwrite_duplicate_files(self):
+    def test_validate_reports_all_structural_errors(self):
+        self.archive.course_xml = (
+            '<course><vertical/><chapter display_name="C1"><vertical/>'
+            '<html/></chapter></course>')
+        self.importer = self._new_importer()
+        self.importer.parse()
+
+        errors = self.importer.validate()
+        self.assertEqual(3, len(errors))
+        self.assertIn('content must be in chapters', errors[0])
+        self.assertIn(
+            'Chapters may only contain sequentials, but \'C1\' contains '
+            '<vertical>', errors[1])
+        self.assertIn('<html>', errors[2])
+
+    def test_validate_reports_missing_files(self):
+        self.archive.course_xml = (
+            '<course><chapter><sequential url_name="s1"/>'
+            '<sequential><html filename="h1"/></sequential></chapter>'
+            '</course>')
+        self.archive.missing_files = [
+            'root/sequential/s1.xml', 'root/html/h1.html']
+        self.importer = self._new_importer()
+        self.importer.parse()
+
+        errors = self.importer.validate()
+        self.assertEqual(2, len(errors))
+        self.assertIn('root/sequential/s1.xml', errors[0])
+        self.assertIn('root/html/h1.html', errors[1])
+
+    def test_validate_reports_missing_course_file(self):
+        self.archive.missing_files = ['root/course.xml']
+        self.importer = self._new_importer()
+        self.importer.parse()
+
+        errors = self.importer.validate()
+        self.assertEqual(1, len(errors))
+        self.assertIn('missing the file \'root/course.xml\'', errors[0])
+
+    def test_validate_content_does_not_construct_blocks(self):
+        self.archive.course_xml = (
+            '<course><chapter><sequential><vertical usage_id="v1">'
+            '<not_a_block usage_id="b1"/><html><p/></html></vertical>'
+            '<not_a_block usage_id="b2"/></sequential></chapter></course>')
+        self.archive.members.append(self.MockArchive.MockMember(
+            'root/static/big.png',
+            size=xblock_module.MAX_ASSET_UPLOAD_SIZE_K * 1024 + 1))
+        self.archive.members.append(self.MockArchive.MockMember(
+            'root/static/small.png', size=1))
+        self.importer = xblock_module.Importer(
+            self.archive, self.course, self.fs, None, validate_only=True)
+        self.importer.parse()
+
+        errors = sorted(self.importer.validate_content())
+        self.assertEqual(3, len(errors))
+        self.assertIn('root/static/big.png', errors[0])
+        self.assertIn('Unsupported block type <not_a_block> (b1)', errors[1])
+        self.assertIn('Unsupported block type <not_a_block> (b2)', errors[2])
+
+    def test_validate_only_does_not_install_files(self):
         self.archive.members.append(
             self.MockArchive.MockMember('root/static/test.png'))
+        self.importer = xblock_module.Importer(
+            self.archive, self.course, self.fs, None, validate_only=True)
+        self.importer.parse()
+        self.importer.do_import()
+        self.assertTrue(self.importer.dry_run)
+        self.assertIsNone(self.fs.last_filedata_list)
+        self.assertNotIn('root/static/test.png', self.archive.extracted_paths)
+
+    def test_validate_only_does_not_load_root_usages(self):
+        self.importer = xblock_module.Importer(
+            self.archive, self.course, self.fs, None, validate_only=True)
+        self.importer.parse()
+
+        def fail():
+            self.fail('Root usages loaded')
+        old_iter_all = xblock_module.RootUsageDao.__dict__['iter_all']
+        xblock_module.RootUsageDao.iter_all = staticmethod(fail)
+        try:
+            self.importer.do_import()
+        finally:
+            xblock_module.RootUsageDao.iter_all = old_iter_all
+
+    def test_parse_reads_each_referenced_file_once(self):
+        self.archive.course_xml = (
+            '<course>'
+            '<chapter><sequential url_name="s1"/></chapter>'
+            '<chapter><sequential url_name="s1"/></chapter>'
+            '</course>')
+        self.archive.files = {
+            'root/sequential/s1.xml': (
+                '<sequential display_name="S1"><html filename="h1"/>'
+                '</sequential>'),
+            'root/html/h1.html': '<p><img src="/static/test.png"></p>'}
+        self.importer = self._new_importer()
+        self.importer.parse()
+
+        self.assertEqual(
+            1, self.archive.extracted_paths.count('root/sequential/s1.xml'))
+        self.assertEqual(
+            1, self.archive.extracted_paths.count('root/html/h1.html'))
+        self.assertIn('root/sequential/s1.xml', self.importer.parse_timings)
+        self.assertIn('root/html/h1.html', self.importer.parse_timings)
+
+        # Each chapter has its own copy of the sequential
+        sequentials = self.importer.course_root.findall('chapter/sequential')
+        self.assertEqual(2, len(sequentials))
+        self.assertIsNot(sequentials[0], sequentials[1])
+        for sequential in sequentials:
+            self.assertEqual('s1', sequential.attrib['usage_id'])
+            self.assertEqual('S1', sequential.attrib['display_name'])
+            self.assertNotIn('filename', sequential.find('html').attrib)
+            self.assertEqual(
+                'assets/img/static/test.png',
+                sequential.find('.//img').attrib['src'])
+
+    def test_parse_rejects_circular_references(self):
+        self.archive.course_xml = (
+            '<course><chapter url_name="c1"/></course>')
+        self.archive.files = {
+            'root/chapter/c1.xml': '<chapter><chapter url_name="c1"/></chapter>'}
+        self.importer = self._new_importer()
+        try:
+            self.importer.parse()
+            self.fail('Expected BadImportException')
+        except xblock_module.BadImportException as expected:
+            self.assertIn('Circular reference', str(expected))
+
+    def test_parse_deeply_nested_content(self):
+        depth = sys.getrecursionlimit() + 100
+        self.archive.course_xml = (
+            '<course><chapter><sequential>%s%s</sequential></chapter>'
+            '</course>') % ('<vertical>' * depth, '</vertical>' * depth)
+        self.importer = self._new_importer()
+        self.importer.parse()
+
+        node = self.importer.course_root.find('chapter/sequential')
+        for _ in xrange(depth):
+            node = node.find('vertical')
+        self.assertEqual(0, len(node))
+
+        # Such a course cannot be built as XBlocks, and fails validation
+        errors = self.importer.validate()
+        self.assertEqual(1, len(errors))
+        self.assertIn('nested at most', errors[0])
 
-        def isfile(path):
-            return path == '/assets/img/static/test.png'
-        self.fs.isfile = isfile
+    def test_overwrite_duplicate_files(self):
+        self.archive.members.append(
+            self.MockArchive.MockMember('root/static/test.png'))
+        self.fs.existing_files = ['/assets/img/static/test.png']
         self.assertIsNone(self.fs.last_put)
 
         self.importer = self._new_importer()
@@ -1514,6 +2629,56 @@ class ImporterTestCase(TestBase):
         self.assertEquals(2, len(fd_list[0]))
         self.assertEquals('/assets/img/static/test.png', fd_list[0][0])
         self.assertEquals('file_data', fd_list[0][1].read())
+        self.assertIn(
+            'Updating file \'/assets/img/static/test.png\'',
+            self.importer.journal)
+
+        # The digest of the installed file is recorded
+        entity = xblock_module.StaticFileDigestEntity.get_by_key_name(
+            '/assets/img/static/test.png')
+        self.assertEquals(hashlib.sha1('file_data').hexdigest(), entity.digest)
+
+    def test_skip_unchanged_files(self):
+        self.archive.members.append(
+            self.MockArchive.MockMember('root/static/test.png', size=9))
+        self.fs.existing_files = ['/assets/img/static/test.png']
+        xblock_module.StaticFileDigestEntity(
+            key_name='/assets/img/static/test.png',
+            digest=hashlib.sha1('file_data').hexdigest()).put()
+
+        self.importer = self._new_importer()
+        self.importer.parse()
+        self.importer.do_import()
+        self.assertIsNone(self.fs.last_filedata_list)
+        self.assertEquals([
+            'Skipping unchanged file \'/assets/img/static/test.png\'',
+            'Static files: 0 inserted (0 bytes), 0 updated (0 bytes), '
+            '1 skipped (9 bytes)'], self.importer.journal)
+
+    def test_upload_static_files_in_batches(self):
+        file_count = xblock_module.STATIC_FILE_UPLOAD_BATCH_SIZE + 1
+        for i in xrange(file_count):
+            self.archive.members.append(
+                self.MockArchive.MockMember('root/static/%s.png' % i))
+
+        filedata_lists = []
+
+        def put_multi_async(filedata_list):
+            filedata_lists.append(filedata_list)
+            return lambda: None
+        self.fs.put_multi_async = put_multi_async
+
+        self.importer = self._new_importer()
+        self.importer.parse()
+        self.importer.do_import()
+        self.assertEquals(2, len(filedata_lists))
+        self.assertEquals(
+            xblock_module.STATIC_FILE_UPLOAD_BATCH_SIZE,
+            len(filedata_lists[0]))
+        self.assertEquals(1, len(filedata_lists[1]))
+        self.assertIn(
+            'Static files: %s inserted (0 bytes), 0 updated (0 bytes), '
+            '0 skipped (0 bytes)' % file_count, self.importer.journal)
 
     def test_refuse_to_install_too_large_files(self):
         self.archive.members.append(self.MockArchive.MockMember(
@@ -1528,6 +2693,468 @@ class ImporterTestCase(TestBase):
             self.assertIn('Cannot upload files bigger than', str(expected))
 
 
+class XBlockExportJobTestCase(TestBase):
+    """Functional tests for the job which exports a course as an archive."""
+
+    def setUp(self):
+        super(XBlockExportJobTestCase, self).setUp()
+        self.testbed.init_blobstore_stub()
+        self.testbed.init_files_stub()
+        self.base = '/test'
+        sites.setup_courses('course:/test::ns_test, course:/:/')
+        self.old_namespace = namespace_manager.get_namespace()
+        namespace_manager.set_namespace('ns_test')
+        self.app_context = sites.get_app_context_for_namespace('ns_test')
+
+    def tearDown(self):
+        namespace_manager.set_namespace(self.old_namespace)
+        super(XBlockExportJobTestCase, self).tearDown()
+
+    def _store_in_blobstore(self, data):
+        file_name = files.blobstore.create(mime_type='application/octet-stream')
+        with files.open(file_name, 'a') as f:
+            f.write(data)
+        files.finalize(file_name)
+        return files.blobstore.get_blob_key(file_name)
+
+    def _import_archive(self, blob_key, dry_run=False):
+        job = xblock_module.XBlockArchiveJob(
+            self.app_context, blob_key=blob_key, dry_run=dry_run)
+        resp_dict = job.run()
+        self.assertTrue(resp_dict['success'])
+        return resp_dict['message']
+
+    def _export_archive(self):
+        job = xblock_module.XBlockExportJob(self.app_context)
+        job.submit()
+        self.execute_all_deferred_tasks()
+        self.assertFalse(job.is_active())
+        state = job.load_export_state()
+        self.assertTrue(state.success)
+        return {'message': state.message, 'blob_key': state.blob_key}
+
+    def _open_archive(self, blob_key):
+        return tarfile.open(
+            fileobj=blobstore.BlobReader(blob_key), mode='r:gz')
+
+    def test_export_empty_course(self):
+        resp_dict = self._export_archive()
+        archive = self._open_archive(resp_dict['blob_key'])
+        self.assertEqual(
+            ['course', 'course/course.xml'], archive.getnames())
+        course_xml = archive.extractfile('course/course.xml').read()
+        self.assertEqual(0, len(cElementTree.XML(course_xml)))
+
+    def test_export_writes_olx_layout(self):
+        archive = os.path.join(
+            os.path.dirname(__file__), 'resources', 'functional_tests.tar.gz')
+        self._import_archive(self._store_in_blobstore(open(archive).read()))
+
+        resp_dict = self._export_archive()
+        self.assertIn('Course successfully exported', resp_dict['message'])
+        self.assertIn(
+            'Static files: 1 exported (5861 bytes)', resp_dict['message'])
+        archive = self._open_archive(resp_dict['blob_key'])
+        names = archive.getnames()
+
+        course_root = cElementTree.XML(
+            archive.extractfile('course/course.xml').read())
+        self.assertEqual(
+            ['688fe994cb234bf48eb96c84aea018b5',
+             '094732b6779740029b88d8db4efce83b'],
+            [chapter.attrib['url_name'] for chapter in course_root])
+
+        chapter = cElementTree.XML(archive.extractfile(
+            'course/chapter/688fe994cb234bf48eb96c84aea018b5.xml').read())
+        self.assertEqual('Section 1', chapter.attrib['display_name'])
+        self.assertEqual(2, len(chapter))
+
+        sequential_path = 'course/sequential/%s.xml' % (
+            chapter[0].attrib['url_name'])
+        sequential = cElementTree.XML(
+            archive.extractfile(sequential_path).read())
+        self.assertEqual('Subsection 1.1', sequential.attrib['display_name'])
+
+        # HTML content is written to separate files
+        html = sequential.find('.//html')
+        self.assertEqual(0, len(html))
+        self.assertIn('course/html/%s.html' % html.attrib['filename'], names)
+
+        self.assertIn('course/static/test.png', names)
+        self.assertEqual(
+            5861, len(archive.extractfile('course/static/test.png').read()))
+
+    def test_exported_archive_can_be_merged_back(self):
+        archive = os.path.join(
+            os.path.dirname(__file__), 'resources', 'functional_tests.tar.gz')
+        self._import_archive(self._store_in_blobstore(open(archive).read()))
+
+        resp_dict = self._export_archive()
+        journal = self._import_archive(resp_dict['blob_key'], dry_run=True)
+
+        # The units and lessons are matched with the existing ones
+        self.assertNotIn('Create unit', journal)
+        self.assertNotIn('Create lesson', journal)
+        self.assertNotIn('Delete', journal)
+        self.assertIn('Skipping unchanged file', journal)
+
+    def test_export_writes_one_unit_per_task(self):
+        archive = os.path.join(
+            os.path.dirname(__file__), 'resources', 'functional_tests.tar.gz')
+        self._import_archive(self._store_in_blobstore(open(archive).read()))
+        unit_count = len(courses.Course(
+            None, app_context=self.app_context).get_units())
+
+        job = xblock_module.XBlockExportJob(self.app_context)
+        self.assertTrue(job.run()['success'])
+        self.assertTrue(job.is_active())
+        self.assertEqual(0, job.load_export_state().step)
+
+        self.execute_all_deferred_tasks()
+        self.assertFalse(job.is_active())
+        state = job.load_export_state()
+        self.assertTrue(state.success)
+        # One task for each unit and one for the batch of static files
+        self.assertEqual(unit_count + 1, state.step)
+
+    def test_export_deletes_previous_archive(self):
+        first_blob_key = self._export_archive()['blob_key']
+        second_blob_key = self._export_archive()['blob_key']
+        self.assertNotEqual(first_blob_key, second_blob_key)
+        self.assertIsNone(blobstore.BlobInfo.get(first_blob_key))
+        self.assertIsNotNone(blobstore.BlobInfo.get(second_blob_key))
+
+    def test_download_serves_exported_archive(self):
+        actions.login('admin@example.com', is_admin=True)
+        blob_key = self._export_archive()['blob_key']
+
+        response = self.get('xblock_export_download')
+        self.assertEqual(200, response.status_int)
+        self.assertEqual(
+            blob_key, response.headers[blobstore.BLOB_KEY_HEADER])
+
+    def test_export_requires_edit_rights(self):
+        actions.login('user@example.com')
+        request = {
+            'key': '',
+            'payload': transforms.dumps({}),
+            'xsrf_token': utils.XsrfTokenManager.create_xsrf_token(
+                xblock_module.XBlockExportRESTHandler.XSRF_TOKEN)}
+        response = self.put(
+            'rest/xblock_export', {'request': transforms.dumps(request)})
+        self.assertEqual(401, transforms.loads(response.body)['status'])
+        self.assertFalse(
+            xblock_module.XBlockExportJob(self.app_context).is_active())
+
+    def test_download_requires_admin(self):
+        actions.login('user@example.com')
+        response = self.get(
+            'xblock_export_download', expect_errors=True)
+        self.assertEqual(401, response.status_int)
+
+
+class XBlockGarbageCollectionJobTestCase(TestBase):
+    """Functional tests for the job which deletes unreachable XBlocks."""
+
+    def setUp(self):
+        super(XBlockGarbageCollectionJobTestCase, self).setUp()
+        sites.setup_courses('course:/test::ns_test, course:/:/')
+        self.old_namespace = namespace_manager.get_namespace()
+        namespace_manager.set_namespace('ns_test')
+        self.app_context = sites.get_app_context_for_namespace('ns_test')
+        self.base = '/test'
+
+    def tearDown(self):
+        namespace_manager.set_namespace(self.old_namespace)
+        super(XBlockGarbageCollectionJobTestCase, self).tearDown()
+
+    def _insert_root_usage(self, xml):
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        usage_id = parse_xml_string(rt, xml)
+        return xblock_module.RootUsageDao.save(xblock_module.RootUsageDto(
+            None, {'description': 'an xblock', 'usage_id': usage_id}))
+
+    def _run_job(self, dry_run):
+        job = xblock_module.XBlockGarbageCollectionJob(
+            self.app_context, dry_run=dry_run)
+        job.submit()
+        self.execute_all_deferred_tasks()
+        self.assertFalse(job.is_active())
+        return job.load_sweep_state().message
+
+    def _assert_usage_exists(self, usage_id, exists=True):
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        try:
+            rt.get_block(usage_id)
+            self.assertTrue(exists)
+        except xblock.exceptions.NoSuchUsage:
+            self.assertFalse(exists)
+
+    def test_deletes_blocks_detached_by_update(self):
+        self._insert_root_usage(
+            '<vertical usage_id="vertical_id">'
+            '<html usage_id="html_id">text</html></vertical>')
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        parse_xml_string(rt, '<vertical usage_id="vertical_id"></vertical>')
+
+        # A dry run only reports the unreachable entities
+        message = self._run_job(dry_run=True)
+        self.assertIn('Found 1 usages, 1 definitions', message)
+        self._assert_usage_exists('html_id')
+
+        message = self._run_job(dry_run=False)
+        self.assertIn('Deleted 1 usages, 1 definitions', message)
+        self._assert_usage_exists('html_id', exists=False)
+        self._assert_usage_exists('vertical_id')
+        self.assertIsNone(xblock_module.store.KeyValueEntity.get_by_id(
+            'definition.html_id.content'))
+
+        # Nothing is left to collect
+        message = self._run_job(dry_run=False)
+        self.assertIn('Deleted 0 usages, 0 definitions', message)
+
+    def test_deletes_tree_of_deleted_root_usage(self):
+        root_usage_id = self._insert_root_usage(
+            '<vertical usage_id="vertical_1"><html usage_id="html_1">1</html>'
+            '</vertical>')
+        self._insert_root_usage(
+            '<vertical usage_id="vertical_2"><html usage_id="html_2">2</html>'
+            '</vertical>')
+        xblock_module.RootUsageDao.delete(
+            xblock_module.RootUsageDto(root_usage_id, {}))
+
+        self._run_job(dry_run=False)
+        self._assert_usage_exists('vertical_1', exists=False)
+        self._assert_usage_exists('html_1', exists=False)
+        self._assert_usage_exists('vertical_2')
+        self._assert_usage_exists('html_2')
+
+    def test_keeps_student_state_of_reachable_blocks(self):
+        self._insert_root_usage('<sequential usage_id="seq_id"></sequential>')
+        rt = xblock_module.Runtime(MockHandler(), student_id='s23')
+        block = rt.get_block('seq_id')
+        block.position = 3
+        block.save()
+
+        self._run_job(dry_run=False)
+        rt = xblock_module.Runtime(MockHandler(), student_id='s23')
+        self.assertEqual(3, rt.get_block('seq_id').position)
+
+    def test_keeps_blocks_attached_during_collection(self):
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        parse_xml_string(rt, '<html usage_id="detached_id">text</html>')
+        job = xblock_module.XBlockGarbageCollectionJob(
+            self.app_context, dry_run=False)
+        self.assertTrue(job.run()['success'])
+
+        # A root saved after marking is marked before the sweep deletes
+        self._insert_root_usage('<html usage_id="detached_id">text</html>')
+        self.execute_all_deferred_tasks()
+
+        self.assertIn(
+            'Deleted 0 usages, 0 definitions', job.load_sweep_state().message)
+        self._assert_usage_exists('detached_id')
+
+    def test_sweep_runs_in_batches_and_removes_marks(self):
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        for i in xrange(3):
+            parse_xml_string(rt, '<html usage_id="detached_%s">%s</html>' % (
+                i, i))
+        self._insert_root_usage('<html usage_id="kept_id">text</html>')
+
+        old_batch_size = xblock_module.GC_SWEEP_BATCH_SIZE
+        xblock_module.GC_SWEEP_BATCH_SIZE = 1
+        try:
+            message = self._run_job(dry_run=False)
+        finally:
+            xblock_module.GC_SWEEP_BATCH_SIZE = old_batch_size
+
+        self.assertIn('Deleted 3 usages, 3 definitions', message)
+        self._assert_usage_exists('kept_id')
+        self.assertEqual(
+            0, len(xblock_module.XBlockGarbageMarkEntity.query().fetch(10)))
+
+    def test_job_is_active_until_sweep_completes(self):
+        job = xblock_module.XBlockGarbageCollectionJob(self.app_context)
+        self.assertTrue(job.run()['success'])
+        # The job has run, but the sweep is still queued
+        self.assertTrue(job.is_active())
+        self.execute_all_deferred_tasks()
+        self.assertFalse(job.is_active())
+
+    def test_editor_refuses_saves_during_collection(self):
+        actions.login('admin@example.com', is_admin=True)
+        xblock_module.XBlockGarbageCollectionJob(self.app_context).submit()
+        xsrf_token = utils.XsrfTokenManager.create_xsrf_token(
+            xblock_module.XBlockEditorRESTHandler.XSRF_TOKEN)
+        response = self.put(
+            'rest/xblock',
+            XBlockEditorRESTHandlerTestCase.get_request(xsrf_token))
+        resp_dict = transforms.loads(response.body)
+        self.assertEqual(412, resp_dict['status'])
+        self.assertEqual(
+            xblock_module.messages.GARBAGE_COLLECTION_IN_PROGRESS,
+            resp_dict['message'])
+
+    def test_rest_handler_starts_collection(self):
+        actions.login('admin@example.com', is_admin=True)
+        xsrf_token = utils.XsrfTokenManager.create_xsrf_token(
+            xblock_module.XBlockGarbageCollectionRESTHandler.XSRF_TOKEN)
+        request = {
+            'key': '',
+            'payload': transforms.dumps({'dry_run': True}),
+            'xsrf_token': xsrf_token}
+        response = self.put(
+            'rest/xblock_garbage_collection',
+            {'request': transforms.dumps(request)})
+        resp_dict = transforms.loads(response.body)
+        self.assertEqual(200, resp_dict['status'])
+        self.assertTrue(
+            xblock_module.XBlockGarbageCollectionJob(
+                self.app_context).is_active())
+
+
+class PackedFieldStorageTestCase(TestBase):
+    """Functional tests for the packed layout of student fields."""
+
+    def _enable_packed_storage(self):
+        config.Registry.test_overrides[
+            xblock_module.XBLOCK_PACKED_FIELD_STORAGE.name] = True
+
+    def tearDown(self):
+        config.Registry.test_overrides.pop(
+            xblock_module.XBLOCK_PACKED_FIELD_STORAGE.name, None)
+        super(PackedFieldStorageTestCase, self).tearDown()
+
+    def _get_key(self, scope, user_id, field_name):
+        return xblock.runtime.KeyValueStore.Key(
+            scope=scope, user_id=user_id,
+            block_scope_id='0d40c9be8e254416b4782bf8e19a538f',
+            field_name=field_name)
+
+    def test_student_fields_are_stored_in_one_entity(self):
+        kvs = xblock_module.PackedKeyValueStore()
+        first_key = self._get_key(xblock.fields.Scope.user_state, 's23', 'a')
+        second_key = self._get_key(xblock.fields.Scope.user_state, 's23', 'b')
+        content_key = self._get_key(xblock.fields.Scope.content, None, 'c')
+        kvs.set_many({first_key: 1, second_key: [2], content_key: 'text'})
+
+        packed_entity = xblock_module.PackedKeyValueEntity.get_by_id(
+            'usage.0d40c9be8e254416b4782bf8e19a538f.s23')
+        self.assertEqual({'a': 1, 'b': [2]}, packed_entity.fields)
+        self.assertIsNone(xblock_module.store.KeyValueEntity.get_by_id(
+            xblock_module.store.key_string(first_key)))
+        self.assertEqual(
+            'text', xblock_module.store.KeyValueEntity.get_by_id(
+                xblock_module.store.key_string(content_key)).value)
+
+        kvs = xblock_module.PackedKeyValueStore()
+        self.assertEqual(1, kvs.get(first_key))
+        self.assertEqual('text', kvs.get(content_key))
+
+        kvs.delete(first_key)
+        self.assertFalse(kvs.has(first_key))
+        self.assertTrue(kvs.has(second_key))
+        with self.assertRaises(KeyError):
+            xblock_module.PackedKeyValueStore().get(first_key)
+
+    def test_unpacked_student_fields_are_read_until_first_write(self):
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        usage_id = parse_xml_string(rt, '<thumbs/>')
+        keys = dict(
+            (student_id, xblock.runtime.KeyValueStore.Key(
+                scope=xblock.fields.Scope.user_state, user_id=student_id,
+                block_scope_id=usage_id, field_name='voted'))
+            for student_id in ['s23', 's24'])
+        xblock_module.store.KeyValueStore().set_many(
+            {keys['s23']: True, keys['s24']: True})
+
+        # The fields are read by key, as named by the class of the block
+        kvs = xblock_module.PackedKeyValueStore()
+        self.assertTrue(kvs.get(keys['s23']))
+
+        kvs.set(keys['s23'], False)
+        packed_entity = xblock_module.PackedKeyValueEntity.get_by_id(
+            'usage.%s.s23' % usage_id)
+        self.assertEqual({'voted': False}, packed_entity.fields)
+
+        # Once packed, a deleted field is not read from the old layout
+        kvs.delete(keys['s23'])
+        kvs = xblock_module.PackedKeyValueStore()
+        self.assertFalse(kvs.has(keys['s23']))
+        self.assertTrue(kvs.get(keys['s24']))
+
+    def test_unpacked_student_fields_of_unknown_block_are_empty(self):
+        # pylint: disable=protected-access
+        self.assertEqual({}, xblock_module._get_unpacked_student_fields(
+            'usage.0d40c9be8e254416b4782bf8e19a538f.s23'))
+
+    def test_migration_job_packs_existing_student_fields(self):
+        rt = xblock_module.Runtime(MockHandler(), is_admin=True)
+        usage_id = parse_xml_string(rt, '<thumbs/>')
+        for student_id in ['s23', 's24']:
+            rt = xblock_module.Runtime(MockHandler(), student_id=student_id)
+            block = rt.get_block(usage_id)
+            block.voted = True
+            block.upvotes = 1
+            block.save()
+
+        # The job refuses to run while the old layout is still written
+        app_context = sites.get_all_courses()[0]
+        resp_dict = xblock_module.PackedFieldMigrationJob(app_context).run()
+        self.assertFalse(resp_dict['success'])
+        self.assertIsNone(xblock_module.PackedKeyValueEntity.get_by_id(
+            'usage.%s.s23' % usage_id))
+
+        # State saved before packed storage was enabled is read, and merged
+        # into the packed layout by the first write
+        self._enable_packed_storage()
+        rt = xblock_module.Runtime(MockHandler(), student_id='s23')
+        block = rt.get_block(usage_id)
+        self.assertTrue(block.voted)
+        self.assertEqual(1, block.upvotes)
+        block.voted = False
+        block.save()
+
+        # The job packs the state of s24 but keeps the newer state of s23
+        resp_dict = xblock_module.PackedFieldMigrationJob(app_context).run()
+        self.assertTrue(resp_dict['success'])
+        self.assertIn('of 1 blocks', resp_dict['message'])
+        self.assertEqual(
+            {'voted': False},
+            xblock_module.PackedKeyValueEntity.get_by_id(
+                'usage.%s.s23' % usage_id).fields)
+        self.assertEqual(
+            {'voted': True},
+            xblock_module.PackedKeyValueEntity.get_by_id(
+                'usage.%s.s24' % usage_id).fields)
+
+    def test_rest_handler_starts_migration(self):
+        actions.login('admin@example.com', is_admin=True)
+        xsrf_token = utils.XsrfTokenManager.create_xsrf_token(
+            xblock_module.PackedFieldMigrationRESTHandler.XSRF_TOKEN)
+        request = {
+            'key': '',
+            'payload': transforms.dumps({}),
+            'xsrf_token': xsrf_token}
+
+        response = self.put(
+            'rest/xblock_packed_field_migration',
+            {'request': transforms.dumps(request)})
+        resp_dict = transforms.loads(response.body)
+        self.assertEqual(412, resp_dict['status'])
+
+        self._enable_packed_storage()
+        response = self.put(
+            'rest/xblock_packed_field_migration',
+            {'request': transforms.dumps(request)})
+        resp_dict = transforms.loads(response.body)
+        self.assertEqual(200, resp_dict['status'])
+        self.assertTrue(
+            xblock_module.PackedFieldMigrationJob(
+                sites.get_all_courses()[0]).is_active())
+
+
 class XBlockTagTestCase(TestBase):
     """Functional tests for the XBlock tag."""
 